@@ -0,0 +1,92 @@
+"""
+Measures simulated ticks per second and round trips per simulated tick
+against a local stand-in server with simulated network latency, for
+several action_repeat settings.
+
+    $ python benchmarks/bench_action_repeat.py --latency 0.001
+"""
+import argparse
+import asyncio
+import time
+
+from google.protobuf.descriptor_pb2 import DescriptorProto
+from google.protobuf.descriptor_pb2 import FieldDescriptorProto
+
+from bonsai.brain_server_connection import BrainServerConnection
+from bonsai.loopback import LoopbackBrain, constant_policy
+from bonsai.simulator import Simulator
+from bonsai.stand_in_server import StandInServer
+
+
+def make_schema(name, field_names):
+    schema = DescriptorProto()
+    schema.name = name
+    for number, field_name in enumerate(field_names, 1):
+        field = schema.field.add()
+        field.name = field_name
+        field.number = number
+        field.type = FieldDescriptorProto.TYPE_FLOAT
+        field.label = FieldDescriptorProto.LABEL_OPTIONAL
+    return schema
+
+
+class FineTimestepSimulator(Simulator):
+    def __init__(self):
+        super().__init__()
+        self.ticks = 0
+        self.x = 0.0
+
+    def set_prediction(self, a):
+        self.ticks += 1
+        self.x += 0.001 * a
+
+    def get_state(self):
+        return {'x': self.x}
+
+    def reward(self):
+        return -abs(self.x)
+
+    def get_terminal(self):
+        return False
+
+
+async def run(action_repeat, args):
+    prediction_schema = make_schema('prediction', ['a'])
+
+    def brain_factory():
+        return LoopbackBrain(
+            make_schema('properties', []), make_schema('output', ['x']),
+            prediction_schema, {}, 'reward',
+            constant_policy(prediction_schema, 1.0),
+            args.episode_length, args.episodes)
+
+    server = StandInServer(brain_factory, latency=args.latency)
+    await server.start()
+    simulator = FineTimestepSimulator()
+    connection = BrainServerConnection(
+        server.url, "bench", simulator, action_repeat=action_repeat)
+    begin = time.perf_counter()
+    await connection.run_until_complete()
+    elapsed = time.perf_counter() - begin
+    await server.close()
+    round_trips = server.brains[0].messages
+    print("action_repeat={}: {:.0f} ticks/s, {:.3f} round trips/tick".format(
+        action_repeat, simulator.ticks / elapsed,
+        round_trips / simulator.ticks))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--episodes", type=int, default=5)
+    parser.add_argument("--episode-length", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.001)
+    parser.add_argument("--repeats", type=int, nargs="+", default=[1, 4, 8])
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    for action_repeat in args.repeats:
+        loop.run_until_complete(run(action_repeat, args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Measures the throughput of CurveGenerator, rendering and serializing
+MNIST-sized samples: one at a time through next_data() and the output
+schema, and --batch-size at a time through next_data_batch() and a
+compiled batch serializer, with and without numpy. Each path reports
+its best of --repeat runs.
+
+    $ python benchmarks/bench_curve_generator.py --samples 5000
+"""
+import argparse
+import time
+from unittest import mock
+
+from google.protobuf.descriptor_pb2 import DescriptorProto
+
+from bonsai import curve_generator
+from bonsai.brain_server_connection import BrainServerConnection
+from bonsai.common.message_builder import MessageBuilder
+from bonsai.common.state_to_proto import compile_batch_serializer
+from bonsai.curve_generator import CurveGenerator
+from bonsai.proto.curve_generator_pb2 import MNIST_training_data_schema
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--samples", type=int, default=5000)
+    parser.add_argument("--size", type=int, default=28)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=256)
+    args = parser.parse_args()
+
+    generator = CurveGenerator(args.size, args.size, seed=0)
+    connection = BrainServerConnection(
+        "ws://localhost/v1/bench/bench/sims/ws", "bench", generator)
+    output_schema = DescriptorProto()
+    MNIST_training_data_schema.DESCRIPTOR.CopyToProto(output_schema)
+    connection.output_schema = MessageBuilder().reconstitute(output_schema)
+    serialize_batch = compile_batch_serializer(connection.output_schema)
+    batches = args.samples // args.batch_size
+
+    def sample_path():
+        for _ in range(args.samples):
+            connection.get_next_data_message().SerializeToString()
+
+    def batch_path():
+        for _ in range(batches):
+            serialize_batch(generator.next_data_batch(args.batch_size))
+
+    paths = [("next_data", sample_path, args.samples),
+             ("next_data_batch", batch_path, batches * args.batch_size)]
+    for with_numpy in (True, False):
+        if with_numpy and curve_generator.numpy is None:
+            print("numpy is not installed")
+            continue
+        with mock.patch.object(curve_generator, 'numpy',
+                               curve_generator.numpy if with_numpy else None):
+            for name, run, count in paths:
+                elapsed = float('inf')
+                for _ in range(args.repeat):
+                    begin = time.perf_counter()
+                    run()
+                    elapsed = min(elapsed, time.perf_counter() - begin)
+                print("{:<32} {:8.0f} samples/s".format(
+                    "{}, {}".format(
+                        name, "numpy" if with_numpy else "pure python"),
+                    count / elapsed))
+
+
+if __name__ == '__main__':
+    main()
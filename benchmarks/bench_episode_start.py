@@ -0,0 +1,92 @@
+"""
+Compares episode throughput for a simulator with an expensive start()
+when episodes begin with start() versus restoring a snapshot taken
+after the first start().
+
+    $ python benchmarks/bench_episode_start.py --warmup-ticks 20000
+"""
+import argparse
+import copy
+import time
+
+from google.protobuf.descriptor_pb2 import DescriptorProto
+from google.protobuf.descriptor_pb2 import FieldDescriptorProto
+
+from bonsai.loopback import LoopbackDriver
+from bonsai.simulator import Simulator
+
+
+def make_schema(name, field_names):
+    schema = DescriptorProto()
+    schema.name = name
+    for number, field_name in enumerate(field_names, 1):
+        field = schema.field.add()
+        field.name = field_name
+        field.number = number
+        field.type = FieldDescriptorProto.TYPE_FLOAT
+        field.label = FieldDescriptorProto.LABEL_OPTIONAL
+    return schema
+
+
+class WarmupSimulator(Simulator):
+    def __init__(self, warmup_ticks):
+        super().__init__()
+        self.warmup_ticks = warmup_ticks
+        self.world = None
+        self.restore_seconds = []
+
+    def start(self):
+        # Stands in for building a world and running warm-up ticks.
+        world = [0.0] * 64
+        for tick in range(self.warmup_ticks):
+            world[tick % 64] += 0.5
+        self.world = world
+
+    def snapshot(self):
+        return copy.deepcopy(self.world)
+
+    def restore(self, snapshot):
+        begin = time.perf_counter()
+        self.world = list(snapshot)
+        self.restore_seconds.append(time.perf_counter() - begin)
+
+    def set_prediction(self, a):
+        self.world[0] += a
+
+    def get_state(self):
+        return {'x': self.world[0]}
+
+    def reward(self):
+        return 0.0
+
+    def get_terminal(self):
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--episodes", type=int, default=100)
+    parser.add_argument("--episode-length", type=int, default=10)
+    parser.add_argument("--warmup-ticks", type=int, default=20000)
+    args = parser.parse_args()
+
+    for restore_snapshots in (False, True):
+        simulator = WarmupSimulator(args.warmup_ticks)
+        driver = LoopbackDriver(
+            simulator, make_schema('properties', []),
+            make_schema('output', ['x']), make_schema('prediction', ['a']),
+            reward_name='reward', policy='constant',
+            episode_length=args.episode_length,
+            connection_options={'restore_snapshots': restore_snapshots})
+        result = driver.run(args.episodes)
+        line = "restore_snapshots={}: {:.1f} episodes/s".format(
+            restore_snapshots, result.episodes / result.elapsed)
+        if simulator.restore_seconds:
+            line += ", mean restore {:.1f} us".format(
+                1e6 * sum(simulator.restore_seconds) /
+                len(simulator.restore_seconds))
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
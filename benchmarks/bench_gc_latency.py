@@ -0,0 +1,179 @@
+"""
+Measures step latency in prediction mode with and without
+low_latency_gc. A stand-in server in a child process times the round
+trip from each PREDICTION it sends to the STATE that follows. The
+simulator keeps a large long-lived heap, makes cyclic garbage every step
+and retains a little of it, so full collections happen and their pauses
+show up in the tail latencies. Steps right after a terminal state, where
+low_latency_gc runs deferred full collections, are reported separately.
+
+    $ python benchmarks/bench_gc_latency.py --episodes 20
+"""
+import argparse
+import asyncio
+import multiprocessing
+import time
+
+from google.protobuf.descriptor_pb2 import DescriptorProto
+from google.protobuf.descriptor_pb2 import FieldDescriptorProto
+
+from bonsai.brain_server_connection import BrainServerConnection
+from bonsai.gc_control import GcControl
+from bonsai.loopback import LoopbackBrain, constant_policy
+from bonsai.simulator import Simulator
+from bonsai.stand_in_server import StandInServer
+
+
+def make_schema(name, field_names):
+    schema = DescriptorProto()
+    schema.name = name
+    for number, field_name in enumerate(field_names, 1):
+        field = schema.field.add()
+        field.name = field_name
+        field.number = number
+        field.type = FieldDescriptorProto.TYPE_FLOAT
+        field.label = FieldDescriptorProto.LABEL_OPTIONAL
+    return schema
+
+
+PROPERTIES_SCHEMA = make_schema('properties', [])
+OUTPUT_SCHEMA = make_schema('output', ['x', 'y'])
+PREDICTION_SCHEMA = make_schema('prediction', ['a'])
+
+
+class TimedBrain(LoopbackBrain):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # (latency, whether the previous state was terminal) pairs.
+        self.latencies = []
+        self._sent = None
+        self._after_terminal = False
+
+    def respond(self, from_simulator_bytes):
+        now = time.perf_counter()
+        if self._sent is not None:
+            self.latencies.append((now - self._sent, self._after_terminal))
+        episodes = self.episodes
+        responses = super().respond(from_simulator_bytes)
+        self._after_terminal = self.episodes != episodes
+        self._sent = None
+        if self.phase == "predicting":
+            self._sent = time.perf_counter()
+        return responses
+
+
+class GarbageSimulator(Simulator):
+    def __init__(self, heap_objects, garbage, retain, episode_length):
+        super().__init__()
+        self.heap = [{'index': i, 'values': [i]} for i in range(heap_objects)]
+        self.garbage = garbage
+        self.retain = retain
+        self.history = []
+        self.episode_length = episode_length
+        self.steps = 0
+        self.x = 0.0
+
+    def set_prediction(self, a):
+        if self.steps >= self.episode_length:
+            self.steps = 0
+        self.steps += 1
+        self.x += a
+        for _ in range(self.garbage):
+            node = {}
+            node['self'] = node
+        for _ in range(self.retain):
+            self.history.append([self.x])
+
+    def get_state(self):
+        return {'x': self.x, 'y': float(self.steps)}
+
+    def reward(self):
+        return 0.0
+
+    def get_terminal(self):
+        return self.steps >= self.episode_length
+
+
+def serve(results, args):
+    def brain_factory():
+        return TimedBrain(
+            PROPERTIES_SCHEMA, OUTPUT_SCHEMA, PREDICTION_SCHEMA, {},
+            'reward', constant_policy(PREDICTION_SCHEMA, 1.0),
+            args.episode_length, args.episodes)
+
+    async def run():
+        server = StandInServer(brain_factory)
+        await server.start()
+        results.put(server.prediction_url)
+        while not (server.brains and server.brains[-1].phase == "finished"):
+            await asyncio.sleep(0.05)
+        await server.close()
+        results.put(server.brains[-1].latencies)
+
+    asyncio.new_event_loop().run_until_complete(run())
+
+
+def measure(args, low_latency_gc):
+    results = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(results, args))
+    server.start()
+    url = results.get()
+
+    simulator = GarbageSimulator(
+        args.heap_objects, args.garbage, args.retain, args.episode_length)
+    connection = BrainServerConnection(
+        url, "bench", simulator, low_latency_gc=low_latency_gc)
+    pauses = connection.gc_control
+    if pauses is None:
+        pauses = GcControl()
+        pauses.measure()
+    try:
+        asyncio.get_event_loop().run_until_complete(
+            connection.run_until_complete())
+    except Exception:
+        pass
+    report = pauses.report()
+    pauses.close()
+
+    latencies = results.get()
+    server.join()
+    return latencies, report
+
+
+def summary(latencies):
+    latencies = sorted(latencies)
+
+    def percentile(fraction):
+        index = min(len(latencies) - 1, int(fraction * len(latencies)))
+        return 1e3 * latencies[index]
+    return "{} steps, p50 {:.3f} ms, p99 {:.3f} ms, p99.9 {:.3f} ms, " \
+        "max {:.3f} ms".format(len(latencies), percentile(0.5),
+                               percentile(0.99), percentile(0.999),
+                               1e3 * latencies[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--episodes", type=int, default=20)
+    parser.add_argument("--episode-length", type=int, default=500)
+    parser.add_argument("--heap-objects", type=int, default=300000)
+    parser.add_argument("--garbage", type=int, default=200,
+                        help="cyclic objects made per step")
+    parser.add_argument("--retain", type=int, default=20,
+                        help="objects kept per step")
+    args = parser.parse_args()
+
+    # The connection logs an error when the server closes a finished
+    # prediction session; that is expected here.
+    for low_latency_gc in (False, True):
+        latencies, report = measure(args, low_latency_gc)
+        print("low_latency_gc={}".format(low_latency_gc))
+        print("  in episode:     " + summary(
+            [latency for latency, after in latencies if not after]))
+        print("  after terminal: " + summary(
+            [latency for latency, after in latencies if after]))
+        print("  " + report.replace("\n", "\n  "))
+
+
+if __name__ == '__main__':
+    main()
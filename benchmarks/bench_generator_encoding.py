@@ -0,0 +1,107 @@
+"""
+Compares generator data encoding through the output schema received at
+registration against the former hardcoded MNIST_training_data_schema
+path, for MNIST-sized samples, and splitting next_data_batch() style
+batches of --batch-size samples into messages. Each path reports its
+best of --repeat runs.
+
+    $ python benchmarks/bench_generator_encoding.py --samples 5000
+"""
+import argparse
+import random
+import time
+
+from google.protobuf.descriptor_pb2 import DescriptorProto
+
+from bonsai.brain_server_connection import BrainServerConnection
+from bonsai.common.message_builder import MessageBuilder
+from bonsai.common.state_to_proto import compile_batch_serializer
+from bonsai.generator import Generator
+from bonsai.inkling_types import Luminance, LuminanceBatch
+from bonsai.proto.curve_generator_pb2 import MNIST_training_data_schema
+
+
+class SampleGenerator(Generator):
+    def __init__(self, samples):
+        super().__init__()
+        self.samples = samples
+        self.index = 0
+
+    def next_data(self):
+        sample = self.samples[self.index % len(self.samples)]
+        self.index += 1
+        return sample
+
+
+def encode_mnist(next_data):
+    # The encoding previously hardcoded in get_next_data_message.
+    next_data_message = MNIST_training_data_schema()
+    next_data_message.label = next_data["label"]
+    next_data_message.image.width = next_data["image"].width
+    next_data_message.image.height = next_data["image"].height
+    next_data_message.image.pixels = next_data["image"].pixels
+    return next_data_message
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--samples", type=int, default=5000)
+    parser.add_argument("--size", type=int, default=28)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=256)
+    args = parser.parse_args()
+
+    size = args.size
+    samples = [{'label': random.randrange(10),
+                'image': Luminance(size, size,
+                                   [random.random()] * size * size)}
+               for _ in range(100)]
+    generator = SampleGenerator(samples)
+    connection = BrainServerConnection(
+        "ws://localhost/v1/bench/bench/sims/ws", "bench", generator)
+    output_schema = DescriptorProto()
+    MNIST_training_data_schema.DESCRIPTOR.CopyToProto(output_schema)
+    connection.output_schema = MessageBuilder().reconstitute(output_schema)
+
+    def mnist_path():
+        for _ in range(args.samples):
+            encode_mnist(generator.next_data()).SerializeToString()
+
+    def schema_path():
+        for _ in range(args.samples):
+            connection.get_next_data_message().SerializeToString()
+
+    def batch_path():
+        connection.encode_data_batch(
+            [generator.next_data() for _ in range(args.samples)])
+
+    # A batch as next_data_batch() returns it: labels and the images
+    # stacked in one pixel buffer.
+    batch_samples = [samples[i % len(samples)]
+                     for i in range(args.batch_size)]
+    batch = {'label': [sample['label'] for sample in batch_samples],
+             'image': LuminanceBatch(size, size, b''.join(
+                 sample['image'].pixels for sample in batch_samples))}
+    serialize_batch = compile_batch_serializer(connection.output_schema)
+
+    def next_data_batch_path():
+        for _ in range(args.samples // args.batch_size):
+            serialize_batch(batch)
+
+    for name, run in [("hardcoded MNIST", mnist_path),
+                      ("output schema", schema_path),
+                      ("output schema, batch", batch_path),
+                      ("next_data_batch", next_data_batch_path)]:
+        elapsed = float('inf')
+        for _ in range(args.repeat):
+            begin = time.perf_counter()
+            run()
+            elapsed = min(elapsed, time.perf_counter() - begin)
+        count = args.samples
+        if run is next_data_batch_path:
+            count -= args.samples % args.batch_size
+        print("{:<22} {:8.0f} samples/s".format(name, count / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Measures how long importing the bonsai package and the connection
+module takes in a fresh interpreter, and fails if either exceeds a
+budget or if importing the connection module imports the modules behind
+its opt-in options. On Python
+3.7 and later the times come from -X importtime; earlier versions time
+the import statement itself.
+
+    $ python benchmarks/bench_import_time.py --runs 10 --budget-ms 20 \
+        --connection-budget-ms 200
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+
+# Statements checked against the package budget, and against the
+# connection budget. The connection module pulls in websockets and
+# protobuf, but none of the modules behind its opt-in options.
+BUDGETED = ["import bonsai", "from bonsai import Simulator"]
+CONNECTION_BUDGETED = ["import bonsai.brain_server_connection"]
+OPT_IN_MODULES = ["bonsai.trajectory", "bonsai.common.field_accounting",
+                  "bonsai.memory_telemetry", "tracemalloc",
+                  "bonsai.gc_control", "bonsai.server_capture"]
+
+_IMPORTTIME_LINE = re.compile(
+    r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def _environment():
+    # Import bonsai from this checkout rather than an installed copy.
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = os.pathsep.join(
+        [root] + [p for p in [environment.get('PYTHONPATH')] if p])
+    return environment
+
+
+def _top_level_imports(statement):
+    """
+    Runs statement with -X importtime and returns the name and
+    cumulative microseconds of each least indented import.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        stderr=subprocess.PIPE, universal_newlines=True, check=True,
+        env=_environment())
+    lines = [_IMPORTTIME_LINE.match(line)
+             for line in result.stderr.splitlines()]
+    lines = [match for match in lines if match]
+    depth = min(len(match.group(3)) for match in lines)
+    return [(match.group(4), int(match.group(2))) for match in lines
+            if len(match.group(3)) == depth]
+
+
+def import_time_ms(statement):
+    """
+    Returns the milliseconds spent importing in statement, run in a new
+    interpreter.
+    """
+    if sys.version_info >= (3, 7):
+        # Modules imported directly by the statement are the least
+        # indented lines, and their cumulative times add up to the
+        # statement's import time. Modules the interpreter imports at
+        # startup are reported too, and are left out.
+        startup = set(name for name, _ in _top_level_imports("pass"))
+        return sum(cumulative for name, cumulative
+                   in _top_level_imports(statement)
+                   if name not in startup) / 1000.0
+
+    program = ("import time\n"
+               "begin = time.perf_counter()\n"
+               "{}\n"
+               "print(time.perf_counter() - begin)\n").format(statement)
+    output = subprocess.check_output(
+        [sys.executable, "-c", program], universal_newlines=True,
+        env=_environment())
+    return float(output) * 1000.0
+
+
+def eager_opt_in_modules():
+    """
+    Returns the opt-in modules that importing the connection module
+    imports, in a new interpreter.
+    """
+    program = ("import sys\n"
+               "import bonsai.brain_server_connection\n"
+               "print(' '.join(name for name in {!r}\n"
+               "               if name in sys.modules))").format(
+                   OPT_IN_MODULES)
+    output = subprocess.check_output(
+        [sys.executable, "-c", program], universal_newlines=True,
+        env=_environment())
+    return output.split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--budget-ms", type=float, default=20.0)
+    parser.add_argument("--connection-budget-ms", type=float,
+                        default=200.0)
+    args = parser.parse_args()
+
+    budgets = [(statement, args.budget_ms) for statement in BUDGETED]
+    budgets += [(statement, args.connection_budget_ms)
+                for statement in CONNECTION_BUDGETED]
+    over_budget = []
+    for statement, budget_ms in budgets:
+        median = statistics.median(
+            import_time_ms(statement) for _ in range(args.runs))
+        if median > budget_ms:
+            over_budget.append(statement)
+            verdict = "over budget"
+        else:
+            verdict = "ok"
+        print("{:8.1f} ms  {:<40} {}".format(median, statement, verdict))
+
+    for statement in over_budget:
+        print("'{}' exceeds its budget".format(statement))
+    eager = eager_opt_in_modules()
+    if eager:
+        print("Importing the connection imports opt-in modules: {}".format(
+            ", ".join(eager)))
+    if over_budget or eager:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Measures the per-message overhead of the BrainServerConnection message
+loop using the in-process loopback driver. The simulator does no work,
+so the time per message is the cost of the SDK itself.
+
+    $ python benchmarks/bench_message_loop.py --episodes 200
+"""
+import argparse
+
+from google.protobuf.descriptor_pb2 import DescriptorProto
+from google.protobuf.descriptor_pb2 import FieldDescriptorProto
+
+from bonsai.brain_server_connection import set_event_loop_policy
+from bonsai.loopback import LoopbackDriver
+from bonsai.simulator import Simulator
+
+
+def make_schema(name, field_names):
+    schema = DescriptorProto()
+    schema.name = name
+    for number, field_name in enumerate(field_names, 1):
+        field = schema.field.add()
+        field.name = field_name
+        field.number = number
+        field.type = FieldDescriptorProto.TYPE_FLOAT
+        field.label = FieldDescriptorProto.LABEL_OPTIONAL
+    return schema
+
+
+class NullSimulator(Simulator):
+    def set_prediction(self, **kwargs):
+        pass
+
+    def get_state(self):
+        return {'x': 0.0, 'y': 0.0}
+
+    def reward(self):
+        return 0.0
+
+    def get_terminal(self):
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--episodes", type=int, default=200)
+    parser.add_argument("--episode-length", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--event-loop", choices=["asyncio", "uvloop"],
+                        default="asyncio")
+    args = parser.parse_args()
+
+    set_event_loop_policy(args.event_loop)
+
+    driver = LoopbackDriver(
+        NullSimulator(),
+        make_schema('properties', []),
+        make_schema('output', ['x', 'y']),
+        make_schema('prediction', ['a']),
+        reward_name='reward', policy='constant',
+        episode_length=args.episode_length)
+
+    best = None
+    for _ in range(args.repeat):
+        result = driver.run(args.episodes)
+        if best is None or result.elapsed < best.elapsed:
+            best = result
+    print("{} messages in {:.3f}s: {:.1f} us/message, "
+          "{:.0f} messages/s".format(
+              best.messages, best.elapsed,
+              1e6 * best.elapsed / best.messages,
+              best.messages_per_second))
+
+
+if __name__ == '__main__':
+    main()
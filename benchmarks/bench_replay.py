@@ -0,0 +1,113 @@
+"""
+Replays a captured server message stream to a simulator at full speed,
+to measure client side message handling against recorded traffic.
+
+Captures are made by passing capture_path to BrainServerConnection.
+Without --capture, a session against a local stand-in server is
+captured first.
+
+    $ python benchmarks/bench_replay.py
+    $ python benchmarks/bench_replay.py --capture session.cap \
+          --simulator my_package.my_module:MySimulator
+"""
+import argparse
+import asyncio
+import importlib
+import os
+import tempfile
+
+from google.protobuf.descriptor_pb2 import DescriptorProto
+from google.protobuf.descriptor_pb2 import FieldDescriptorProto
+
+from bonsai.brain_server_connection import BrainServerConnection
+from bonsai.loopback import LoopbackBrain, random_policy
+from bonsai.server_capture import ReplayDriver
+from bonsai.simulator import Simulator
+from bonsai.stand_in_server import StandInServer
+
+
+def make_schema(name, field_names):
+    schema = DescriptorProto()
+    schema.name = name
+    for number, field_name in enumerate(field_names, 1):
+        field = schema.field.add()
+        field.name = field_name
+        field.number = number
+        field.type = FieldDescriptorProto.TYPE_FLOAT
+        field.label = FieldDescriptorProto.LABEL_OPTIONAL
+    return schema
+
+
+class PendulumSimulator(Simulator):
+    def __init__(self):
+        super().__init__()
+        self.angle = 0.0
+
+    def reset(self):
+        self.angle = 0.0
+
+    def set_prediction(self, torque):
+        self.angle += 0.01 * torque
+
+    def get_state(self):
+        return {'angle': self.angle}
+
+    def upright(self):
+        return -abs(self.angle)
+
+    def get_terminal(self):
+        return abs(self.angle) > 1.0
+
+
+def capture_session(path, args):
+    prediction_schema = make_schema('prediction', ['torque'])
+
+    def brain_factory():
+        return LoopbackBrain(
+            make_schema('properties', []), make_schema('output', ['angle']),
+            prediction_schema, {}, 'upright',
+            random_policy(prediction_schema, 0), args.episode_length,
+            args.episodes)
+
+    async def run():
+        server = StandInServer(brain_factory)
+        await server.start()
+        connection = BrainServerConnection(
+            server.url, "bench", PendulumSimulator(), capture_path=path)
+        await connection.run_until_complete()
+        await server.close()
+
+    asyncio.get_event_loop().run_until_complete(run())
+
+
+def load_factory(spec):
+    module_name, _, name = spec.partition(':')
+    return getattr(importlib.import_module(module_name), name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--capture")
+    parser.add_argument("--simulator",
+                        help="module:callable returning the simulator")
+    parser.add_argument("--episodes", type=int, default=20)
+    parser.add_argument("--episode-length", type=int, default=200)
+    parser.add_argument("--timing", action="store_true",
+                        help="replay at the original message timing")
+    args = parser.parse_args()
+
+    path = args.capture
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), "session.cap")
+        capture_session(path, args)
+    factory = (load_factory(args.simulator) if args.simulator
+               else PendulumSimulator)
+
+    result = ReplayDriver(path, factory(), timing=args.timing).run()
+    print("{} messages, {} episodes in {:.3f} s: {:.0f} messages/s".format(
+        result.messages, result.episodes, result.elapsed,
+        result.messages_per_second))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,46 @@
-
 """The bonsai package contains the code necessary for users to author
 and connect their own custom generators and simulators with the bonsai
 brain system.
 """
+import importlib
+import sys
+import types
+
+# The following names are loaded from their respective modules the
+# first time they are accessed at the 'bonsai' package level, so that
+# 'import bonsai' does not import websockets, the protobuf modules or
+# numpy until they are needed.
+_LAZY_ATTRIBUTES = {
+    'BrainServerConnection': 'bonsai.brain_server_connection',
+    'parse_base_arguments': 'bonsai.brain_server_connection',
+    'run_for_training_or_prediction': 'bonsai.brain_server_connection',
+    'run_with_url': 'bonsai.brain_server_connection',
+    'Generator': 'bonsai.generator',
+    'AsyncSimulator': 'bonsai.simulator',
+    'Simulator': 'bonsai.simulator',
+    'VectorSimulator': 'bonsai.vector_simulator',
+    'run_vector_simulator': 'bonsai.vector_simulator',
+}
+
+__all__ = sorted(_LAZY_ATTRIBUTES)
+
+
+class _LazyModule(types.ModuleType):
+    # Module level __getattr__ needs Python 3.7, so the package module's
+    # class is swapped for one defining it instead.
+
+    def __getattr__(self, name):
+        module_name = _LAZY_ATTRIBUTES.get(name)
+        if module_name is None:
+            raise AttributeError(
+                "module '{}' has no attribute '{}'".format(
+                    self.__name__, name))
+        value = getattr(importlib.import_module(module_name), name)
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(super().__dir__()) | set(_LAZY_ATTRIBUTES))
+
 
-# The following classes are imported from their respective modules
-# so that they are available at the 'bonsai' package level.
-from bonsai.brain_server_connection import BrainServerConnection
-from bonsai.brain_server_connection import parse_base_arguments
-from bonsai.brain_server_connection import run_for_training_or_prediction
-from bonsai.brain_server_connection import run_with_url
-from bonsai.generator import Generator
-from bonsai.simulator import Simulator
+sys.modules[__name__].__class__ = _LazyModule
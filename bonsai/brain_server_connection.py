@@ -5,33 +5,112 @@ and generators that communicate with BRAIN backend.
 """
 import argparse
 import asyncio
+import gc
 import logging
+import operator
 import os
-from collections import namedtuple
+import random
+import time
+from collections import deque, namedtuple
 from urllib.parse import urlparse
 
 import websockets
 
-from bonsai.common.state_to_proto import convert_state_to_proto
+from bonsai.common.lru_cache import LRUCache
+from bonsai.common.state_to_proto import compile_batch_serializer
+from bonsai.common.state_to_proto import compile_message_decoder
+from bonsai.common.state_to_proto import compile_state_encoder
+from bonsai.common.state_to_proto import compile_state_serializer
 from bonsai.common.message_builder import MessageBuilder
 from bonsai.generator import Generator
-from bonsai.simulator import Simulator
+from bonsai.simulator import AsyncSimulator, Simulator
 from bonsai.proto.generator_simulator_api_pb2 import (
     SimulatorToServer, ServerToSimulator)
-from bonsai_config import BonsaiConfig
-
-# TODO: Once we support fully dynamic schemas for generators, we can
-# remove this.
-from bonsai.proto.curve_generator_pb2 import MNIST_training_data_schema
 
 
 log = logging.getLogger(__name__)
 
+# The trajectory recorder, field accounting, memory telemetry, garbage
+# collector control and the thread that prepares episodes are opt-in,
+# and their modules are imported only when their option is set, to keep
+# importing this module fast.
+
+# How rewards of repeated actions are combined, see action_repeat.
+_REWARD_ACCUMULATORS = {
+    "sum": operator.add,
+    "last": lambda accumulated, reward: reward,
+    "max": max,
+}
+
+
+def _state_data_view(to_server_bytes):
+    """
+    Returns a memoryview of the serialized state_data field within a
+    serialized SimulatorToServer message, found by walking the
+    top-level fields rather than re-encoding the field.
+    """
+    view = memoryview(to_server_bytes)
+    offset = 0
+    while offset < len(view):
+        key, offset = _read_varint(view, offset)
+        field_number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            _, offset = _read_varint(view, offset)
+        elif wire_type == 2:
+            length, offset = _read_varint(view, offset)
+            if field_number == 3:
+                return view[offset:offset + length]
+            offset += length
+        elif wire_type == 5:
+            offset += 4
+        elif wire_type == 1:
+            offset += 8
+        else:
+            break
+    return view[0:0]
+
+
+def _read_varint(view, offset):
+    value = 0
+    shift = 0
+    while True:
+        byte = view[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+
+
+def _properties_key(properties):
+    """
+    Returns a hashable key for a dictionary of decoded property values.
+    Repeated fields are converted to tuples.
+    """
+    key = []
+    for name in sorted(properties):
+        value = properties[name]
+        if not isinstance(value, (str, bytes)) and hasattr(value, '__iter__'):
+            value = tuple(value)
+        key.append((name, value))
+    return tuple(key)
+
 
 class BrainServerConnection:
 
-    def __init__(self, brain_api_url, simulator_name, simulator):
+    def __init__(self, brain_api_url, simulator_name, simulator,
+                 restore_snapshots=False, prepare_episodes=False,
+                 properties_cache_size=0, properties_cache_cost=None,
+                 action_repeat=1, reward_accumulation="sum",
+                 max_reconnect_attempts=0, reconnect_backoff=0.5,
+                 reconnect_backoff_max=30.0, trajectory_dir=None,
+                 capture_path=None, field_accounting=False,
+                 memoize_fields=False,
+                 memory_interval=0, memory_budget=None, trace_memory=False,
+                 low_latency_gc=False, data_batch_size=256,
+                 send_window=8):
         self._current_reward_name = None
+        self._reward_function = None
 
         parse_result = urlparse(brain_api_url)
         path_parts = parse_result.path.strip("/").split("/")
@@ -65,90 +144,505 @@ class BrainServerConnection:
         self.simulator_name = simulator_name
 
         # Ensure the simulator argument has the correct type
+        self.is_async_simulator = False
         if isinstance(simulator, Simulator):
             self.is_generator = False
+        elif isinstance(simulator, AsyncSimulator):
+            self.is_generator = False
+            self.is_async_simulator = True
         elif isinstance(simulator, Generator):
             self.is_generator = True
         else:
             raise TypeError(
                 "Argument 'simulator' must be an object of type "
-                "bonsai.Generator or bonsai.Simulator")
+                "bonsai.Generator, bonsai.Simulator or bonsai.AsyncSimulator")
         self.simulator = simulator
 
-    def handle_set_properties(self, set_properties_data):
+        # Prefer the fused get_state_reward_terminal() hook when the
+        # simulator overrides it.
+        base_class = AsyncSimulator if self.is_async_simulator else Simulator
+        self._uses_fused_step = (
+            not self.is_generator and
+            type(simulator).get_state_reward_terminal is not
+            base_class.get_state_reward_terminal)
+
+        # Generators that override next_encoded_data() provide
+        # serialized samples, which are sent without decoding.
+        self._uses_encoded_data = (
+            self.is_generator and
+            type(simulator).next_encoded_data is not
+            Generator.next_encoded_data)
+
+        # Otherwise, generators that override next_data_batch() provide
+        # data_batch_size samples at a time, which are split into
+        # messages together and queued in _data_batch.
+        self._uses_data_batches = (
+            self.is_generator and not self._uses_encoded_data and
+            type(simulator).next_data_batch is not
+            Generator.next_data_batch)
+        if data_batch_size < 1:
+            raise ValueError("data_batch_size must be at least 1")
+        self.data_batch_size = data_batch_size
+        self._data_batch = deque()
+
+        # Otherwise, generators that implement __aiter__() or a
+        # coroutine next_data() are awaited by a task fetching up to
+        # send_window samples ahead of sending them.
+        self._uses_async_data = (
+            self.is_generator and not self._uses_encoded_data and
+            not self._uses_data_batches and (
+                hasattr(simulator, '__aiter__') or
+                asyncio.iscoroutinefunction(simulator.next_data)))
+        if send_window < 1:
+            raise ValueError("send_window must be at least 1")
+        self.send_window = send_window
+        # Counts SET_PROPERTIES messages; samples are tagged with it when
+        # their fetch begins, so ones made with earlier properties are
+        # never sent, even if their fetch was under way.
+        self._properties_generation = 0
+
+        # With restore_snapshots, the state after the first start() is
+        # captured once and restored at RESET and START, skipping the
+        # simulator's own reset() and start().
+        if (restore_snapshots or properties_cache_size) and (
+                self.is_generator or
+                type(simulator).snapshot is base_class.snapshot or
+                type(simulator).restore is base_class.restore):
+            raise ValueError(
+                "restore_snapshots and properties_cache_size require a "
+                "simulator that implements snapshot() and restore()")
+        self.restore_snapshots = restore_snapshots
+        self._snapshot = None
+        self._snapshot_is_current = False
+
+        # With properties_cache_size, the simulator is snapshotted after
+        # each set_properties() and the snapshot cached under the
+        # property values, so a SET_PROPERTIES with values seen before
+        # restores it instead of configuring the simulator again. The
+        # cache holds snapshots costing up to properties_cache_size in
+        # total, where properties_cache_cost(properties, snapshot)
+        # gives each snapshot's cost, 1 by default.
+        if properties_cache_size:
+            self._properties_cache = LRUCache(properties_cache_size)
+        else:
+            self._properties_cache = None
+        self._properties_cache_cost = properties_cache_cost
+        self._properties_entry = None
+
+        # With action_repeat, each prediction is applied for that many
+        # simulator ticks, stopping early at a terminal state. Only the
+        # final state is sent, with the ticks' rewards combined by
+        # reward_accumulation: "sum", "last" or "max".
+        if action_repeat < 1:
+            raise ValueError("action_repeat must be at least 1")
+        if reward_accumulation not in _REWARD_ACCUMULATORS:
+            raise ValueError(
+                "reward_accumulation must be one of {}".format(
+                    ", ".join(sorted(_REWARD_ACCUMULATORS))))
+        self.action_repeat = action_repeat
+        self.reward_accumulation = reward_accumulation
+        self._accumulate_reward = _REWARD_ACCUMULATORS[reward_accumulation]
+        self._repeated_reward = None
+
+        # With prepare_episodes, the next episode is started in the
+        # background after SET_PROPERTIES, while the server round trips
+        # READY, so START only has to send the state. After RESET only
+        # reset() runs in the background; start() waits for START, or
+        # for the SET_PROPERTIES of a new lesson. Nothing is prepared
+        # after STOP, as the server normally follows it with RESET.
+        self.prepare_episodes = prepare_episodes and not self.is_generator
+        self._prepared_episode = None
+        self._prepared_start = False
+        self._executor = None
+
+        # With max_reconnect_attempts, a dropped connection is retried
+        # up to that many times in a row, waiting a random time of up to
+        # reconnect_backoff * 2 ** attempt seconds, capped at
+        # reconnect_backoff_max, before each attempt. The simulator and
+        # the schema classes are kept, and the session resumes with
+        # REGISTER. The seconds from each drop to the next
+        # ACKNOWLEDGE_REGISTER are appended to reconnect_downtimes.
+        self.max_reconnect_attempts = max_reconnect_attempts
+        self.reconnect_backoff = reconnect_backoff
+        self.reconnect_backoff_max = reconnect_backoff_max
+        self.reconnect_downtimes = []
+        self._reconnect_attempt = 0
+        self._dropped_at = None
+
+        # Schema classes by serialized schema, so the classes built for
+        # a schema are reused whenever the server sends it again.
+        self._schema_classes = {}
+
+        # The encoders, decoders and serializers compiled for each schema
+        # class. With memoize_fields, serializers reuse the bytes of
+        # embedded message fields, e.g. a static Luminance, while they
+        # are unchanged; see Simulator.get_state_versions().
+        self._codecs = {}
+        self._serializers = {}
+        self._batch_serializers = {}
+        self.memoize_fields = memoize_fields
+        self._uses_state_versions = (
+            memoize_fields and not self.is_generator and
+            type(simulator).get_state_versions is not
+            base_class.get_state_versions)
+
+        # With trajectory_dir, the serialized SimulationSourceData of
+        # every state sent is recorded there, see TrajectoryRecorder.
+        if trajectory_dir is not None and not self.is_generator:
+            from bonsai.trajectory import TrajectoryRecorder
+            self.trajectory_recorder = TrajectoryRecorder(trajectory_dir)
+        else:
+            self.trajectory_recorder = None
+
+        # With capture_path, every message received from the server is
+        # written there with its arrival time, for replay with
+        # bonsai.server_capture.ReplayDriver.
+        self.capture_path = capture_path
+        self._capture = None
+
+        # With field_accounting, the size and encode time of each field
+        # of the states and actions sent are accounted for, and a ranked
+        # report is logged when the connection closes.
+        if field_accounting:
+            from bonsai.common.field_accounting import FieldAccounting
+            self.field_accounting = FieldAccounting()
+        else:
+            self.field_accounting = None
+
+        # With memory_interval, the resident set size is logged every
+        # memory_interval messages and, with trace_memory, so are the
+        # allocation sites that grew, see MemoryTelemetry. Above
+        # memory_budget bytes, the connection is closed and the cached
+        # schemas, codecs and snapshots are dropped before reconnecting.
+        if memory_interval or memory_budget is not None:
+            from bonsai.memory_telemetry import MemoryTelemetry
+            self.memory_telemetry = MemoryTelemetry(
+                memory_interval or 1000, memory_budget, trace_memory)
+        else:
+            self.memory_telemetry = None
+        self.memory_rebuilds = 0
+
+        # With low_latency_gc, the garbage collector is kept out of the
+        # steps of an episode and runs at its boundaries, see GcControl.
+        # Collector pauses are logged when the connection closes.
+        if low_latency_gc and not self.is_generator:
+            from bonsai.gc_control import GcControl
+            self.gc_control = GcControl()
+        else:
+            self.gc_control = None
+
+    def _reconstitute_schema(self, schema):
+        key = schema.SerializeToString()
+        schema_class = self._schema_classes.get(key)
+        if schema_class is None:
+            schema_class = MessageBuilder().reconstitute(schema)
+            self._schema_classes[key] = schema_class
+        return schema_class
+
+    def _codec(self, schema_class):
+        """
+        Returns the (encoder, decoder) pair compiled for schema_class.
+        """
+        codec = self._codecs.get(schema_class)
+        if codec is None:
+            codec = (compile_state_encoder(schema_class),
+                     compile_message_decoder(schema_class))
+            self._codecs[schema_class] = codec
+        return codec
+
+    def _serializer(self, schema_class):
+        """
+        Returns the function serializing states as schema_class bytes.
+        """
+        serialize = self._serializers.get(schema_class)
+        if serialize is None:
+            serialize = compile_state_serializer(
+                schema_class, memoize=self.memoize_fields)
+            if self.field_accounting is not None:
+                serialize = self.field_accounting.instrument(
+                    schema_class, serialize)
+            self._serializers[schema_class] = serialize
+        return serialize
+
+    def _parse_set_properties(self, set_properties_data):
         log.debug("Received set_properties message")
 
-        # Parse request_data into a properties message.
-        properties_message = self.properties_schema()
-        properties_message.ParseFromString(
-            set_properties_data.dynamic_properties)
+        # Parse request_data into a dictionary of the property names
+        # to values.
+        decode = self._codec(self.properties_schema)[1]
+        properties = decode(set_properties_data.dynamic_properties)
 
-        # Create a dictionary of the property names to values.
-        properties = {}
-        for field in properties_message.DESCRIPTOR.fields:
-            properties[field.name] = getattr(properties_message, field.name)
+        # Properties may change the world, so drop any snapshot.
+        self._snapshot = None
+        self._snapshot_is_current = False
 
-        # Call set_properties on the simulator.
-        self.simulator.set_properties(**properties)
-
-        # Set current reward name.
+        # Set current reward name, and resolve its method once here
+        # rather than on every state message.
         self._current_reward_name = set_properties_data.reward_name
+        if self._current_reward_name and not self._uses_fused_step:
+            self._reward_function = getattr(
+                self.simulator, self._current_reward_name)
+        else:
+            self._reward_function = None
 
         # Set the predictions schema
-        self.prediction_schema = MessageBuilder().reconstitute(
+        self.prediction_schema = self._reconstitute_schema(
             set_properties_data.prediction_schema)
 
-    def handle_prediction(self, prediction_data):
-        log.debug("Received prediction message")
+        return properties
+
+    def _cache_properties_snapshot(self, properties, snapshot):
+        if self._properties_cache_cost is not None:
+            cost = self._properties_cache_cost(properties, snapshot)
+        else:
+            cost = 1
+        # The second item holds the episode snapshot once one is taken.
+        entry = [snapshot, None]
+        self._properties_cache.put(_properties_key(properties), entry, cost)
+        self._properties_entry = entry
+
+    def _restore_cached_properties(self, properties):
+        entry = self._properties_cache.get(_properties_key(properties))
+        self._properties_entry = entry
+        if entry is not None:
+            log.debug("Restoring cached simulator for properties %s",
+                      properties)
+            self._snapshot = entry[1]
+        return entry
+
+    def handle_set_properties(self, set_properties_data):
+        properties = self._parse_set_properties(set_properties_data)
+
+        if self._properties_cache is None:
+            # Call set_properties on the simulator.
+            self.simulator.set_properties(**properties)
+            return
+
+        entry = self._restore_cached_properties(properties)
+        if entry is not None:
+            self.simulator.restore(entry[0])
+            self.simulator.properties = properties
+        else:
+            self.simulator.set_properties(**properties)
+            self._cache_properties_snapshot(
+                properties, self.simulator.snapshot())
+
+    async def handle_set_properties_async(self, set_properties_data):
+        properties = self._parse_set_properties(set_properties_data)
 
-        # Parse request_data into a properties message.
-        predictions_msg = self.prediction_schema()
-        predictions_msg.ParseFromString(
-            prediction_data.dynamic_prediction)
+        if self._properties_cache is None:
+            # Await set_properties on the AsyncSimulator.
+            await self.simulator.set_properties(**properties)
+            return
+
+        entry = self._restore_cached_properties(properties)
+        if entry is not None:
+            await self.simulator.restore(entry[0])
+            self.simulator.properties = properties
+        else:
+            await self.simulator.set_properties(**properties)
+            self._cache_properties_snapshot(
+                properties, await self.simulator.snapshot())
 
-        # Create a dictionary of the property names to values.
-        predictions = {}
-        for field in predictions_msg.DESCRIPTOR.fields:
-            predictions[field.name] = getattr(predictions_msg, field.name)
+    def _parse_prediction(self, prediction_data):
+        log.debug("Received prediction message")
+
+        # Parse request_data into a dictionary of the prediction names
+        # to values.
+        decode = self._codec(self.prediction_schema)[1]
+        return decode(prediction_data.dynamic_prediction)
 
+    def handle_prediction(self, prediction_data):
+        predictions = self._parse_prediction(prediction_data)
         self.simulator.notify_prediction_received(predictions)
 
-    def get_state_message(self):
-        state = self.simulator.get_state()
+        # Apply repeats up to, but not including, the final tick, whose
+        # reward and terminal are read by get_state_message().
+        for _ in range(self.action_repeat - 1):
+            reward, terminal = self._get_reward_and_terminal()
+            if terminal:
+                return
+            self._add_repeated_reward(reward)
+            self.simulator.notify_prediction_received(predictions)
+
+    async def handle_prediction_async(self, prediction_data):
+        predictions = self._parse_prediction(prediction_data)
+        await self.simulator.notify_prediction_received(predictions)
+
+        for _ in range(self.action_repeat - 1):
+            reward, terminal = await self._get_reward_and_terminal_async()
+            if terminal:
+                return
+            self._add_repeated_reward(reward)
+            await self.simulator.notify_prediction_received(predictions)
 
-        if self._current_reward_name:
-            reward = getattr(self.simulator, self._current_reward_name)()
+    def _add_repeated_reward(self, reward):
+        if self._repeated_reward is None:
+            self._repeated_reward = reward
+        else:
+            self._repeated_reward = self._accumulate_reward(
+                self._repeated_reward, reward)
+
+    def _combine_repeated_reward(self, reward):
+        if self._repeated_reward is not None:
+            reward = self._accumulate_reward(self._repeated_reward, reward)
+            self._repeated_reward = None
+        return reward
+
+    def _get_reward_and_terminal(self):
+        if self._uses_fused_step:
+            _, reward, terminal = self.simulator.get_state_reward_terminal(
+                self._current_reward_name or None)
+            return reward or 0.0, terminal
+        if self._reward_function is not None:
+            reward = self._reward_function()
+        else:
+            reward = 0.0
+        return reward, self.simulator.get_terminal()
+
+    async def _get_reward_and_terminal_async(self):
+        if self._uses_fused_step:
+            _, reward, terminal = (
+                await self.simulator.get_state_reward_terminal(
+                    self._current_reward_name or None))
+            return reward or 0.0, terminal
+        if self._reward_function is not None:
+            reward = await self._reward_function()
         else:
             reward = 0.0
+        return reward, await self.simulator.get_terminal()
 
-        terminal = self.simulator.get_terminal()
-        state_message = self.output_schema()
-        convert_state_to_proto(state_message, state)
+    def _build_state_message(self, state, reward, terminal):
+        versions = None
+        if self._uses_state_versions:
+            versions = self.simulator.get_state_versions()
 
         to_server = SimulatorToServer()
         to_server.message_type = SimulatorToServer.STATE
-        to_server.state_data.state = state_message.SerializeToString()
+        to_server.state_data.state = self._serializer(self.output_schema)(
+            state, versions)
         to_server.state_data.reward = reward
         to_server.state_data.terminal = terminal
 
         # add action taken
         last_action = self.simulator.get_last_action()
         if last_action is not None:
-            actions_msg = self.prediction_schema()
-            convert_state_to_proto(actions_msg, last_action)
-            to_server.state_data.action_taken = actions_msg.SerializeToString()
+            to_server.state_data.action_taken = self._serializer(
+                self.prediction_schema)(last_action)
         return to_server
 
-    @asyncio.coroutine
-    def send_register(self, websocket):
+    def get_state_message(self):
+        if self._uses_fused_step:
+            state, reward, terminal = (
+                self.simulator.get_state_reward_terminal(
+                    self._current_reward_name or None))
+            if reward is None:
+                reward = 0.0
+        else:
+            state = self.simulator.get_state()
+
+            if self._reward_function is not None:
+                reward = self._reward_function()
+            else:
+                reward = 0.0
+
+            terminal = self.simulator.get_terminal()
+        reward = self._combine_repeated_reward(reward)
+        return self._build_state_message(state, reward, terminal)
+
+    async def get_state_message_async(self):
+        if self._uses_fused_step:
+            state, reward, terminal = (
+                await self.simulator.get_state_reward_terminal(
+                    self._current_reward_name or None))
+            if reward is None:
+                reward = 0.0
+        else:
+            state = await self.simulator.get_state()
+
+            if self._reward_function is not None:
+                reward = await self._reward_function()
+            else:
+                reward = 0.0
+
+            terminal = await self.simulator.get_terminal()
+        reward = self._combine_repeated_reward(reward)
+        return self._build_state_message(state, reward, terminal)
+
+    def _remember_episode_snapshot(self):
+        if self._properties_entry is not None:
+            self._properties_entry[1] = self._snapshot
+
+    def _start_episode(self):
+        if self._snapshot is None:
+            self.simulator.start()
+            if self.restore_snapshots:
+                self._snapshot = self.simulator.snapshot()
+                self._remember_episode_snapshot()
+        elif not self._snapshot_is_current:
+            self.simulator.restore(self._snapshot)
+        self._snapshot_is_current = False
+
+    async def _start_episode_async(self):
+        if self._snapshot is None:
+            await self.simulator.start()
+            if self.restore_snapshots:
+                self._snapshot = await self.simulator.snapshot()
+                self._remember_episode_snapshot()
+        elif not self._snapshot_is_current:
+            await self.simulator.restore(self._snapshot)
+        self._snapshot_is_current = False
+
+    def _reset_episode(self):
+        if self._snapshot is None:
+            self.simulator.reset()
+        else:
+            self.simulator.restore(self._snapshot)
+            self._snapshot_is_current = True
+
+    async def _reset_episode_async(self):
+        if self._snapshot is None:
+            await self.simulator.reset()
+        else:
+            await self.simulator.restore(self._snapshot)
+            self._snapshot_is_current = True
+
+    def _prepare_episode(self, reset=False):
+        # With reset, only reset() runs ahead, as the server may still
+        # send SET_PROPERTIES, which must be applied before start().
+        if self.is_async_simulator:
+            self._prepared_episode = asyncio.ensure_future(
+                self._reset_episode_async() if reset else
+                self._start_episode_async())
+        else:
+            if self._executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self._executor = ThreadPoolExecutor(max_workers=1)
+            self._prepared_episode = asyncio.get_event_loop().run_in_executor(
+                self._executor,
+                self._reset_episode if reset else self._start_episode)
+        self._prepared_start = not reset
+
+    async def _wait_for_prepared_episode(self):
+        """
+        Waits for any reset or start running in the background and
+        returns True if an episode was started.
+        """
+        prepared_episode, self._prepared_episode = (
+            self._prepared_episode, None)
+        if prepared_episode is None:
+            return False
+        await prepared_episode
+        return self._prepared_start
+
+    async def send_register(self, websocket):
         register = SimulatorToServer()
         register.message_type = SimulatorToServer.REGISTER
         register.register_data.simulator_name = self.simulator_name
-        yield from websocket.send(register.SerializeToString())
+        await websocket.send(register.SerializeToString())
 
-    @asyncio.coroutine
-    def recv_acknowledge_register(self, websocket):
-        from_server_bytes = yield from websocket.recv()
+    async def recv_acknowledge_register(self, websocket):
+        from_server_bytes = await websocket.recv()
         from_server = ServerToSimulator()
         from_server.ParseFromString(from_server_bytes)
 
@@ -164,37 +658,77 @@ class BrainServerConnection:
                 "not contain acknowledge_register_data.")
 
         # Reconstitute the simulator schemas.
-        self.properties_schema = MessageBuilder().reconstitute(
-            from_server.acknowledge_register_data.properties_schema)
-        self.output_schema = MessageBuilder().reconstitute(
-            from_server.acknowledge_register_data.output_schema)
-        self.prediction_schema = MessageBuilder().reconstitute(
-            from_server.acknowledge_register_data.prediction_schema)
-
-    @asyncio.coroutine
-    def send_ready(self, websocket):
+        data = from_server.acknowledge_register_data
+        self.properties_schema = self._reconstitute_schema(
+            data.properties_schema)
+        self.output_schema = self._reconstitute_schema(data.output_schema)
+        self.prediction_schema = self._reconstitute_schema(
+            data.prediction_schema)
+
+    async def _send_state(self, websocket, to_server):
+        data = to_server.SerializeToString()
+        if self.trajectory_recorder is not None:
+            self.trajectory_recorder.record(
+                _state_data_view(data), to_server.state_data.terminal)
+        await websocket.send(data)
+        # Collecting after sending overlaps with the server's response.
+        if self.gc_control is not None:
+            if to_server.state_data.terminal:
+                self.gc_control.boundary()
+            else:
+                self.gc_control.step()
+
+    async def _send_ready(self, websocket):
+        await self.send_ready(websocket)
+        if self.gc_control is not None:
+            self.gc_control.boundary()
+
+    async def send_ready(self, websocket):
         ready = SimulatorToServer()
         ready.message_type = SimulatorToServer.READY
-        yield from websocket.send(ready.SerializeToString())
+        await websocket.send(ready.SerializeToString())
+
+    async def handle_from_server(self, websocket, from_server):
+        is_async = self.is_async_simulator
+
+        # The simulator must not be touched while an episode is being
+        # prepared in the background, so every message waits for it
+        # first. START then only sends the state of the prepared one.
+        episode_prepared = await self._wait_for_prepared_episode()
 
-    @asyncio.coroutine
-    def handle_from_server(self, websocket, from_server):
         if from_server.message_type == ServerToSimulator.SET_PROPERTIES:
             if not from_server.HasField("set_properties_data"):
                 raise RuntimeError(
                     "Received a SET_PROPERTIES message that did "
                     "not contain set_properties_data.")
-            self.handle_set_properties(from_server.set_properties_data)
-            yield from self.send_ready(websocket)
+            if is_async:
+                await self.handle_set_properties_async(
+                    from_server.set_properties_data)
+            else:
+                self.handle_set_properties(from_server.set_properties_data)
+            if self.prepare_episodes:
+                self._prepare_episode()
+            await self._send_ready(websocket)
 
         elif from_server.message_type == ServerToSimulator.START:
-            self.simulator.start()
-            to_server = self.get_state_message()
-            yield from websocket.send(to_server.SerializeToString())
+            if self.trajectory_recorder is not None:
+                self.trajectory_recorder.start_episode()
+            if is_async:
+                if not episode_prepared:
+                    await self._start_episode_async()
+                to_server = await self.get_state_message_async()
+            else:
+                if not episode_prepared:
+                    self._start_episode()
+                to_server = self.get_state_message()
+            await self._send_state(websocket, to_server)
 
         elif from_server.message_type == ServerToSimulator.STOP:
-            self.simulator.stop()
-            yield from self.send_ready(websocket)
+            if is_async:
+                await self.simulator.stop()
+            else:
+                self.simulator.stop()
+            await self._send_ready(websocket)
 
         elif from_server.message_type == ServerToSimulator.PREDICTION:
             if not from_server.HasField("prediction_data"):
@@ -202,59 +736,87 @@ class BrainServerConnection:
                     "Received a PREDICTION message that did "
                     "not contain prediction_data.")
 
-            self.handle_prediction(from_server.prediction_data)
-            to_server = self.get_state_message()
-            yield from websocket.send(to_server.SerializeToString())
+            if is_async:
+                await self.handle_prediction_async(
+                    from_server.prediction_data)
+                to_server = await self.get_state_message_async()
+            else:
+                self.handle_prediction(from_server.prediction_data)
+                to_server = self.get_state_message()
+            await self._send_state(websocket, to_server)
 
         elif from_server.message_type == ServerToSimulator.RESET:
-            self.simulator_info.simulator.reset()
-            yield from self.send_ready(websocket)
+            if self.prepare_episodes:
+                self._prepare_episode(reset=True)
+            elif is_async:
+                await self._reset_episode_async()
+            else:
+                self._reset_episode()
+            await self._send_ready(websocket)
 
         else:
             raise RuntimeError(
                 "Cannot handle ServerToSimulator message with type {}".format(
                     from_server.message_type))
 
-    @asyncio.coroutine
-    def run_simulator_for_training(self, websocket):
+    async def run_simulator_for_training(self, websocket):
         # Start by sending a ready message to the server
         # TODO: T365: Exchange should start with register first
-        yield from self.send_ready(websocket)
+        await self.send_ready(websocket)
 
         message_count = 0
         while True:
             # Get a message from the server
-            from_server_bytes = yield from websocket.recv()
+            from_server_bytes = await websocket.recv()
             from_server = ServerToSimulator()
             from_server.ParseFromString(from_server_bytes)
 
             # Exit if it is a FINISHED message
             if from_server.message_type == ServerToSimulator.FINISHED:
+                await self._wait_for_prepared_episode()
                 log.info("Training is finished!")
                 return
 
             # Otherwise handle the message
-            yield from self.handle_from_server(websocket, from_server)
+            telemetry = self.memory_telemetry
+            if telemetry is not None:
+                phase = ServerToSimulator.MessageType.Name(
+                    from_server.message_type)
+                telemetry.before(phase)
+            await self.handle_from_server(websocket, from_server)
+            if telemetry is not None:
+                telemetry.after(phase)
 
             message_count += 1
             if message_count % 250 == 0:
                 log.info("Handled %i messages from the server so far",
                          message_count)
 
-    @asyncio.coroutine
-    def run_simulator_for_prediction(self, websocket):
+    async def run_simulator_for_prediction(self, websocket):
         num_predictions = 0
+        telemetry = self.memory_telemetry
         while True:
+            if telemetry is not None:
+                telemetry.before("PREDICTION")
 
             # Send state to the server
-            to_server = self.get_state_message()
-            yield from websocket.send(to_server.SerializeToString())
+            if self.is_async_simulator:
+                to_server = await self.get_state_message_async()
+            else:
+                to_server = self.get_state_message()
+            await self._send_state(websocket, to_server)
 
             # Get a prediction back from the server
-            from_server_bytes = yield from websocket.recv()
+            from_server_bytes = await websocket.recv()
             from_server = ServerToSimulator()
             from_server.ParseFromString(from_server_bytes)
-            self.handle_prediction(from_server.prediction_data)
+            if self.is_async_simulator:
+                await self.handle_prediction_async(
+                    from_server.prediction_data)
+            else:
+                self.handle_prediction(from_server.prediction_data)
+            if telemetry is not None:
+                telemetry.after("PREDICTION")
 
             num_predictions += 1
             if num_predictions % 250 == 0:
@@ -266,36 +828,134 @@ class BrainServerConnection:
                 "Method get_next_data_message should only be called when a "
                 "generator is being used.")
 
-        next_data = self.simulator.next_data()
-
-        # TODO: We don't support fully dynamic schemas for
-        # generators yet. All of our current generators
-        # currently use the same schema, so we hardcode it here.
-        # It's also harcoded in learnerd in
-        # BatchTrainer._collate_batch_data().
-        next_data_message = MNIST_training_data_schema()
-        next_data_message.label = next_data["label"]
-        next_data_message.image.width = next_data["image"].width
-        next_data_message.image.height = next_data["image"].height
-        next_data_message.image.pixels = next_data["image"].pixels
-        return next_data_message
-
-    @asyncio.coroutine
-    def run_generator_for_training(self, websocket):
+        # Generator data is encoded with the output schema received at
+        # registration, e.g. the MNIST training data schema.
+        encode = self._codec(self.output_schema)[0]
+        return encode(self.simulator.next_data())
+
+    def _next_batched_data(self):
+        if not self._data_batch:
+            batch = self.simulator.next_data_batch(self.data_batch_size)
+            serialize_batch = self._batch_serializers.get(self.output_schema)
+            if serialize_batch is None:
+                serialize_batch = compile_batch_serializer(self.output_schema)
+                self._batch_serializers[self.output_schema] = serialize_batch
+            self._data_batch.extend(serialize_batch(batch))
+            if not self._data_batch:
+                raise StopIteration
+        return self._data_batch.popleft()
+
+    async def _fetch_async_data(self, window):
+        """
+        Puts (generation, sample, None) triples from an asynchronous
+        generator into the window queue, waiting while it is full, and
+        finally a (None, None, exception) triple when the generator ends
+        or fails. generation is the properties generation when the fetch
+        of sample began.
+        """
+        if hasattr(self.simulator, '__aiter__'):
+            fetch = self.simulator.__aiter__().__anext__
+        else:
+            fetch = self.simulator.next_data
+        try:
+            while True:
+                generation = self._properties_generation
+                sample = await fetch()
+                await window.put((generation, sample, None))
+        except StopAsyncIteration:
+            await window.put((None, None, StopIteration()))
+        except Exception as e:
+            await window.put((None, None, e))
+
+    async def _next_fetched_data(self, window):
+        """
+        Returns the next (sample, None) pair in the window made with the
+        current properties, skipping older ones, or the
+        (None, exception) pair ending the window.
+        """
+        while True:
+            generation, sample, error = await window.get()
+            if (error is not None or
+                    generation == self._properties_generation):
+                return sample, error
+
+    def _drop_fetched_data(self, window):
+        # A sample still being fetched or waiting for room in the window
+        # is skipped by _next_fetched_data() instead. Keeps the triple
+        # ending the window, if it was fetched already.
+        self._properties_generation += 1
+        end = None
+        while not window.empty():
+            fetched = window.get_nowait()
+            if fetched[2] is not None:
+                end = fetched
+        if end is not None:
+            window.put_nowait(end)
+
+    def encode_data_batch(self, samples):
+        """
+        Encodes a sequence of generator samples, each a dictionary of
+        output schema field names to values, and returns the serialized
+        messages.
+        """
+        if not self.is_generator:
+            raise RuntimeError(
+                "Method encode_data_batch should only be called when a "
+                "generator is being used.")
+        serialize = self._serializer(self.output_schema)
+        return [serialize(sample) for sample in samples]
+
+    async def run_generator_for_training(self, websocket):
         if not self.is_generator:
             raise RuntimeError(
                 "Method run_generator_for_training should only be called "
                 "when a generator is being used.")
 
+        window = None
+        fetch_task = None
+        if self._uses_async_data:
+            window = asyncio.Queue(maxsize=self.send_window)
+            fetch_task = asyncio.ensure_future(
+                self._fetch_async_data(window))
+        try:
+            await self._generator_loop(websocket, window)
+        finally:
+            if fetch_task is not None:
+                fetch_task.cancel()
+
+    async def _generator_loop(self, websocket, window):
         message_count = 0
+        telemetry = self.memory_telemetry
         while True:
+            if telemetry is not None:
+                telemetry.before("DATA")
 
             # Generators should just always send next data messages
-            to_server = self.get_next_data_message()
-            yield from websocket.send(to_server.SerializeToString())
+            try:
+                if self._uses_encoded_data:
+                    to_server_bytes = self.simulator.next_encoded_data()
+                elif self._uses_data_batches:
+                    to_server_bytes = self._next_batched_data()
+                elif window is not None:
+                    sample, error = await self._next_fetched_data(window)
+                    if error is not None:
+                        raise error
+                    to_server_bytes = self._serializer(
+                        self.output_schema)(sample)
+                else:
+                    to_server_bytes = self._serializer(
+                        self.output_schema)(self.simulator.next_data())
+            except StopIteration:
+                log.info("Generator %s has no more data",
+                         self.simulator_name)
+                return
+            # Waits while the transport's write buffer is full, and the
+            # fetch task waits while the window is full, so a slow
+            # connection stops the generator from running ahead.
+            await websocket.send(to_server_bytes)
 
             # Get a message from the server
-            from_server_bytes = yield from websocket.recv()
+            from_server_bytes = await websocket.recv()
             from_server = ServerToSimulator()
             from_server.ParseFromString(from_server_bytes)
 
@@ -308,17 +968,22 @@ class BrainServerConnection:
                         "Received a SET_PROPERTIES message that did "
                         "not contain set_properties_data.")
                 self.handle_set_properties(from_server.set_properties_data)
+                # Samples made with the previous properties are dropped.
+                self._data_batch.clear()
+                if window is not None:
+                    self._drop_fetched_data(window)
             elif from_server.message_type == ServerToSimulator.FINISHED:
                 log.info("Training is finished!")
                 return
+            if telemetry is not None:
+                telemetry.after("DATA")
 
             message_count += 1
             if message_count % 250 == 0:
                 log.info("Handled %i messages from the server so far",
                          message_count)
 
-    @asyncio.coroutine
-    def run_until_complete(self):
+    async def run_until_complete(self):
         if self.is_training and self.is_generator:
             log.info("Running generator %s for training",
                      self.simulator_name)
@@ -335,28 +1000,154 @@ class BrainServerConnection:
             log.error("Nothing to run!")
             return
 
-        log.info("About to connect to %s", self.brain_api_url)
-        websocket = yield from websockets.connect(self.brain_api_url)
+        try:
+            while True:
+                log.info("About to connect to %s", self.brain_api_url)
+                # Only failures to connect are retried here; an OSError
+                # from the simulator or the recorder is not a connection
+                # problem and propagates.
+                try:
+                    websocket = await websockets.connect(self.brain_api_url)
+                except (OSError,
+                        websockets.exceptions.InvalidHandshake) as e:
+                    if not await self._before_reconnect():
+                        raise
+                    log.error("Could not connect to '%s': %s",
+                              self.brain_api_url, e)
+                    continue
+                try:
+                    await self._run_session(websocket, run_coro)
+                    return
+                except websockets.exceptions.ConnectionClosed as e:
+                    log.error("Connection to '%s' is closed, code='%s', "
+                              "reason='%s'",
+                              self.brain_api_url, e.code, e.reason)
+                    if not await self._before_reconnect():
+                        return
+                except MemoryError as e:
+                    # MemoryBudgetExceeded can only come from memory
+                    # telemetry, which has imported its module.
+                    if self.memory_telemetry is None:
+                        raise
+                    from bonsai.memory_telemetry import MemoryBudgetExceeded
+                    if not isinstance(e, MemoryBudgetExceeded):
+                        raise
+                    log.warning("%s, reconnecting to '%s' with fresh state",
+                                e, self.brain_api_url)
+                    await self._rebuild()
+
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Releases the resources held between sessions: the thread that
+        prepares episodes, the trajectory recorder, the capture, memory
+        tracing and garbage collector control, and logs their reports.
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self.trajectory_recorder is not None:
+            self.trajectory_recorder.close()
+        if self._capture is not None:
+            self._capture.close()
+            self._capture = None
+        if self.field_accounting is not None:
+            log.info("Encoded fields, largest first:\n%s",
+                     self.field_accounting.report())
+        if self.memory_telemetry is not None:
+            log.info("Memory use:\n%s", self.memory_telemetry.report())
+            self.memory_telemetry.close()
+        if self.gc_control is not None:
+            log.info("Garbage collector pauses:\n%s",
+                     self.gc_control.report())
+            self.gc_control.close()
+
+    async def _run_session(self, websocket, run_coro):
+        if self.capture_path is not None:
+            from bonsai.server_capture import (
+                CapturingWebSocket, MessageCapture)
+            if self._capture is None:
+                self._capture = MessageCapture(
+                    self.capture_path, self.is_training)
+            websocket = CapturingWebSocket(websocket, self._capture)
 
         try:
 
             # The first step in all modes is to send a register message
             # and receive an aknowledge register message.
-            yield from self.send_register(websocket)
-            yield from self.recv_acknowledge_register(websocket)
+            await self.send_register(websocket)
+            await self.recv_acknowledge_register(websocket)
+
+            if self._dropped_at is not None:
+                downtime = time.monotonic() - self._dropped_at
+                self.reconnect_downtimes.append(downtime)
+                log.info("Reconnected to %s after %.3f seconds",
+                         self.brain_api_url, downtime)
+                self._dropped_at = None
+            self._reconnect_attempt = 0
+            if self.gc_control is not None:
+                self.gc_control.start()
 
             # Run the mode specific coroutine
-            yield from run_coro(websocket)
-
-        except websockets.exceptions.ConnectionClosed as e:
-            log.error("Connection to '%s' is closed, code='%s', reason='%s'",
-                      self.brain_api_url, e.code, e.reason)
+            await run_coro(websocket)
 
         finally:
-            yield from websocket.close()
-
-
-_BaseArguments = namedtuple('BaseArguments', ['brain_url', 'headless'])
+            await websocket.close()
+
+    async def _before_reconnect(self):
+        """
+        Waits out the backoff before the next reconnect attempt. Returns
+        False if no attempts are left.
+        """
+        if self._reconnect_attempt >= self.max_reconnect_attempts:
+            return False
+        if self._dropped_at is None:
+            self._dropped_at = time.monotonic()
+
+        # The episode in progress is lost with the connection; the
+        # server starts a new one after REGISTER.
+        await self._wait_for_prepared_episode()
+        self._repeated_reward = None
+
+        delay = random.uniform(0, min(
+            self.reconnect_backoff_max,
+            self.reconnect_backoff * 2 ** self._reconnect_attempt))
+        self._reconnect_attempt += 1
+        log.info("Reconnecting to %s in %.3f seconds (attempt %i of %i)",
+                 self.brain_api_url, delay, self._reconnect_attempt,
+                 self.max_reconnect_attempts)
+        await asyncio.sleep(delay)
+        return True
+
+    async def _rebuild(self):
+        """
+        Drops what the connection caches between messages, so the next
+        session rebuilds it, after the memory budget was exceeded. Raises
+        MemoryBudgetExceeded if that does not bring memory use back
+        under budget.
+        """
+        await self._wait_for_prepared_episode()
+        self._repeated_reward = None
+        self._schema_classes.clear()
+        self._codecs.clear()
+        self._serializers.clear()
+        self._batch_serializers.clear()
+        if self._properties_cache is not None:
+            self._properties_cache.clear()
+        self._properties_entry = None
+        self._snapshot = None
+        self._snapshot_is_current = False
+        if self.gc_control is not None:
+            self.gc_control.thaw()
+        gc.collect()
+        self.memory_rebuilds += 1
+        self.memory_telemetry.check_budget()
+
+
+_BaseArguments = namedtuple(
+    'BaseArguments', ['brain_url', 'headless', 'event_loop'])
 
 
 def parse_base_arguments():
@@ -381,6 +1172,10 @@ def parse_base_arguments():
         "The simulator can be run with or without the graphical environment."
         "By default the graphical environment is shown. Using --headless "
         "will run the simulator without graphical output.")
+    event_loop_help = (
+        "The event loop implementation used for the server connection. "
+        "Using --event-loop uvloop requires the uvloop package to be "
+        "installed; if it is not, the default asyncio loop is used.")
 
     brain_group = parser.add_mutually_exclusive_group(required=True)
     brain_group.add_argument("--train-brain", help=train_brain_help)
@@ -388,9 +1183,13 @@ def parse_base_arguments():
     brain_group.add_argument("--brain-url", help=brain_url_help)
     parser.add_argument("--predict-version", help=predict_version_help)
     parser.add_argument("--headless", help=headless_help, action="store_true")
+    parser.add_argument("--event-loop", help=event_loop_help,
+                        choices=["asyncio", "uvloop"], default="asyncio")
 
     args = parser.parse_args()
 
+    # Only the command line needs the user's configuration.
+    from bonsai_config import BonsaiConfig
     config = BonsaiConfig()
     partial_url = "ws://{host}:{port}/v1/{user}".format(
             host=config.host(),
@@ -419,12 +1218,42 @@ def parse_base_arguments():
                   "must be specified.")
         return
 
-    return _BaseArguments(brain_url, args.headless)
+    return _BaseArguments(brain_url, args.headless, args.event_loop)
+
+
+def set_event_loop_policy(event_loop):
+    """
+    Installs the asyncio event loop policy named by event_loop, either
+    "asyncio" or "uvloop", or an asyncio.AbstractEventLoopPolicy
+    instance. If uvloop is requested but not installed, the default
+    asyncio policy is kept and a warning is logged.
+    """
+    if event_loop is None or event_loop == "asyncio":
+        return
+    if event_loop == "uvloop":
+        try:
+            import uvloop
+        except ImportError:
+            log.warning("uvloop is not installed, using the default "
+                        "asyncio event loop.")
+            return
+        event_loop = uvloop.EventLoopPolicy()
+    elif not isinstance(event_loop, asyncio.AbstractEventLoopPolicy):
+        raise ValueError(
+            "Unknown event loop '{}', expected 'asyncio', 'uvloop' or an "
+            "event loop policy".format(event_loop))
+    asyncio.set_event_loop_policy(event_loop)
+
 
+def run_with_url(simulator_name, simulator, brain_url, event_loop=None,
+                 **connection_options):
+    # Select the event loop implementation, e.g. uvloop
+    set_event_loop_policy(event_loop)
 
-def run_with_url(simulator_name, simulator, brain_url):
-    # Create a connection to the brain server
-    server = BrainServerConnection(brain_url, simulator_name, simulator)
+    # Create a connection to the brain server. connection_options are
+    # passed through to BrainServerConnection, e.g. restore_snapshots.
+    server = BrainServerConnection(
+        brain_url, simulator_name, simulator, **connection_options)
 
     # Run until complete
     asyncio.get_event_loop().run_until_complete(server.run_until_complete())
@@ -441,4 +1270,5 @@ def run_for_training_or_prediction(simulator_name, simulator):
 
     base_arguments = parse_base_arguments()
     if base_arguments:
-        run_with_url(simulator_name, simulator, base_arguments.brain_url)
+        run_with_url(simulator_name, simulator, base_arguments.brain_url,
+                     base_arguments.event_loop)
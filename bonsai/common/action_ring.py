@@ -0,0 +1,82 @@
+"""
+Defines a lock-free ring buffer of timestamped actions, written by a
+simulator thread and read by the server connection.
+"""
+import logging
+import time
+
+
+log = logging.getLogger(__name__)
+
+
+class ActionRingBuffer:
+    """
+    Holds the last capacity (timestamp, action) entries appended by a
+    single producer thread, readable from another thread without locks.
+
+    Each slot holds an immutable (sequence, timestamp, action) tuple,
+    and the producer publishes an entry by bumping the write count only
+    after the slot is filled. Both are single reference assignments,
+    which are atomic in CPython, so a reader sees either the old or the
+    new entry of a slot, never a mix, and uses the sequence number to
+    skip slots overwritten while it was reading. Timestamps must not
+    decrease.
+    """
+
+    def __init__(self, capacity=64):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self._slots = [None] * capacity
+        self._written = 0
+
+    def append(self, action, timestamp=None):
+        """
+        Records that action took effect at timestamp, by default
+        time.monotonic(). Only one thread may call append().
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        sequence = self._written
+        self._slots[sequence % self.capacity] = (sequence, timestamp, action)
+        self._written = sequence + 1
+
+    def latest(self):
+        """
+        Returns the most recently appended action, or None.
+        """
+        written = self._written
+        if written == 0:
+            return None
+        return self._slots[(written - 1) % self.capacity][2]
+
+    def action_at(self, timestamp):
+        """
+        Returns the action in effect at timestamp: the newest retained
+        entry whose timestamp is not after it, or None if no action was
+        appended by then. If that entry was already overwritten, the
+        oldest entry still held is returned instead and a warning is
+        logged, as the ring is too small for the delay between actions
+        and states.
+        """
+        written = self._written
+        oldest = max(0, written - self.capacity)
+        held = None
+        for sequence in range(written - 1, oldest - 1, -1):
+            entry = self._slots[sequence % self.capacity]
+            if entry[0] != sequence:
+                # Overwritten by the producer since we started; every
+                # older slot is gone too.
+                break
+            if entry[1] <= timestamp:
+                return entry[2]
+            held = entry
+        else:
+            if oldest == 0:
+                return None
+        if held is None:
+            held = self._slots[(self._written - 1) % self.capacity]
+        log.warning("The action in effect at %s was overwritten; using "
+                    "the oldest one held, from %s. Increase the capacity "
+                    "of the action ring.", timestamp, held[1])
+        return held[2]
@@ -0,0 +1,61 @@
+"""
+Defines a least recently used cache bounded by the total cost of its
+entries.
+"""
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Maps keys to values, evicting the least recently used entries once
+    the sum of their costs exceeds max_cost. Every entry costs 1 unless
+    a cost is given to put(), so by default max_cost bounds the number
+    of entries.
+    """
+
+    def __init__(self, max_cost):
+        self.max_cost = max_cost
+        self.total_cost = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """
+        Returns the value for key, marking it as most recently used, or
+        default if key is not cached.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value, cost=1):
+        """
+        Caches value under key and evicts least recently used entries
+        until the total cost fits. A value whose cost alone exceeds
+        max_cost is not cached. Returns True if the value was cached.
+        """
+        self.discard(key)
+        if cost > self.max_cost:
+            return False
+        self._entries[key] = (value, cost)
+        self.total_cost += cost
+        while self.total_cost > self.max_cost:
+            _, (_, evicted_cost) = self._entries.popitem(last=False)
+            self.total_cost -= evicted_cost
+        return True
+
+    def discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_cost -= entry[1]
+
+    def clear(self):
+        self._entries.clear()
+        self.total_cost = 0
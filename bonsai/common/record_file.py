@@ -0,0 +1,25 @@
+"""
+This file contains the framing of the record files written by
+TrajectoryRecorder and write_shard: each record is a header holding its
+payload length and a tag, the episode index in trajectory segments,
+followed by the payload.
+"""
+import struct
+
+
+RECORD_HEADER = struct.Struct('<IQ')
+
+
+def read_record_headers(data):
+    """
+    Yields the payload offset, payload length and tag of each whole
+    record in data, a bytes-like object.
+    """
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        length, tag = RECORD_HEADER.unpack_from(data, offset)
+        start = offset + RECORD_HEADER.size
+        if start + length > len(data):
+            return
+        yield start, length, tag
+        offset = start + length
@@ -0,0 +1,99 @@
+"""
+Defines a single-producer, single-consumer ring buffer of messages held
+in shared memory, for passing data between processes without pickling.
+"""
+import multiprocessing
+import struct
+
+
+_LENGTH = struct.Struct('<I')
+
+
+class SharedRingBuffer:
+    """
+    A fixed number of fixed size slots in a shared memory block, with a
+    pair of semaphores tracking filled and free slots. Exactly one
+    process may put() and exactly one other process may get(); each side
+    keeps its own slot index, so no shared counters are needed.
+
+    The buffer is passed to a child process as a multiprocessing.Process
+    argument. Writers fill a slot in place through put_into(), and
+    readers get a memoryview onto the slot that stays valid until they
+    call release(), so large payloads are written once and never copied
+    through a pipe.
+    """
+
+    def __init__(self, slot_count=2, slot_size=1 << 20, context=None):
+        if slot_count < 1:
+            raise ValueError("slot_count must be at least 1")
+        context = context or multiprocessing.get_context()
+        self.slot_count = slot_count
+        self.slot_size = slot_size
+        self._stride = _LENGTH.size + slot_size
+        self._memory = context.RawArray('B', slot_count * self._stride)
+        self._filled = context.Semaphore(0)
+        self._free = context.Semaphore(slot_count)
+        self._put_index = 0
+        self._get_index = 0
+        self._view = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_view'] = None
+        return state
+
+    def _buffer(self):
+        if self._view is None:
+            self._view = memoryview(self._memory).cast('B')
+        return self._view
+
+    def put_into(self, size, write, timeout=None):
+        """
+        Reserves a slot for a message of size bytes and calls
+        write(buffer, offset) to fill it in place, where buffer is a
+        writable memoryview. Raises ValueError if size exceeds the slot
+        size and TimeoutError if no slot frees up within timeout.
+        """
+        if size > self.slot_size:
+            raise ValueError(
+                "Message of {} bytes does not fit in a {} byte slot".format(
+                    size, self.slot_size))
+        if not self._free.acquire(timeout=timeout):
+            raise TimeoutError("Timed out waiting for a free slot")
+        offset = (self._put_index % self.slot_count) * self._stride
+        buffer = self._buffer()
+        _LENGTH.pack_into(buffer, offset, size)
+        write(buffer, offset + _LENGTH.size)
+        self._put_index += 1
+        self._filled.release()
+
+    def put(self, data, timeout=None):
+        """
+        Copies the bytes-like object data into the next free slot.
+        """
+        size = len(data)
+
+        def write(buffer, offset):
+            buffer[offset:offset + size] = data
+        self.put_into(size, write, timeout)
+
+    def get(self, timeout=None):
+        """
+        Waits for the next message and returns a memoryview of it. The
+        view must not be used after release() is called.
+        """
+        if not self._filled.acquire(timeout=timeout):
+            raise TimeoutError("Timed out waiting for a message")
+        offset = (self._get_index % self.slot_count) * self._stride
+        buffer = self._buffer()
+        size, = _LENGTH.unpack_from(buffer, offset)
+        start = offset + _LENGTH.size
+        return buffer[start:start + size]
+
+    def release(self):
+        """
+        Returns the slot of the message last returned by get() to the
+        producer.
+        """
+        self._get_index += 1
+        self._free.release()
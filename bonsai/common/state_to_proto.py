@@ -1,6 +1,8 @@
 
 import logging
 
+from bonsai.inkling_types import Luminance
+
 
 log = logging.getLogger(__name__)
 
@@ -49,3 +51,172 @@ def convert_state_to_proto(state_msg, state):
                 field.message_type, field.name, state[field.name], state_msg)
         else:
             setattr(state_msg, field.name, state[field.name])
+
+
+def field_plan(descriptor):
+    """ This function returns, for each field of a message descriptor, a
+    (name, embedded type name) pair, where the embedded type name is None
+    for simple types. Encoders and decoders compiled from a plan do not
+    need to inspect the descriptor on every message.
+    """
+    return tuple(
+        (field.name,
+         field.message_type.full_name
+         if is_proto_type_embedded_message(field) else None)
+        for field in descriptor.fields)
+
+
+def compile_state_encoder(message_class, plan=None):
+    """ This function returns a function that converts a state dictionary
+    into a new message_class message, like convert_state_to_proto does
+    """
+    if plan is None:
+        plan = field_plan(message_class.DESCRIPTOR)
+    steps = tuple(
+        (name, inkling_type_proto_handler[type_name]
+         if type_name is not None else None)
+        for name, type_name in plan)
+
+    def encode(state):
+        message = message_class()
+        for name, handler in steps:
+            if handler is None:
+                setattr(message, name, state[name])
+            else:
+                handler(name, message, state[name])
+        return message
+    return encode
+
+
+def compile_state_serializer(message_class, plan=None, memoize=False):
+    """ This function returns a function that serializes a state dictionary
+    as message_class bytes. With memoize, the encoded bytes of each
+    embedded message field, such as a Luminance, are kept and reused for
+    as long as the field holds the same object with the same attributes,
+    or, when a dictionary of version tokens is passed along with the
+    state, an equal token. Reused bytes are appended to the serialization
+    of the other fields instead of copying the field into the message
+    again. The result parses to the same message, though fields may not
+    be in field number order
+    """
+    encode = compile_state_encoder(message_class, plan)
+    if not memoize:
+        def serialize(state, versions=None):
+            return encode(state).SerializeToString()
+        return serialize
+
+    if plan is None:
+        plan = field_plan(message_class.DESCRIPTOR)
+    simple = tuple(name for name, type_name in plan if type_name is None)
+    # Per embedded message field: its handler and the version, object,
+    # object attributes and encoded bytes last seen.
+    embedded = tuple(
+        (name, inkling_type_proto_handler[type_name],
+         [None, None, None, None])
+        for name, type_name in plan if type_name is not None)
+
+    def serialize(state, versions=None):
+        message = message_class()
+        for name in simple:
+            setattr(message, name, state[name])
+        chunks = [None]
+        for name, handler, memo in embedded:
+            value = state[name]
+            version = versions.get(name) if versions else None
+            if version is not None:
+                hit = memo[0] is not None and memo[0] == version
+                attributes = None
+            else:
+                attributes = _attributes(value)
+                hit = memo[1] is value and memo[2] == attributes
+            if not hit:
+                field_message = message_class()
+                handler(name, field_message, value)
+                memo[:] = (version, value, attributes,
+                           field_message.SerializeToString())
+            chunks.append(memo[3])
+        chunks[0] = message.SerializeToString()
+        return b''.join(chunks)
+    return serialize
+
+
+def compile_batch_serializer(message_class, plan=None):
+    """ This function returns a function that splits a batch, a dictionary
+    of field names to one value per sample, with a LuminanceBatch for each
+    Luminance field, into a list of serialized message_class messages.
+    Arrays with a tolist() method, such as numpy arrays, are converted in
+    one call. Images are sliced from the batch's pixels and appended after
+    a header serialized once per batch, so no Luminance message is built
+    per sample
+    """
+    if plan is None:
+        plan = field_plan(message_class.DESCRIPTOR)
+    simple = tuple(name for name, type_name in plan if type_name is None)
+    embedded = tuple((name, inkling_type_proto_handler[type_name])
+                     for name, type_name in plan if type_name is not None)
+
+    def serialize_batch(batch):
+        columns = []
+        for name in simple:
+            values = batch[name]
+            columns.append((name, values.tolist()
+                            if hasattr(values, 'tolist') else values))
+        images = []
+        for name, handler in embedded:
+            images.append(_image_column(message_class, name, handler,
+                                        batch[name]))
+        counts = set(len(values) for _, values in columns)
+        counts.update(len(view) // stride for _, view, stride in images)
+        if len(counts) > 1:
+            raise ValueError(
+                "Batch fields have different numbers of samples: "
+                "{}".format(sorted(counts)))
+        count = counts.pop() if counts else 0
+
+        messages = []
+        for index in range(count):
+            message = message_class()
+            for name, values in columns:
+                setattr(message, name, values[index])
+            chunks = [message.SerializeToString()]
+            for header, view, stride in images:
+                chunks.append(header)
+                chunks.append(view[index * stride:(index + 1) * stride])
+            messages.append(b''.join(chunks))
+        return messages
+    return serialize_batch
+
+
+def _image_column(message_class, name, handler, images):
+    """ Returns the serialized bytes preceding each image's pixels when the
+    field holds only that image, the batch's pixels and the length of one
+    image's pixels
+    """
+    stride = images.stride
+    message = message_class()
+    handler(name, message, Luminance(images.width, images.height,
+                                     bytes(stride)))
+    # Pixels are the last field of a Luminance, so they end the message.
+    return message.SerializeToString()[:-stride], images.pixels, stride
+
+
+def _attributes(value):
+    # Attribute values are compared by identity first, so comparing
+    # them is cheap while they are unchanged.
+    attributes = getattr(value, '__dict__', None)
+    return tuple(attributes.values()) if attributes is not None else ()
+
+
+def compile_message_decoder(message_class, plan=None):
+    """ This function returns a function that parses serialized
+    message_class bytes into a dictionary of field names to values
+    """
+    if plan is None:
+        plan = field_plan(message_class.DESCRIPTOR)
+    names = tuple(name for name, _ in plan)
+
+    def decode(data):
+        message = message_class()
+        message.ParseFromString(data)
+        return {name: getattr(message, name) for name in names}
+    return decode
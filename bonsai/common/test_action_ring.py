@@ -0,0 +1,77 @@
+import threading
+import unittest
+from unittest import mock
+
+from bonsai.common import action_ring
+from bonsai.common.action_ring import ActionRingBuffer
+from bonsai.simulator import AsynchronousSimulator
+
+
+class ActionRingBufferTests(unittest.TestCase):
+    def test_latest_and_action_at(self):
+        ring = ActionRingBuffer(4)
+        self.assertIsNone(ring.latest())
+        ring.append('a', 1.0)
+        ring.append('b', 2.0)
+        ring.append('c', 3.0)
+        self.assertEqual('c', ring.latest())
+        self.assertIsNone(ring.action_at(0.5))
+        self.assertEqual('a', ring.action_at(1.5))
+        self.assertEqual('b', ring.action_at(2.0))
+        self.assertEqual('c', ring.action_at(10.0))
+
+    def test_wraps_and_forgets_old_entries(self):
+        ring = ActionRingBuffer(2)
+        for step in range(5):
+            ring.append(step, float(step))
+        self.assertEqual(4, ring.latest())
+        self.assertEqual(3, ring.action_at(3.5))
+        with self.assertLogs('bonsai.common.action_ring', 'WARNING'):
+            self.assertEqual(3, ring.action_at(1.0))
+
+    def test_concurrent_reads_see_consistent_entries(self):
+        ring = ActionRingBuffer(8)
+        count = 20000
+        errors = []
+
+        def produce():
+            for step in range(count):
+                ring.append({'step': step}, float(step))
+
+        producer = threading.Thread(target=produce)
+        producer.start()
+        with mock.patch.object(action_ring.log, 'warning'):
+            while producer.is_alive():
+                latest = ring.latest()
+                if latest is not None:
+                    at = ring.action_at(float(latest['step']))
+                    # Either the entry we asked about or, if the
+                    # producer lapped us, a newer one.
+                    if at['step'] < latest['step']:
+                        errors.append((latest, at))
+        producer.join()
+        self.assertEqual([], errors)
+        self.assertEqual(count - 1, ring.latest()['step'])
+
+
+class StampedSimulator(AsynchronousSimulator):
+    def __init__(self):
+        super().__init__()
+        self.state_time = None
+
+    def get_state_timestamp(self):
+        return self.state_time
+
+
+class AsynchronousSimulatorTests(unittest.TestCase):
+    def test_reports_action_in_effect_at_state_time(self):
+        simulator = StampedSimulator()
+        simulator.register_action_taken({'force': 1.0}, timestamp=10.0)
+        simulator.register_action_taken({'force': 2.0}, timestamp=20.0)
+        self.assertEqual({'force': 2.0}, simulator.get_last_action())
+        simulator.state_time = 15.0
+        self.assertEqual({'force': 1.0}, simulator.get_last_action())
+
+
+if __name__ == '__main__':
+    unittest.main()
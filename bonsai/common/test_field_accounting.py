@@ -0,0 +1,56 @@
+import unittest
+
+from google.protobuf.descriptor_pb2 import FieldDescriptorProto
+
+from bonsai.common.field_accounting import FieldAccounting
+from bonsai.common.message_builder import MessageBuilder
+from bonsai.common.state_to_proto import compile_state_serializer
+from bonsai.inkling_types import Luminance
+from bonsai.test_loopback import make_schema
+
+FRAME_SCHEMA = make_schema(
+    'output', [('frame', FieldDescriptorProto.TYPE_MESSAGE),
+               ('speed', FieldDescriptorProto.TYPE_FLOAT),
+               ('gear', FieldDescriptorProto.TYPE_INT32)])
+FRAME_SCHEMA.field[0].type_name = 'bonsai.inkling_types.proto.Luminance'
+
+
+class FieldAccountingTests(unittest.TestCase):
+    def setUp(self):
+        self.frame_class = MessageBuilder().reconstitute(FRAME_SCHEMA)
+        self.accounting = FieldAccounting()
+        self.serialize = self.accounting.instrument(
+            self.frame_class, compile_state_serializer(self.frame_class))
+        self.state = {'frame': Luminance(4, 4, [0.5] * 16), 'speed': 2.0,
+                      'gear': 3}
+
+    def test_serializes_like_the_compiled_serializer(self):
+        expected = compile_state_serializer(self.frame_class)(self.state)
+        self.assertEqual(expected, self.serialize(self.state))
+
+    def test_field_sizes_add_up_to_message_size(self):
+        size = 0
+        for _ in range(3):
+            size += len(self.serialize(self.state))
+        rows = self.accounting.rows()
+        self.assertEqual(size, sum(row[3] for row in rows))
+        self.assertTrue(all(row[2] == 3 for row in rows))
+        self.assertTrue(all(row[4] >= 0 for row in rows))
+
+    def test_report_ranks_largest_fields_first(self):
+        self.serialize(self.state)
+        self.assertEqual(['frame', 'speed', 'gear'],
+                         [row[1] for row in self.accounting.rows()])
+        lines = self.accounting.report().splitlines()
+        self.assertEqual(4, len(lines))
+        self.assertTrue(lines[1].startswith('output.frame '))
+        self.assertEqual(2, len(self.accounting.report(limit=1).splitlines()))
+
+    def test_clear(self):
+        self.serialize(self.state)
+        self.accounting.clear()
+        self.assertEqual([], self.accounting.rows())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+
+from bonsai.common.lru_cache import LRUCache
+
+
+class LRUCacheTests(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(1, cache.get('a'))
+        cache.put('c', 3)
+        self.assertNotIn('b', cache)
+        self.assertEqual(1, cache.get('a'))
+        self.assertEqual(3, cache.get('c'))
+
+    def test_evicts_by_cost(self):
+        cache = LRUCache(10)
+        cache.put('a', 1, cost=4)
+        cache.put('b', 2, cost=4)
+        cache.put('c', 3, cost=4)
+        self.assertEqual(['b', 'c'], [k for k in 'abc' if k in cache])
+        self.assertEqual(8, cache.total_cost)
+
+    def test_rejects_values_costlier_than_the_cache(self):
+        cache = LRUCache(3)
+        self.assertFalse(cache.put('a', 1, cost=4))
+        self.assertEqual(0, len(cache))
+
+    def test_put_replaces_existing_entry(self):
+        cache = LRUCache(3)
+        cache.put('a', 1, cost=2)
+        cache.put('a', 2, cost=3)
+        self.assertEqual(2, cache.get('a'))
+        self.assertEqual(3, cache.total_cost)
+
+
+if __name__ == '__main__':
+    unittest.main()
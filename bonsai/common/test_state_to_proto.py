@@ -0,0 +1,128 @@
+import struct
+import unittest
+from unittest import mock
+
+from google.protobuf.descriptor_pb2 import DescriptorProto
+from google.protobuf.descriptor_pb2 import FieldDescriptorProto
+
+from bonsai.common import state_to_proto
+from bonsai.common.message_builder import MessageBuilder
+from bonsai.common.state_to_proto import compile_batch_serializer
+from bonsai.common.state_to_proto import compile_state_encoder
+from bonsai.common.state_to_proto import compile_state_serializer
+from bonsai.inkling_types import Luminance, LuminanceBatch
+from bonsai.proto.curve_generator_pb2 import MNIST_training_data_schema
+from bonsai.test_loopback import make_schema
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAP_SCHEMA = make_schema(
+    'output', [('map', FieldDescriptorProto.TYPE_MESSAGE),
+               ('x', FieldDescriptorProto.TYPE_FLOAT)])
+MAP_SCHEMA.field[0].type_name = 'bonsai.inkling_types.proto.Luminance'
+LUMINANCE = 'bonsai.inkling_types.proto.Luminance'
+
+
+class MemoizedSerializerTests(unittest.TestCase):
+    def setUp(self):
+        self.map_class = MessageBuilder().reconstitute(MAP_SCHEMA)
+        self.encode = compile_state_encoder(self.map_class)
+        self.handler = mock.Mock(
+            wraps=state_to_proto.build_luminance_from_state)
+        patcher = mock.patch.dict(state_to_proto.inkling_type_proto_handler,
+                                  {LUMINANCE: self.handler})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.serialize = compile_state_serializer(
+            self.map_class, memoize=True)
+
+    def assert_parses_as(self, state, data):
+        self.assertEqual(self.encode(state),
+                         self.map_class.FromString(data))
+
+    def test_unchanged_object_is_encoded_once(self):
+        image = Luminance(2, 2, [0.25] * 4)
+        for x in range(3):
+            state = {'map': image, 'x': float(x)}
+            self.assert_parses_as(state, self.serialize(state))
+        self.assertEqual(1, self.handler.call_count)
+
+    def test_new_or_modified_object_is_encoded_again(self):
+        image = Luminance(2, 2, [0.25] * 4)
+        self.serialize({'map': image, 'x': 0.0})
+        image.pixels = Luminance(2, 2, [0.5] * 4).pixels
+        state = {'map': image, 'x': 0.0}
+        self.assert_parses_as(state, self.serialize(state))
+        state = {'map': Luminance(2, 2, [0.75] * 4), 'x': 0.0}
+        self.assert_parses_as(state, self.serialize(state))
+        self.assertEqual(3, self.handler.call_count)
+
+    def test_version_tokens_replace_identity(self):
+        first = {'map': Luminance(1, 1, [0.5]), 'x': 1.0}
+        data = self.serialize(first, {'map': 1})
+        # A new object with the same version reuses the bytes.
+        self.assertEqual(
+            data, self.serialize(dict(first, map=Luminance(1, 1, [0.5])),
+                                 {'map': 1}))
+        second = {'map': Luminance(1, 1, [0.75]), 'x': 1.0}
+        self.assert_parses_as(second, self.serialize(second, {'map': 2}))
+        self.assertEqual(2, self.handler.call_count)
+
+    def test_without_memoize_matches_encoder(self):
+        state = {'map': Luminance(1, 1, [0.5]), 'x': 1.0}
+        self.assertEqual(self.encode(state).SerializeToString(),
+                         compile_state_serializer(self.map_class)(state))
+
+
+class BatchSerializerTests(unittest.TestCase):
+    def setUp(self):
+        schema = DescriptorProto()
+        MNIST_training_data_schema.DESCRIPTOR.CopyToProto(schema)
+        self.mnist_class = MessageBuilder().reconstitute(schema)
+        self.serialize = compile_state_serializer(self.mnist_class)
+        self.serialize_batch = compile_batch_serializer(self.mnist_class)
+        self.pixels = [[0.25, 0.5], [0.75, 1.0], [0.0, 0.125]]
+
+    def expected(self, labels):
+        return [self.serialize({'label': label,
+                                'image': Luminance(2, 1, pixels)})
+                for label, pixels in zip(labels, self.pixels)]
+
+    def test_splits_batch_like_single_samples(self):
+        images = LuminanceBatch(2, 1, struct.pack('6f', *sum(self.pixels,
+                                                             [])))
+        self.assertEqual(3, len(images))
+        self.assertEqual(Luminance(2, 1, self.pixels[1]).pixels,
+                         images[1].pixels)
+        self.assertEqual(
+            self.expected([3, 1, 4]),
+            self.serialize_batch({'label': [3, 1, 4], 'image': images}))
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_numpy_arrays(self):
+        labels = numpy.array([3, 1, 4], dtype=numpy.uint32)
+        images = numpy.array(self.pixels, dtype=numpy.float32).reshape(
+            3, 1, 2)
+        self.assertEqual(
+            self.expected([3, 1, 4]),
+            self.serialize_batch({'label': labels,
+                                  'image': LuminanceBatch(2, 1, images)}))
+        for dtype in (numpy.float64, numpy.int32, numpy.uint32, '>f4'):
+            with self.assertRaises(TypeError):
+                LuminanceBatch(2, 1, images.astype(dtype))
+
+    def test_rejects_mismatched_fields(self):
+        images = LuminanceBatch(2, 1, bytes(16))
+        with self.assertRaises(ValueError):
+            self.serialize_batch({'label': [3, 1, 4], 'image': images})
+        with self.assertRaises(ValueError):
+            LuminanceBatch(2, 1, bytes(12))
+        self.assertEqual([], self.serialize_batch(
+            {'label': [], 'image': LuminanceBatch(2, 1, b'')}))
+
+
+if __name__ == '__main__':
+    unittest.main()
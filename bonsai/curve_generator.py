@@ -0,0 +1,107 @@
+"""
+This file contains CurveGenerator, a Generator rendering images of
+parabolic curves for the MNIST_training_data_schema of
+curve_generator.proto. It serves as a reference workload for generator
+throughput and as a template for fast generators: samples are rendered
+a batch at a time with numpy when it is installed.
+
+    $ python -m bonsai.curve_generator --train-brain mybrain
+"""
+import math
+import random
+import struct
+
+from bonsai.brain_server_connection import run_for_training_or_prediction
+from bonsai.generator import Generator
+from bonsai.inkling_types import LuminanceBatch
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class CurveGenerator(Generator):
+    """
+    Renders anti-aliased curves y = a * x**2 + b * x + c across width by
+    height Luminance images, with x and y spanning [-1, 1] and y
+    pointing up. The bend a is drawn from [-curviness, curviness], where
+    curviness is the property of that name set by the BRAIN (see
+    CurveGeneratorSetPropertiesRequestData) and defaults to 1. The label
+    is 1 for curves bending up and 0 for curves bending down.
+
+    next_data_batch() renders a whole batch in a few numpy operations;
+    without numpy it falls back to rendering pixel by pixel.
+    """
+
+    def __init__(self, width=28, height=28, thickness=None, seed=None):
+        super().__init__()
+        self.width = width
+        self.height = height
+        # Half the line width, in the units of y; a pixel by default.
+        self.thickness = thickness or 2.0 / height
+        self._random = random.Random(seed)
+        self._numpy_random = None
+        if numpy is not None:
+            self._numpy_random = numpy.random.RandomState(seed)
+
+    @property
+    def curviness(self):
+        curviness = self.properties.get('curviness')
+        return 1.0 if curviness is None else float(curviness)
+
+    def next_data(self):
+        batch = self.next_data_batch(1)
+        return {'label': int(batch['label'][0]), 'image': batch['image'][0]}
+
+    def next_data_batch(self, count):
+        if numpy is not None:
+            return self._render_with_numpy(count)
+        return self._render(count)
+
+    def _render_with_numpy(self, count):
+        uniform = self._numpy_random.uniform
+        a = uniform(-1.0, 1.0, (count, 1, 1)) * self.curviness
+        b = uniform(-0.5, 0.5, (count, 1, 1))
+        c = uniform(-0.5, 0.5, (count, 1, 1))
+        x = numpy.linspace(-1.0, 1.0, self.width).reshape(1, 1, -1)
+        # Rows run from the top of the image down.
+        y = numpy.linspace(1.0, -1.0, self.height).reshape(1, -1, 1)
+        distance = numpy.abs(y - (a * x * x + b * x + c))
+        pixels = numpy.clip(1.0 - distance / self.thickness, 0.0, 1.0)
+        return {'label': (a.reshape(-1) > 0).astype(numpy.uint32),
+                'image': LuminanceBatch(
+                    self.width, self.height,
+                    numpy.ascontiguousarray(pixels, dtype=numpy.float32))}
+
+    def _render(self, count):
+        uniform = self._random.uniform
+        xs = [_span(i, self.width, -1.0, 1.0) for i in range(self.width)]
+        ys = [_span(i, self.height, 1.0, -1.0) for i in range(self.height)]
+        labels = []
+        pixels = []
+        for _ in range(count):
+            a = uniform(-1.0, 1.0) * self.curviness
+            b = uniform(-0.5, 0.5)
+            c = uniform(-0.5, 0.5)
+            curve = [a * x * x + b * x + c for x in xs]
+            for y in ys:
+                for value in curve:
+                    pixels.append(max(0.0, 1.0 - math.fabs(y - value) /
+                                      self.thickness))
+            labels.append(1 if a > 0 else 0)
+        return {'label': labels,
+                'image': LuminanceBatch(
+                    self.width, self.height,
+                    struct.pack('{}f'.format(len(pixels)), *pixels))}
+
+
+def _span(index, count, first, last):
+    # Like numpy.linspace(first, last, count)[index].
+    if count == 1:
+        return first
+    return first + (last - first) * index / (count - 1)
+
+
+if __name__ == '__main__':
+    run_for_training_or_prediction("curve_generator", CurveGenerator())
@@ -0,0 +1,153 @@
+"""
+This file contains GcControl, which keeps full garbage collections out
+of the steps of a BrainServerConnection, running them at episode
+boundaries instead, and measures collector pauses.
+"""
+import collections
+import gc
+import logging
+import sys
+import time
+
+
+log = logging.getLogger(__name__)
+
+# Stands in for "never" as the threshold of the oldest generation.
+_NEVER = 1 << 30
+
+# The collector is configured once per process, however many connections
+# use it: the thresholds found by the first start(), and the number of
+# started GcControls. The last one to close restores the collector.
+_thresholds = None
+_users = 0
+
+
+class GcControl:
+    """
+    start() collects everything and freezes what survives, such as the
+    reconstituted schemas, where gc.freeze() is available (Python 3.7
+    and later), so no later collection examines those objects. It then
+    stops full collections, whose pauses grow with the heap, from
+    running automatically. Young collections still run automatically,
+    as they are short.
+
+    The connection calls boundary() at episode boundaries (after STOP,
+    RESET and SET_PROPERTIES, and after sending a terminal state), and
+    the deferred full collection runs there. Like CPython's own, it only
+    runs once the oldest generation's threshold is exceeded and the heap
+    has grown by a quarter since the last one; the heap size is
+    estimated with sys.getallocatedblocks(). The connection calls step()
+    after every other state. It collects anyway once max_deferred
+    younger collections are pending, so episodes that never end do not
+    grow the heap forever.
+
+    Once started, the duration of every collection in the process is
+    recorded in pauses as (generation, seconds) pairs, including
+    collections not triggered here. measure() records them without
+    changing how the collector runs.
+
+    Several GcControls, e.g. of connections sharing an event loop, can
+    be started in one process. The collector stays configured until
+    the last of them is closed.
+    """
+
+    def __init__(self, max_deferred=1000, history=100000):
+        self.max_deferred = max_deferred
+        self.pauses = collections.deque(maxlen=history)
+        self._began = None
+        self._started = False
+        self._heap_blocks = 0
+
+    def measure(self):
+        """
+        Starts recording collector pauses.
+        """
+        if self._callback not in gc.callbacks:
+            gc.callbacks.append(self._callback)
+
+    def start(self):
+        """
+        Collects, freezes what survives and defers full collections.
+        Objects frozen by an earlier start() are collected again first.
+        """
+        global _thresholds, _users
+        self.measure()
+        if not self._started:
+            if _users == 0:
+                _thresholds = gc.get_threshold()
+            _users += 1
+            self._started = True
+        self.thaw()
+        gc.collect()
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+        gc.set_threshold(_thresholds[0], _thresholds[1], _NEVER)
+        self._heap_blocks = sys.getallocatedblocks()
+
+    def thaw(self):
+        """
+        Returns frozen objects to the collector, so that the next
+        collection can reclaim the ones that became garbage. The next
+        start() freezes what survives again.
+        """
+        if self._started and hasattr(gc, 'unfreeze'):
+            gc.unfreeze()
+
+    def step(self):
+        if self._started and gc.get_count()[2] >= self.max_deferred:
+            self._collect()
+
+    def boundary(self):
+        if self._started and (
+                gc.get_count()[2] > _thresholds[2] and
+                sys.getallocatedblocks() > 1.25 * self._heap_blocks):
+            self._collect()
+
+    def report(self):
+        """
+        Returns the number, total, 99th percentile and longest pauses of
+        each generation as printable text.
+        """
+        by_generation = collections.defaultdict(list)
+        for generation, seconds in self.pauses:
+            by_generation[generation].append(seconds)
+        lines = []
+        for generation in sorted(by_generation):
+            pauses = sorted(by_generation[generation])
+            lines.append(
+                "generation {}: {} collections, {:.1f} ms total, p99 "
+                "{:.3f} ms, max {:.3f} ms".format(
+                    generation, len(pauses), 1e3 * sum(pauses),
+                    1e3 * pauses[int(0.99 * (len(pauses) - 1))],
+                    1e3 * pauses[-1]))
+        return "\n".join(lines)
+
+    def close(self):
+        """
+        Stops measuring and, if no other GcControl is started, returns
+        the collector to how the first start() found it.
+        """
+        global _thresholds, _users
+        if self._callback in gc.callbacks:
+            gc.callbacks.remove(self._callback)
+        if not self._started:
+            return
+        self._started = False
+        _users -= 1
+        if _users == 0:
+            if hasattr(gc, 'unfreeze'):
+                gc.unfreeze()
+            gc.set_threshold(*_thresholds)
+            _thresholds = None
+
+    def _collect(self):
+        gc.collect()
+        self._heap_blocks = sys.getallocatedblocks()
+
+    def _callback(self, phase, info):
+        if phase == "start":
+            self._began = time.perf_counter()
+        elif self._began is not None:
+            self.pauses.append(
+                (info["generation"], time.perf_counter() - self._began))
+            self._began = None
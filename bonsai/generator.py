@@ -14,4 +14,37 @@ class Generator:
         self.properties = kwargs
 
     def next_data(self):
+        """
+        Returns the next sample, as a dictionary of output schema field
+        names to values. Raising StopIteration ends the session.
+
+        Generators reading from sockets, queues or files can instead
+        define next_data() as a coroutine (async def), or implement
+        __aiter__() returning an asynchronous iterator of samples. The
+        connection then awaits them in a task that stays up to
+        send_window samples ahead of sending, rather than blocking its
+        event loop. Raising StopAsyncIteration ends the session.
+        """
+        raise NotImplementedError()
+
+    def next_encoded_data(self):
+        """
+        Optional hook returning the next sample already serialized with
+        the output schema, as bytes. When overridden, it is used instead
+        of next_data() and the bytes are sent as they are. Raising
+        StopIteration ends the session.
+        """
+        raise NotImplementedError()
+
+    def next_data_batch(self, count):
+        """
+        Optional hook returning up to count samples at once, as a
+        dictionary of output schema field names to one value per sample:
+        a sequence or array, e.g. a numpy array of labels, for simple
+        fields, and a bonsai.inkling_types.LuminanceBatch holding the
+        stacked images for Luminance fields. When overridden (and
+        next_encoded_data() is not), it is used instead of next_data(),
+        and the connection splits each batch into messages. Returning an
+        empty batch or raising StopIteration ends the session.
+        """
         raise NotImplementedError()
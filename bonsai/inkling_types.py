@@ -1,4 +1,5 @@
 
+import sys
 from struct import pack
 
 
@@ -47,3 +48,49 @@ class Luminance():
             raise ValueError("Argument image must have mode 'L'")
         pixels = [x / 255 for x in image.tobytes()]
         return cls(image.size[0], image.size[1], pixels)
+
+
+# Buffer formats of little-endian 32-bit floats; 'f' is native.
+_FLOAT32_FORMATS = ('<f',) + (('f', '=f') if sys.byteorder == 'little'
+                              else ())
+
+
+class LuminanceBatch():
+    """This class represents a batch of Luminance images of the same size,
+    as returned by Generator.next_data_batch(). pixels holds the images one
+    after the other as little-endian 32-bit floats: bytes, or any object
+    exposing them through the buffer protocol, such as a C-contiguous
+    numpy float32 array of shape (count, height, width). Buffers of any
+    other item type are rejected rather than reinterpreted.
+    """
+
+    def __init__(self, width, height, pixels):
+        view = memoryview(pixels)
+        if view.format != 'B' or view.ndim != 1:
+            if not view.c_contiguous:
+                raise ValueError("Argument pixels must be contiguous")
+            if view.format not in _FLOAT32_FORMATS:
+                raise TypeError(
+                    "Argument pixels has items of format '{}', should be "
+                    "little-endian 32-bit floats".format(view.format))
+            view = view.cast('B')
+        stride = width * height * 4
+        if stride == 0 or len(view) % stride:
+            raise ValueError(
+                "Argument pixels has length {}, should be a multiple of "
+                "{}".format(len(view), stride))
+
+        self.width = width
+        self.height = height
+        self.pixels = view
+        self.stride = stride
+
+    def __len__(self):
+        return len(self.pixels) // self.stride
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError("LuminanceBatch index out of range")
+        start = index * self.stride
+        return Luminance(self.width, self.height,
+                         self.pixels[start:start + self.stride].tobytes())
@@ -0,0 +1,424 @@
+"""
+This file contains LoopbackDriver, which runs a simulator in-process
+through the same SET_PROPERTIES/START/PREDICTION/STOP/RESET message
+sequence used by BrainServerConnection, without a network connection.
+It is intended for measuring how fast a simulator runs under the SDK's
+call pattern, with or without the cost of encoding and decoding.
+"""
+import asyncio
+import logging
+import random
+import time
+from collections import deque, namedtuple
+
+from google.protobuf.descriptor_pb2 import FieldDescriptorProto
+
+from bonsai.brain_server_connection import BrainServerConnection
+from bonsai.common.message_builder import MessageBuilder
+from bonsai.common.state_to_proto import convert_state_to_proto
+from bonsai.simulator import AsyncSimulator, Simulator
+from bonsai.proto.generator_simulator_api_pb2 import (
+    SimulatorToServer, ServerToSimulator)
+
+
+log = logging.getLogger(__name__)
+
+# A training URL is used so that the connection runs the training loop.
+_LOOPBACK_URL = "ws://localhost/v1/loopback/loopback/sims/ws"
+
+_FLOAT_TYPES = frozenset([
+    FieldDescriptorProto.TYPE_FLOAT,
+    FieldDescriptorProto.TYPE_DOUBLE])
+_INT_TYPES = frozenset([
+    FieldDescriptorProto.TYPE_INT32,
+    FieldDescriptorProto.TYPE_INT64,
+    FieldDescriptorProto.TYPE_UINT32,
+    FieldDescriptorProto.TYPE_UINT64,
+    FieldDescriptorProto.TYPE_SINT32,
+    FieldDescriptorProto.TYPE_SINT64,
+    FieldDescriptorProto.TYPE_FIXED32,
+    FieldDescriptorProto.TYPE_FIXED64,
+    FieldDescriptorProto.TYPE_SFIXED32,
+    FieldDescriptorProto.TYPE_SFIXED64])
+
+
+def random_policy(prediction_schema, seed=None):
+    """
+    Returns a policy producing random predictions for the fields in
+    prediction_schema, a DescriptorProto. Floating point fields are
+    drawn from [-1, 1], integer fields from {0, 1} and bool fields
+    from {False, True}.
+    """
+    rng = random.Random(seed)
+    generators = []
+    for field in prediction_schema.field:
+        if field.type in _FLOAT_TYPES:
+            generators.append((field.name, lambda: rng.uniform(-1.0, 1.0)))
+        elif field.type in _INT_TYPES:
+            generators.append((field.name, lambda: rng.randint(0, 1)))
+        elif field.type == FieldDescriptorProto.TYPE_BOOL:
+            generators.append((field.name, lambda: rng.random() < 0.5))
+        else:
+            raise ValueError(
+                "Cannot generate random predictions for field '{}' of "
+                "type {}".format(field.name, field.type))
+
+    def policy():
+        return {name: generate() for name, generate in generators}
+    return policy
+
+
+def constant_policy(prediction_schema, value=0):
+    """
+    Returns a policy that always predicts value for every field in
+    prediction_schema, a DescriptorProto.
+    """
+    predictions = {}
+    for field in prediction_schema.field:
+        if field.type == FieldDescriptorProto.TYPE_BOOL:
+            predictions[field.name] = bool(value)
+        else:
+            predictions[field.name] = value
+
+    def policy():
+        return dict(predictions)
+    return policy
+
+
+def _overrides_fused_step(simulator, base_class):
+    return (type(simulator).get_state_reward_terminal is not
+            base_class.get_state_reward_terminal)
+
+
+class LoopbackResult(namedtuple(
+        'LoopbackResult', ['episodes', 'messages', 'elapsed'])):
+    """
+    The outcome of a loopback run. messages counts the server messages
+    handled by the simulator side (SET_PROPERTIES, START, PREDICTION,
+    STOP and RESET), and elapsed is the wall clock time in seconds.
+    """
+
+    @property
+    def messages_per_second(self):
+        if self.elapsed <= 0:
+            return 0.0
+        return self.messages / self.elapsed
+
+
+class LoopbackBrain:
+    """
+    Plays the server side of a training session. Each call to respond()
+    takes a serialized SimulatorToServer message and returns the list
+    of serialized ServerToSimulator messages the server would send back.
+
+    A simulator that sends a state right after registering is in a
+    prediction session instead. It gets a prediction for every state,
+    until num_episodes episodes have ended at a terminal state or after
+    episode_length predictions. Then the session is finished without a
+    response.
+    """
+
+    def __init__(self, properties_schema, output_schema, prediction_schema,
+                 properties, reward_name, policy, episode_length,
+                 num_episodes, reset_between_episodes=True):
+        self.policy = policy
+        self.episode_length = episode_length
+        self.num_episodes = num_episodes
+        self.reset_between_episodes = reset_between_episodes
+
+        self.episodes = 0
+        self.messages = 0
+        self._phase = "unregistered"
+        self._steps = 0
+
+        self._prediction_class = MessageBuilder().reconstitute(
+            prediction_schema)
+
+        ack = ServerToSimulator()
+        ack.message_type = ServerToSimulator.ACKNOWLEDGE_REGISTER
+        data = ack.acknowledge_register_data
+        data.properties_schema.CopyFrom(properties_schema)
+        data.output_schema.CopyFrom(output_schema)
+        data.prediction_schema.CopyFrom(prediction_schema)
+        self._acknowledge_register = ack.SerializeToString()
+
+        properties_message = MessageBuilder().reconstitute(
+            properties_schema)()
+        convert_state_to_proto(properties_message, properties)
+        set_properties = ServerToSimulator()
+        set_properties.message_type = ServerToSimulator.SET_PROPERTIES
+        data = set_properties.set_properties_data
+        data.dynamic_properties = properties_message.SerializeToString()
+        data.reward_name = reward_name or ""
+        data.prediction_schema.CopyFrom(prediction_schema)
+        self._set_properties = set_properties.SerializeToString()
+
+        self._start = self._simple_message(ServerToSimulator.START)
+        self._stop = self._simple_message(ServerToSimulator.STOP)
+        self._reset = self._simple_message(ServerToSimulator.RESET)
+        self._finished = self._simple_message(ServerToSimulator.FINISHED)
+
+    @property
+    def phase(self):
+        """
+        Where the session is: "unregistered", "registered",
+        "configured", "started", "stopped", "reset", "predicting" or
+        "finished".
+        """
+        return self._phase
+
+    @staticmethod
+    def _simple_message(message_type):
+        message = ServerToSimulator()
+        message.message_type = message_type
+        return message.SerializeToString()
+
+    def _prediction(self):
+        predictions_msg = self._prediction_class()
+        convert_state_to_proto(predictions_msg, self.policy())
+        message = ServerToSimulator()
+        message.message_type = ServerToSimulator.PREDICTION
+        message.prediction_data.dynamic_prediction = (
+            predictions_msg.SerializeToString())
+        return message.SerializeToString()
+
+    def _next_episode_or_finish(self):
+        if self.episodes >= self.num_episodes:
+            self._phase = "finished"
+            return self._finished
+        self._phase = "started"
+        self._steps = 0
+        self.messages += 1
+        return self._start
+
+    def _predict(self, terminal):
+        self._phase = "predicting"
+        if terminal or self._steps >= self.episode_length:
+            self.episodes += 1
+            self._steps = 0
+            if self.episodes >= self.num_episodes:
+                self._phase = "finished"
+                return []
+        self._steps += 1
+        self.messages += 1
+        return [self._prediction()]
+
+    def respond(self, from_simulator_bytes):
+        from_simulator = SimulatorToServer()
+        from_simulator.ParseFromString(from_simulator_bytes)
+        message_type = from_simulator.message_type
+
+        if message_type == SimulatorToServer.REGISTER:
+            self._phase = "registered"
+            return [self._acknowledge_register]
+
+        if message_type == SimulatorToServer.READY:
+            if self._phase == "registered":
+                self._phase = "configured"
+                self.messages += 1
+                return [self._set_properties]
+            if self._phase == "stopped" and self.reset_between_episodes:
+                self._phase = "reset"
+                self.messages += 1
+                return [self._reset]
+            return [self._next_episode_or_finish()]
+
+        if (message_type == SimulatorToServer.STATE and
+                self._phase in ("registered", "predicting")):
+            return self._predict(from_simulator.state_data.terminal)
+
+        if message_type == SimulatorToServer.STATE:
+            if (from_simulator.state_data.terminal or
+                    self._steps >= self.episode_length):
+                self._phase = "stopped"
+                self.episodes += 1
+                self.messages += 1
+                return [self._stop]
+            self._steps += 1
+            self.messages += 1
+            return [self._prediction()]
+
+        raise RuntimeError(
+            "Cannot handle SimulatorToServer message with type {}".format(
+                message_type))
+
+
+class LoopbackWebSocket:
+    """
+    An in-memory stand in for a websocket that delivers every message
+    sent by the client to a LoopbackBrain and queues its responses.
+    """
+
+    def __init__(self, brain):
+        self._brain = brain
+        self._pending = deque()
+
+    async def send(self, data):
+        self._pending.extend(self._brain.respond(data))
+
+    async def recv(self):
+        return self._pending.popleft()
+
+    async def close(self):
+        pass
+
+
+class LoopbackDriver:
+    """
+    Runs a simulator through the training message sequence in-process.
+
+    The schemas are DescriptorProto messages, as sent by the server in
+    ACKNOWLEDGE_REGISTER. policy is either "random", "constant" or a
+    callable returning a dictionary of predictions.
+
+    With codec enabled, run() drives a real BrainServerConnection over a
+    LoopbackWebSocket so protobuf encoding and decoding is included.
+    With codec disabled, the simulator methods are called directly in
+    the same order, which isolates the cost of the simulator itself.
+    connection_options are passed to the BrainServerConnection and only
+    apply with codec enabled.
+    """
+
+    def __init__(self, simulator, properties_schema, output_schema,
+                 prediction_schema, properties=None, reward_name=None,
+                 policy="random", episode_length=100,
+                 reset_between_episodes=True, seed=None,
+                 connection_options=None):
+        if not isinstance(simulator, (Simulator, AsyncSimulator)):
+            raise TypeError(
+                "Argument 'simulator' must be an object of type "
+                "bonsai.Simulator or bonsai.AsyncSimulator")
+        self.simulator = simulator
+        self.properties_schema = properties_schema
+        self.output_schema = output_schema
+        self.prediction_schema = prediction_schema
+        self.properties = properties or {}
+        self.reward_name = reward_name
+        self.episode_length = episode_length
+        self.reset_between_episodes = reset_between_episodes
+        self.connection_options = connection_options or {}
+
+        if policy == "random":
+            self.policy = random_policy(prediction_schema, seed)
+        elif policy == "constant":
+            self.policy = constant_policy(prediction_schema)
+        elif callable(policy):
+            self.policy = policy
+        else:
+            raise ValueError(
+                "Argument 'policy' must be 'random', 'constant' or a "
+                "callable")
+
+    def run(self, num_episodes, codec=True):
+        """
+        Runs num_episodes episodes and returns a LoopbackResult.
+        """
+        if codec:
+            return self._run_with_codec(num_episodes)
+        return self._run_without_codec(num_episodes)
+
+    def _run_with_codec(self, num_episodes):
+        brain = LoopbackBrain(
+            self.properties_schema, self.output_schema,
+            self.prediction_schema, self.properties, self.reward_name,
+            self.policy, self.episode_length, num_episodes,
+            self.reset_between_episodes)
+        websocket = LoopbackWebSocket(brain)
+        connection = BrainServerConnection(
+            _LOOPBACK_URL, "loopback", self.simulator,
+            **self.connection_options)
+
+        async def session():
+            try:
+                await connection.send_register(websocket)
+                await connection.recv_acknowledge_register(websocket)
+                await connection.run_simulator_for_training(websocket)
+            finally:
+                connection.close()
+
+        begin = time.perf_counter()
+        asyncio.get_event_loop().run_until_complete(session())
+        elapsed = time.perf_counter() - begin
+        return LoopbackResult(brain.episodes, brain.messages, elapsed)
+
+    def _run_without_codec(self, num_episodes):
+        if isinstance(self.simulator, AsyncSimulator):
+            begin = time.perf_counter()
+            messages = asyncio.get_event_loop().run_until_complete(
+                self._run_async_without_codec(num_episodes))
+            elapsed = time.perf_counter() - begin
+            return LoopbackResult(num_episodes, messages, elapsed)
+
+        simulator = self.simulator
+        fused = _overrides_fused_step(simulator, Simulator)
+        if self.reward_name and not fused:
+            reward_function = getattr(simulator, self.reward_name)
+        else:
+            reward_function = None
+
+        begin = time.perf_counter()
+        simulator.set_properties(**self.properties)
+        messages = 1
+        for _ in range(num_episodes):
+            simulator.start()
+            messages += 1
+            steps = 0
+            while True:
+                if fused:
+                    _, _, terminal = simulator.get_state_reward_terminal(
+                        self.reward_name)
+                else:
+                    simulator.get_state()
+                    if reward_function is not None:
+                        reward_function()
+                    terminal = simulator.get_terminal()
+                simulator.get_last_action()
+                if terminal or steps >= self.episode_length:
+                    break
+                simulator.notify_prediction_received(self.policy())
+                steps += 1
+                messages += 1
+            simulator.stop()
+            messages += 1
+            if self.reset_between_episodes:
+                simulator.reset()
+                messages += 1
+        elapsed = time.perf_counter() - begin
+        return LoopbackResult(num_episodes, messages, elapsed)
+
+    async def _run_async_without_codec(self, num_episodes):
+        simulator = self.simulator
+        fused = _overrides_fused_step(simulator, AsyncSimulator)
+        if self.reward_name and not fused:
+            reward_function = getattr(simulator, self.reward_name)
+        else:
+            reward_function = None
+
+        await simulator.set_properties(**self.properties)
+        messages = 1
+        for _ in range(num_episodes):
+            await simulator.start()
+            messages += 1
+            steps = 0
+            while True:
+                if fused:
+                    _, _, terminal = (
+                        await simulator.get_state_reward_terminal(
+                            self.reward_name))
+                else:
+                    await simulator.get_state()
+                    if reward_function is not None:
+                        await reward_function()
+                    terminal = await simulator.get_terminal()
+                simulator.get_last_action()
+                if terminal or steps >= self.episode_length:
+                    break
+                await simulator.notify_prediction_received(self.policy())
+                steps += 1
+                messages += 1
+            await simulator.stop()
+            messages += 1
+            if self.reset_between_episodes:
+                await simulator.reset()
+                messages += 1
+        return messages
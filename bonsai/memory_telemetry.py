@@ -0,0 +1,197 @@
+"""
+This file contains MemoryTelemetry, which tracks the memory use of a
+BrainServerConnection over long sessions: the resident set size every
+interval messages and, with tracing, the allocation sites that grew in
+between and while handling each type of message.
+"""
+import collections
+import logging
+import os
+import sys
+import tracemalloc
+
+
+log = logging.getLogger(__name__)
+
+_MB = float(1 << 20)
+
+
+class MemoryBudgetExceeded(MemoryError):
+    """
+    Raised by MemoryTelemetry when the resident set size exceeds the
+    budget.
+    """
+
+
+def current_resident_set_size():
+    """
+    Returns the resident set size of this process in bytes, or None
+    where /proc is not available.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def resident_set_size():
+    """
+    Returns the resident set size of this process in bytes. Where /proc
+    is not available this is the peak resident set size, or None if that
+    is not available either.
+    """
+    rss = current_resident_set_size()
+    if rss is not None:
+        return rss
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class MemoryTelemetry:
+    """
+    Call before(phase) and after(phase) around handling each message,
+    where phase names the type of message. Every interval messages, the
+    resident set size is sampled and logged, and MemoryBudgetExceeded is
+    raised if it is above budget bytes. Budgets need the current
+    resident set size, so they are ignored, with a warning, where only
+    the peak can be read.
+
+    With trace, tracemalloc is started, and each sample also records the
+    top allocation sites that grew since the previous one, in growth.
+    After each sample, the next message of every phase seen so far is
+    traced on its own, and the sites that grew while handling it are
+    kept in phase_growth. Sites are (location, size diff, block count
+    diff) tuples. Tracing slows everything down, so it is meant for
+    hunting leaks rather than for production runs.
+    """
+
+    def __init__(self, interval=1000, budget=None, trace=False, top=10):
+        if interval < 1:
+            raise ValueError("interval must be at least 1")
+        self.interval = interval
+        # The peak never goes down, so it cannot tell whether dropping
+        # caches brought memory use back under budget.
+        if budget is not None and current_resident_set_size() is None:
+            log.warning("Ignoring the memory budget, as the current "
+                        "resident set size cannot be read here")
+            budget = None
+        self.budget = budget
+        self.trace = trace
+        self.top = top
+        self.messages = 0
+        self.baseline_rss = resident_set_size()
+        self.peak_rss = self.baseline_rss
+        # (messages, resident set size) pairs, oldest first.
+        self.samples = collections.deque(maxlen=1024)
+        self.growth = []
+        self.phase_growth = {}
+        self._phases = set()
+        self._unsampled = set()
+        self._phase_snapshot = None
+        self._started_tracing = False
+        self._snapshot = None
+        if trace:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            self._snapshot = self._take_snapshot()
+
+    def before(self, phase):
+        if phase in self._unsampled:
+            self._phase_snapshot = self._take_snapshot()
+
+    def after(self, phase):
+        if phase not in self._phases:
+            self._phases.add(phase)
+        if self._phase_snapshot is not None:
+            self.phase_growth[phase] = self._growth(
+                self._phase_snapshot, self._take_snapshot())
+            self._phase_snapshot = None
+            self._unsampled.discard(phase)
+        self.messages += 1
+        if self.messages % self.interval == 0:
+            self.sample()
+
+    def sample(self):
+        """
+        Samples the resident set size and, with tracing, the allocation
+        sites that grew since the previous sample.
+        """
+        rss = resident_set_size()
+        self.samples.append((self.messages, rss))
+        if rss is not None:
+            self.peak_rss = max(self.peak_rss, rss)
+            log.info("%.1f MB resident after %i messages (%+.1f MB since "
+                     "start, peak %.1f MB)", rss / _MB, self.messages,
+                     (rss - self.baseline_rss) / _MB, self.peak_rss / _MB)
+        if self.trace:
+            snapshot = self._take_snapshot()
+            self.growth = self._growth(self._snapshot, snapshot)
+            self._snapshot = snapshot
+            self._unsampled = set(self._phases)
+            for site in self.growth:
+                log.info("%+.1f KiB in %+i blocks at %s",
+                         site[1] / 1024.0, site[2], site[0])
+        self.check_budget(rss)
+
+    def check_budget(self, rss=None):
+        """
+        Raises MemoryBudgetExceeded if the resident set size, sampled
+        now unless given, is above the budget.
+        """
+        if self.budget is None:
+            return
+        if rss is None:
+            rss = resident_set_size()
+        if rss is not None and rss > self.budget:
+            raise MemoryBudgetExceeded(
+                "{:.1f} MB resident exceeds the memory budget of "
+                "{:.1f} MB".format(rss / _MB, self.budget / _MB))
+
+    def report(self):
+        """
+        Returns the resident set sizes and top growing allocation sites
+        as printable text.
+        """
+        lines = []
+        if self.samples and self.samples[-1][1] is not None:
+            lines.append(
+                "{:.1f} MB resident after {} messages, {:.1f} MB at "
+                "start, peak {:.1f} MB".format(
+                    self.samples[-1][1] / _MB, self.samples[-1][0],
+                    self.baseline_rss / _MB, self.peak_rss / _MB))
+        for phase in sorted(self.phase_growth):
+            lines.append("Growth while handling {}:".format(phase))
+            for location, size, count in self.phase_growth[phase]:
+                lines.append("  {:+10.1f} KiB {:+7d} blocks  {}".format(
+                    size / 1024.0, count, location))
+        return "\n".join(lines)
+
+    def close(self):
+        """
+        Stops tracing, if it was started here.
+        """
+        self.trace = False
+        self._snapshot = None
+        self._unsampled = set()
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def _take_snapshot(self):
+        # Leaves out the memory tracemalloc and this module use to
+        # take and compare snapshots.
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__)))
+
+    def _growth(self, before, after):
+        stats = after.compare_to(before, 'lineno')
+        return [(str(stat.traceback), stat.size_diff, stat.count_diff)
+                for stat in stats if stat.size_diff > 0][:self.top]
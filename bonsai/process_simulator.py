@@ -0,0 +1,398 @@
+"""
+This file contains ProcessSimulator, a Simulator that runs a client
+implemented simulator in a separate process. BrainServerConnection and
+the protobuf encoding run in the calling process, the simulator runs in
+the child process, and the two exchange states, Luminance frames and
+predictions through shared memory ring buffers instead of pickling, so
+a heavy Python simulator no longer competes with the connection for the
+same interpreter lock.
+"""
+import logging
+import multiprocessing
+import numbers
+import struct
+import traceback
+
+from bonsai.common.shared_ring import SharedRingBuffer
+from bonsai.inkling_types import Luminance
+from bonsai.simulator import Simulator
+
+
+log = logging.getLogger(__name__)
+
+# Requests sent to the simulator process.
+_SET_PROPERTIES = 1
+_START = 2
+_STOP = 3
+_RESET = 4
+_PREDICTION = 5
+_OBSERVE = 6
+_CLOSE = 7
+
+# Replies sent back by the simulator process.
+_OK = 100
+_ERROR = 101
+_OBSERVATION = 102
+
+# Value tags used when packing dictionaries.
+_NONE = 0
+_BOOL = 1
+_INT = 2
+_FLOAT = 3
+_STRING = 4
+_LUMINANCE = 5
+
+_OPCODE = struct.Struct('<B')
+_COUNT = struct.Struct('<I')
+_KEY = struct.Struct('<H')
+_TAG = struct.Struct('<B')
+_INT64 = struct.Struct('<q')
+_DOUBLE = struct.Struct('<d')
+_LUMINANCE_HEADER = struct.Struct('<III')
+_REWARD_TERMINAL = struct.Struct('<d?')
+
+# How often a blocked read checks that the simulator process is alive.
+_POLL_SECONDS = 1.0
+
+
+def _value_size(value):
+    if value is None:
+        return _TAG.size
+    if isinstance(value, (bool, numbers.Integral)):
+        return _TAG.size + _INT64.size
+    if isinstance(value, numbers.Real):
+        return _TAG.size + _DOUBLE.size
+    if isinstance(value, str):
+        return _TAG.size + _COUNT.size + len(value.encode('utf-8'))
+    if isinstance(value, Luminance):
+        return _TAG.size + _LUMINANCE_HEADER.size + len(value.pixels)
+    raise TypeError(
+        "Cannot pass a value of type {} between processes".format(
+            type(value)))
+
+
+def _packed_size(values):
+    """
+    Returns the number of bytes _pack_into() writes for values, a
+    dictionary of names to simple values or None.
+    """
+    if values is None:
+        return _COUNT.size
+    size = _COUNT.size
+    for key, value in values.items():
+        size += _KEY.size + len(key.encode('utf-8')) + _value_size(value)
+    return size
+
+
+def _pack_into(buffer, offset, values):
+    """
+    Writes values into buffer at offset and returns the offset just
+    past them. Luminance pixels are copied straight into the buffer.
+    A values of None is written as a count of 0xFFFFFFFF.
+    """
+    if values is None:
+        _COUNT.pack_into(buffer, offset, 0xFFFFFFFF)
+        return offset + _COUNT.size
+
+    _COUNT.pack_into(buffer, offset, len(values))
+    offset += _COUNT.size
+    for key, value in values.items():
+        key_bytes = key.encode('utf-8')
+        _KEY.pack_into(buffer, offset, len(key_bytes))
+        offset += _KEY.size
+        buffer[offset:offset + len(key_bytes)] = key_bytes
+        offset += len(key_bytes)
+
+        if value is None:
+            _TAG.pack_into(buffer, offset, _NONE)
+            offset += _TAG.size
+        elif isinstance(value, bool):
+            _TAG.pack_into(buffer, offset, _BOOL)
+            _INT64.pack_into(buffer, offset + _TAG.size, int(value))
+            offset += _TAG.size + _INT64.size
+        elif isinstance(value, numbers.Integral):
+            _TAG.pack_into(buffer, offset, _INT)
+            _INT64.pack_into(buffer, offset + _TAG.size, int(value))
+            offset += _TAG.size + _INT64.size
+        elif isinstance(value, numbers.Real):
+            _TAG.pack_into(buffer, offset, _FLOAT)
+            _DOUBLE.pack_into(buffer, offset + _TAG.size, float(value))
+            offset += _TAG.size + _DOUBLE.size
+        elif isinstance(value, str):
+            encoded = value.encode('utf-8')
+            _TAG.pack_into(buffer, offset, _STRING)
+            _COUNT.pack_into(buffer, offset + _TAG.size, len(encoded))
+            offset += _TAG.size + _COUNT.size
+            buffer[offset:offset + len(encoded)] = encoded
+            offset += len(encoded)
+        else:
+            pixels = value.pixels
+            _TAG.pack_into(buffer, offset, _LUMINANCE)
+            _LUMINANCE_HEADER.pack_into(
+                buffer, offset + _TAG.size,
+                value.width, value.height, len(pixels))
+            offset += _TAG.size + _LUMINANCE_HEADER.size
+            buffer[offset:offset + len(pixels)] = pixels
+            offset += len(pixels)
+    return offset
+
+
+def _unpack(buffer, offset):
+    """
+    Reads a dictionary written by _pack_into() and returns it along
+    with the offset just past it.
+    """
+    count, = _COUNT.unpack_from(buffer, offset)
+    offset += _COUNT.size
+    if count == 0xFFFFFFFF:
+        return None, offset
+
+    values = {}
+    for _ in range(count):
+        key_length, = _KEY.unpack_from(buffer, offset)
+        offset += _KEY.size
+        key = bytes(buffer[offset:offset + key_length]).decode('utf-8')
+        offset += key_length
+
+        tag, = _TAG.unpack_from(buffer, offset)
+        offset += _TAG.size
+        if tag == _NONE:
+            value = None
+        elif tag == _BOOL:
+            value = bool(_INT64.unpack_from(buffer, offset)[0])
+            offset += _INT64.size
+        elif tag == _INT:
+            value, = _INT64.unpack_from(buffer, offset)
+            offset += _INT64.size
+        elif tag == _FLOAT:
+            value, = _DOUBLE.unpack_from(buffer, offset)
+            offset += _DOUBLE.size
+        elif tag == _STRING:
+            length, = _COUNT.unpack_from(buffer, offset)
+            offset += _COUNT.size
+            value = bytes(buffer[offset:offset + length]).decode('utf-8')
+            offset += length
+        elif tag == _LUMINANCE:
+            width, height, length = _LUMINANCE_HEADER.unpack_from(
+                buffer, offset)
+            offset += _LUMINANCE_HEADER.size
+            value = Luminance(
+                width, height, bytes(buffer[offset:offset + length]))
+            offset += length
+        else:
+            raise ValueError("Unknown value tag {}".format(tag))
+        values[key] = value
+    return values, offset
+
+
+def _send(ring, opcode, *parts, head=b''):
+    """
+    Writes opcode, the raw bytes head and each dictionary in parts into
+    the next slot of ring.
+    """
+    size = _OPCODE.size + len(head)
+    for part in parts:
+        size += _packed_size(part)
+
+    def write(buffer, offset):
+        _OPCODE.pack_into(buffer, offset, opcode)
+        offset += _OPCODE.size
+        buffer[offset:offset + len(head)] = head
+        offset += len(head)
+        for part in parts:
+            offset = _pack_into(buffer, offset, part)
+    ring.put_into(size, write)
+
+
+def _observe(simulator, reward_name, uses_fused_step):
+    if uses_fused_step:
+        state, reward, terminal = simulator.get_state_reward_terminal(
+            reward_name)
+    else:
+        state = simulator.get_state()
+        reward = getattr(simulator, reward_name)() if reward_name else 0.0
+        terminal = simulator.get_terminal()
+    return state, reward or 0.0, terminal
+
+
+def _serve(simulator_factory, args, kwargs, requests, replies):
+    """
+    Runs in the simulator process: builds the simulator and services
+    requests until asked to close.
+    """
+    simulator = simulator_factory(*args, **kwargs)
+    uses_fused_step = (
+        type(simulator).get_state_reward_terminal is not
+        Simulator.get_state_reward_terminal)
+
+    while True:
+        message = requests.get()
+        opcode, = _OPCODE.unpack_from(message, 0)
+        if opcode in (_SET_PROPERTIES, _PREDICTION, _OBSERVE):
+            values, _ = _unpack(message, _OPCODE.size)
+        message.release()
+        requests.release()
+
+        try:
+            if opcode == _SET_PROPERTIES:
+                simulator.set_properties(**values)
+            elif opcode == _START:
+                simulator.start()
+            elif opcode == _STOP:
+                simulator.stop()
+            elif opcode == _RESET:
+                simulator.reset()
+            elif opcode == _PREDICTION:
+                simulator.notify_prediction_received(values)
+            elif opcode == _OBSERVE:
+                state, reward, terminal = _observe(
+                    simulator, values['reward_name'], uses_fused_step)
+                _send(replies, _OBSERVATION, state,
+                      simulator.get_last_action(),
+                      head=_REWARD_TERMINAL.pack(reward, terminal))
+                continue
+            elif opcode == _CLOSE:
+                _send(replies, _OK)
+                return
+            else:
+                raise ValueError("Unknown request {}".format(opcode))
+        except Exception:
+            _send(replies, _ERROR, {'error': traceback.format_exc()})
+            continue
+        _send(replies, _OK)
+
+
+class ProcessSimulator(Simulator):
+    """
+    Runs the simulator built by simulator_factory(*args, **kwargs) in a
+    child process and forwards every Simulator call to it. Pass it to
+    BrainServerConnection or run_with_url like any other Simulator.
+
+    simulator_factory must be picklable when the "spawn" start method
+    is used, e.g. a Simulator subclass or a module level function.
+    States, predictions and properties may contain numbers, bools,
+    strings and Luminance values; every message, including the largest
+    state with its frames, must fit in max_message_size bytes.
+
+    Predictions are forwarded without waiting for the child to apply
+    them, and the connection's next state request collects the result,
+    so decoding in this process overlaps with simulation in the child.
+    """
+
+    def __init__(self, simulator_factory, *args,
+                 max_message_size=1 << 22, start_method=None, **kwargs):
+        super().__init__()
+        context = multiprocessing.get_context(start_method)
+        self._requests = SharedRingBuffer(2, max_message_size, context)
+        self._replies = SharedRingBuffer(2, max_message_size, context)
+        self._pending = 0
+        self._reward_name = None
+        self._process = context.Process(
+            target=_serve,
+            args=(simulator_factory, args, kwargs,
+                  self._requests, self._replies),
+            daemon=True)
+        self._process.start()
+
+    def __getattr__(self, name):
+        # The reward method of the active objective, the one last
+        # observed, is forwarded to the child process. Other names are
+        # not known in this process.
+        if name != self.__dict__.get('_reward_name'):
+            raise AttributeError(
+                "'{}' object has no attribute '{}'".format(
+                    type(self).__name__, name))
+
+        def reward():
+            return self.get_state_reward_terminal(name)[1]
+        reward.__name__ = name
+        return reward
+
+    def _get_reply(self):
+        while True:
+            try:
+                return self._replies.get(timeout=_POLL_SECONDS)
+            except TimeoutError:
+                if not self._process.is_alive():
+                    raise RuntimeError(
+                        "Simulator process exited with code {}".format(
+                            self._process.exitcode))
+
+    def _check_reply(self, reply):
+        opcode, = _OPCODE.unpack_from(reply, 0)
+        if opcode == _ERROR:
+            values, _ = _unpack(reply, _OPCODE.size)
+            reply.release()
+            self._replies.release()
+            raise RuntimeError(
+                "Simulator process raised an exception:\n{}".format(
+                    values['error']))
+        return opcode
+
+    def _drain_pending(self):
+        while self._pending:
+            self._pending -= 1
+            reply = self._get_reply()
+            self._check_reply(reply)
+            reply.release()
+            self._replies.release()
+
+    def _call(self, opcode, *parts):
+        self._drain_pending()
+        _send(self._requests, opcode, *parts)
+        reply = self._get_reply()
+        self._check_reply(reply)
+        reply.release()
+        self._replies.release()
+
+    def set_properties(self, **kwargs):
+        self.properties = kwargs
+        self._call(_SET_PROPERTIES, kwargs)
+
+    def set_prediction(self, **kwargs):
+        self._drain_pending()
+        _send(self._requests, _PREDICTION, kwargs)
+        self._pending += 1
+
+    def notify_prediction_received(self, predictions):
+        self.set_prediction(**predictions)
+
+    def get_state_reward_terminal(self, reward_name):
+        # Predictions are collected first, so that if one failed, the
+        # observation is not requested and its reply is not left behind.
+        self._drain_pending()
+        _send(self._requests, _OBSERVE, {'reward_name': reward_name})
+        if reward_name:
+            self._reward_name = reward_name
+        reply = self._get_reply()
+        self._check_reply(reply)
+        reward, terminal = _REWARD_TERMINAL.unpack_from(reply, _OPCODE.size)
+        offset = _OPCODE.size + _REWARD_TERMINAL.size
+        state, offset = _unpack(reply, offset)
+        self._last_actions, _ = _unpack(reply, offset)
+        reply.release()
+        self._replies.release()
+        return state, reward, terminal
+
+    def get_state(self):
+        return self.get_state_reward_terminal(None)[0]
+
+    def get_terminal(self):
+        return self.get_state_reward_terminal(None)[2]
+
+    def start(self):
+        self._call(_START)
+
+    def stop(self):
+        self._call(_STOP)
+
+    def reset(self):
+        self._call(_RESET)
+
+    def close(self):
+        """
+        Shuts down the simulator process.
+        """
+        if self._process.is_alive():
+            self._call(_CLOSE)
+        self._process.join()
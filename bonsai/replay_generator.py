@@ -0,0 +1,155 @@
+"""
+This file contains ReplayGenerator, a Generator that serves training
+samples already serialized with the output schema from memory mapped
+shard files, and write_shard, which writes such files.
+"""
+import logging
+import mmap
+import queue
+import random
+import threading
+
+from bonsai.common.record_file import RECORD_HEADER, read_record_headers
+from bonsai.generator import Generator
+
+
+log = logging.getLogger(__name__)
+
+# Signals that a reader thread has finished its shards.
+_DONE = object()
+
+
+def write_shard(path, samples):
+    """
+    Writes the serialized samples, an iterable of bytes, to a shard at
+    path. Shards use the record format of trajectory segments.
+    """
+    with open(path, 'wb') as f:
+        for sample in samples:
+            f.write(RECORD_HEADER.pack(len(sample), 0))
+            f.write(sample)
+
+
+class ReplayGenerator(Generator):
+    """
+    Serves the samples of the shard files in shard_paths, for epochs
+    passes over all shards or forever if epochs is None. Each epoch
+    visits the shards in a random order, and samples pass through a
+    shuffle buffer of shuffle_buffer_size samples; a size of 1 keeps
+    the order of the shards.
+
+    Samples are sliced from the memory mapped shards and sent as they
+    are, so no Python objects are built per sample besides its bytes.
+    With readers greater than one, that many threads read shards in
+    parallel, which helps when shards live on slow or remote storage.
+    """
+
+    def __init__(self, shard_paths, shuffle_buffer_size=1024, epochs=None,
+                 readers=1, seed=None):
+        super().__init__()
+        if not shard_paths:
+            raise ValueError("At least one shard is required")
+        if shuffle_buffer_size < 1:
+            raise ValueError("shuffle_buffer_size must be at least 1")
+        self.shard_paths = list(shard_paths)
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.epochs = epochs
+        self.readers = readers
+        self.epoch = 0
+        self._random = random.Random(seed)
+        self._stop = threading.Event()
+        self._samples = self._shuffled(self._epochs())
+
+    def next_encoded_data(self):
+        return next(self._samples)
+
+    def close(self):
+        """
+        Stops any reader threads.
+        """
+        self._stop.set()
+
+    def _epochs(self):
+        while self.epochs is None or self.epoch < self.epochs:
+            shards = list(self.shard_paths)
+            self._random.shuffle(shards)
+            if self.readers > 1 and len(shards) > 1:
+                samples = self._read_in_parallel(shards)
+            else:
+                samples = (sample for path in shards
+                           for sample in _read_shard(path))
+            count = 0
+            for sample in samples:
+                count += 1
+                yield sample
+            if count == 0 and self.epochs is None:
+                # Otherwise endless empty epochs would never return.
+                raise ValueError("The shards hold no samples")
+            self.epoch += 1
+
+    def _read_in_parallel(self, shards):
+        pending = queue.Queue()
+        for path in shards:
+            pending.put(path)
+        samples = queue.Queue(maxsize=self.shuffle_buffer_size)
+        readers = min(self.readers, len(shards))
+        for _ in range(readers):
+            threading.Thread(target=self._read_shards,
+                             args=(pending, samples), daemon=True).start()
+
+        done = 0
+        while done < readers:
+            sample = samples.get()
+            if sample is _DONE:
+                done += 1
+            elif isinstance(sample, Exception):
+                raise sample
+            else:
+                yield sample
+
+    def _read_shards(self, pending, samples):
+        try:
+            while not self._stop.is_set():
+                try:
+                    path = pending.get_nowait()
+                except queue.Empty:
+                    break
+                for sample in _read_shard(path):
+                    if not self._put(samples, sample):
+                        return
+        except Exception as e:
+            log.error("Reading a shard failed: %s", e)
+            self._put(samples, e)
+        self._put(samples, _DONE)
+
+    def _put(self, samples, item):
+        # Gives up once close() is called, so readers do not block on a
+        # full queue forever.
+        while not self._stop.is_set():
+            try:
+                samples.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _shuffled(self, samples):
+        buffer = []
+        for sample in samples:
+            if len(buffer) < self.shuffle_buffer_size:
+                buffer.append(sample)
+                continue
+            index = self._random.randrange(len(buffer))
+            yield buffer[index]
+            buffer[index] = sample
+        self._random.shuffle(buffer)
+        yield from buffer
+
+
+def _read_shard(path):
+    with open(path, 'rb') as f:
+        if f.seek(0, 2) == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for start, length, _ in read_record_headers(mapped):
+                yield mapped[start:start + length]
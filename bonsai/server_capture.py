@@ -0,0 +1,195 @@
+"""
+This file contains MessageCapture, which records the raw
+ServerToSimulator messages a BrainServerConnection receives along with
+their arrival times, and ReplayDriver, which feeds a recorded session
+back to a BrainServerConnection offline, so client side changes can be
+measured against real server traffic.
+"""
+import asyncio
+import struct
+import time
+
+import websockets
+
+from bonsai.brain_server_connection import BrainServerConnection
+from bonsai.loopback import LoopbackResult
+from bonsai.proto.generator_simulator_api_pb2 import ServerToSimulator
+
+
+_MAGIC = b'BSCAP1'
+# A capture starts with a header saying whether the session was a
+# training session, followed by each message's length and arrival time
+# in seconds since the capture began.
+_HEADER = struct.Struct('<6s?')
+_MESSAGE = struct.Struct('<Id')
+
+_TRAINING_URL = "ws://localhost/v1/replay/replay/sims/ws"
+_PREDICTION_URL = "ws://localhost/v1/replay/replay/1/predictions/ws"
+
+
+class MessageCapture:
+    """
+    Appends received messages to the file at path. Writes go through a
+    buffered file, so recording a message does not wait on the disk.
+    """
+
+    def __init__(self, path, is_training):
+        self.path = path
+        self._file = open(path, 'wb', buffering=1 << 20)
+        self._file.write(_HEADER.pack(_MAGIC, is_training))
+        self._begin = time.monotonic()
+
+    def record(self, data):
+        self._file.write(_MESSAGE.pack(len(data),
+                                       time.monotonic() - self._begin))
+        self._file.write(data)
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+class CapturingWebSocket:
+    """
+    Wraps a websocket, recording each message received into capture.
+    """
+
+    def __init__(self, websocket, capture):
+        self._websocket = websocket
+        self._capture = capture
+
+    async def send(self, data):
+        await self._websocket.send(data)
+
+    async def recv(self):
+        data = await self._websocket.recv()
+        self._capture.record(data)
+        return data
+
+    async def close(self):
+        await self._websocket.close()
+
+
+def read_capture(path):
+    """
+    Returns whether the captured session was a training session, and a
+    list of (arrival time, message bytes) pairs.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, is_training = _HEADER.unpack_from(data, 0)
+    if magic != _MAGIC:
+        raise ValueError("{} is not a message capture".format(path))
+    messages = []
+    offset = _HEADER.size
+    while offset + _MESSAGE.size <= len(data):
+        length, arrival = _MESSAGE.unpack_from(data, offset)
+        offset += _MESSAGE.size
+        if offset + length > len(data):
+            break
+        messages.append((arrival, data[offset:offset + length]))
+        offset += length
+    return is_training, messages
+
+
+class ReplayWebSocket:
+    """
+    Returns captured messages from recv() in order, either immediately
+    or, with timing, no earlier than they originally arrived relative to
+    the first recv(). Sent messages are counted and dropped. Once the
+    capture is exhausted, recv() raises ConnectionClosed.
+    """
+
+    def __init__(self, messages, timing=False):
+        self._messages = messages
+        self._index = 0
+        self.timing = timing
+        self.sent = 0
+        self._begin = None
+
+    async def send(self, data):
+        self.sent += 1
+
+    async def recv(self):
+        if self._index >= len(self._messages):
+            raise websockets.exceptions.ConnectionClosed(
+                1000, "End of capture")
+        arrival, data = self._messages[self._index]
+        self._index += 1
+        if self.timing:
+            now = time.monotonic()
+            if self._begin is None:
+                self._begin = now - arrival
+            delay = self._begin + arrival - now
+            if delay > 0:
+                await asyncio.sleep(delay)
+        return data
+
+    async def close(self):
+        pass
+
+
+class ReplayDriver:
+    """
+    Replays the capture at path to a BrainServerConnection for
+    simulator, created with connection_options, and returns a
+    LoopbackResult counting the STARTs replayed as episodes.
+
+        driver = ReplayDriver("session.cap", MySimulator())
+        print(driver.run().messages_per_second)
+    """
+
+    def __init__(self, path, simulator, timing=False,
+                 connection_options=None):
+        self.is_training, self.messages = read_capture(path)
+        self.simulator = simulator
+        self.timing = timing
+        self.connection_options = connection_options or {}
+
+    def _sessions(self):
+        """
+        Splits the capture into one list of messages per session, as a
+        capture spanning reconnects holds one session per
+        ACKNOWLEDGE_REGISTER, and counts the STARTs.
+        """
+        sessions = []
+        episodes = 0
+        for arrival, data in self.messages:
+            message_type = ServerToSimulator.FromString(data).message_type
+            if (message_type == ServerToSimulator.ACKNOWLEDGE_REGISTER or
+                    not sessions):
+                sessions.append([])
+            elif message_type == ServerToSimulator.START:
+                episodes += 1
+            sessions[-1].append((arrival, data))
+        return sessions, episodes
+
+    def run(self):
+        sessions, episodes = self._sessions()
+        url = _TRAINING_URL if self.is_training else _PREDICTION_URL
+        connection = BrainServerConnection(
+            url, "replay", self.simulator, **self.connection_options)
+        if connection.is_generator:
+            run_coro = connection.run_generator_for_training
+        elif self.is_training:
+            run_coro = connection.run_simulator_for_training
+        else:
+            run_coro = connection.run_simulator_for_prediction
+
+        async def replay():
+            try:
+                for messages in sessions:
+                    websocket = ReplayWebSocket(messages, self.timing)
+                    try:
+                        await connection.send_register(websocket)
+                        await connection.recv_acknowledge_register(websocket)
+                        await run_coro(websocket)
+                    except websockets.exceptions.ConnectionClosed:
+                        pass
+            finally:
+                connection.close()
+
+        begin = time.perf_counter()
+        asyncio.get_event_loop().run_until_complete(replay())
+        elapsed = time.perf_counter() - begin
+        return LoopbackResult(episodes, len(self.messages), elapsed)
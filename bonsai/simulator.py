@@ -1,3 +1,5 @@
+from bonsai.common.action_ring import ActionRingBuffer
+
 
 class Simulator:
     """
@@ -7,7 +9,8 @@ class Simulator:
     Simulators must implement set_prediction(), get_state(),
     get_reward() and get_terminal().
 
-    Implementing start(), stop() and reset() is optional.
+    Implementing start(), stop() and reset() is optional, as is the
+    fused get_state_reward_terminal() hook.
 
     Simulators must also add methods who's names correspond to the
     objectives declared in inkling.
@@ -34,6 +37,18 @@ class Simulator:
     def get_terminal(self):
         raise NotImplementedError()
 
+    def get_state_reward_terminal(self, reward_name):
+        """
+        Optional fused alternative to calling get_state(), the reward
+        method for the active objective and get_terminal() separately.
+        Simulators that recompute the same intermediate values in each
+        of those can override this to return a (state, reward, terminal)
+        tuple in one call, and BrainServerConnection will use it instead.
+        reward_name is the name of the active objective's method, or None
+        when no objective is active, in which case reward is ignored.
+        """
+        raise NotImplementedError()
+
     def start(self):
         pass
 
@@ -43,6 +58,43 @@ class Simulator:
     def reset(self):
         pass
 
+    def snapshot(self):
+        """
+        Optional. Returns an object capturing the simulator's current
+        state, e.g. a deep copy of the attributes that make up the
+        world. BrainServerConnection created with restore_snapshots=True
+        takes one snapshot after the first start() following
+        SET_PROPERTIES and passes it to restore() at every later RESET
+        and START, instead of calling reset() and start().
+
+        With properties_cache_size, a snapshot is also taken right after
+        set_properties() and restored when the same properties are set
+        again, instead of calling set_properties(). Such snapshots must
+        capture everything set_properties() configures; the connection
+        sets the properties attribute itself.
+        """
+        raise NotImplementedError()
+
+    def restore(self, snapshot):
+        """
+        Optional. Returns the simulator to the state captured by
+        snapshot(). The snapshot may be restored many times, so it must
+        not be modified.
+        """
+        raise NotImplementedError()
+
+    def get_state_versions(self):
+        """
+        Optional. With BrainServerConnection created with
+        memoize_fields=True, the encoded bytes of Luminance and other
+        embedded message fields are reused while a field holds the same
+        object. Simulators building new objects for unchanged fields can
+        instead return a dictionary of field names to version tokens for
+        the state last returned; a field whose token equals the previous
+        one is not encoded again.
+        """
+        return None
+
     def get_last_action(self):
         """ when sending states to the server, this function determines which
         corresponding action to send """
@@ -64,9 +116,15 @@ class AsynchronousSimulator(Simulator):
     In addition to this, AsynchronousSimulators must be told when an action
     has been taken, and register_action_taken() must be called regularly by
     the simulator.
+    Actions are kept with their timestamps in a lock-free ring buffer, so
+    a simulator thread running at its own rate can register actions
+    without contending with the connection. If get_state_timestamp() is
+    overridden, the action reported with a state is the one in effect
+    when that state was sampled.
     """
-    def __init__(self):
+    def __init__(self, action_history=64):
         super().__init__()
+        self._actions = ActionRingBuffer(action_history)
 
     def notify_prediction_received(self, predictions):
         """ When receiving new predictions, immediately send to simulator,
@@ -74,8 +132,106 @@ class AsynchronousSimulator(Simulator):
         """
         self.set_prediction(**predictions)
 
-    def register_action_taken(self, predictions):
+    def register_action_taken(self, predictions, timestamp=None):
         """ This function is for the simulator to notify when an action has
         been taken, and is safe to report to the server as affecting the most
-        recent state """
+        recent state. timestamp defaults to time.monotonic(); simulators
+        passing their own timestamps must use the same clock in
+        get_state_timestamp(). Only one thread may call this. """
+        self._actions.append(predictions, timestamp)
+        self._last_actions = predictions
+
+    def get_state_timestamp(self):
+        """ Returns the timestamp at which the state last returned by
+        get_state() was sampled, or None to report the latest action """
+        return None
+
+    def get_last_action(self):
+        """ Returns the action in effect when the last state was sampled """
+        timestamp = self.get_state_timestamp()
+        if timestamp is None:
+            return self._actions.latest()
+        return self._actions.action_at(timestamp)
+
+
+class AsyncSimulator:
+    """
+    Interface for client implemented simulators backed by I/O, such as
+    simulators that proxy to an external engine over a socket.
+
+    This is the coroutine counterpart of Simulator: set_prediction(),
+    get_state(), get_reward(), get_terminal(), start(), stop(), reset()
+    and set_properties() are all coroutines, and BrainServerConnection
+    awaits them on its event loop instead of blocking it. The methods
+    named after the objectives declared in inkling must be coroutines
+    as well. Several connections driving AsyncSimulators can share one
+    event loop, so a single process can overlap many I/O-bound
+    simulators.
+
+    Not to be confused with AsynchronousSimulator, which is about when
+    an action takes effect rather than how the simulator is called.
+    """
+    def __init__(self):
+        self.properties = {}
+        self._last_actions = None
+
+    async def set_properties(self, **kwargs):
+        self.properties = kwargs
+
+    async def set_prediction(self, **kwargs):
+        raise NotImplementedError()
+
+    async def get_state(self):
+        raise NotImplementedError()
+
+    async def get_reward(self):
+        raise NotImplementedError()
+
+    async def get_terminal(self):
+        raise NotImplementedError()
+
+    async def get_state_reward_terminal(self, reward_name):
+        """
+        Optional fused alternative to get_state(), the objective's
+        reward method and get_terminal(); see
+        Simulator.get_state_reward_terminal().
+        """
+        raise NotImplementedError()
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def reset(self):
+        pass
+
+    async def snapshot(self):
+        """
+        Optional; see Simulator.snapshot().
+        """
+        raise NotImplementedError()
+
+    async def restore(self, snapshot):
+        """
+        Optional; see Simulator.restore().
+        """
+        raise NotImplementedError()
+
+    def get_state_versions(self):
+        """
+        Optional; see Simulator.get_state_versions().
+        """
+        return None
+
+    def get_last_action(self):
+        """ when sending states to the server, this function determines which
+        corresponding action to send """
+        return self._last_actions
+
+    async def notify_prediction_received(self, predictions):
+        """ When receiving new predictions, save off a copy before reporting
+        to simulator """
         self._last_actions = predictions
+        await self.set_prediction(**predictions)
@@ -0,0 +1,96 @@
+"""
+This file contains StandInServer, a local websocket server that plays
+the BRAIN side of the simulator protocol using LoopbackBrain. It lets
+simulators and SDK changes be exercised and benchmarked over a real
+websocket connection without a BRAIN backend.
+"""
+import asyncio
+import logging
+
+import websockets
+
+
+log = logging.getLogger(__name__)
+
+
+class StandInServer:
+    """
+    Serves one LoopbackBrain, built by brain_factory(), per websocket
+    connection. latency, in seconds, is added before each response to
+    mimic a network round trip. With drop_after, the first drop_count
+    connections are closed after receiving that many messages, to
+    exercise reconnects.
+
+        server = StandInServer(brain_factory, latency=0.001)
+        await server.start()
+        connection = BrainServerConnection(server.url, "sim", simulator)
+        await connection.run_until_complete()
+        await server.close()
+    """
+
+    def __init__(self, brain_factory, host="127.0.0.1", port=0,
+                 latency=0.0, drop_after=None, drop_count=1):
+        self.brain_factory = brain_factory
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.drop_after = drop_after
+        self.drop_count = drop_count
+        self.drops = 0
+        self.brains = []
+        self._server = None
+
+    @property
+    def url(self):
+        """
+        A training URL for this server.
+        """
+        return "ws://{}:{}/v1/stand_in/stand_in/sims/ws".format(
+            self.host, self.port)
+
+    @property
+    def prediction_url(self):
+        """
+        A prediction URL for this server.
+        """
+        return "ws://{}:{}/v1/stand_in/stand_in/1/predictions/ws".format(
+            self.host, self.port)
+
+    async def start(self):
+        self._server = await websockets.serve(
+            self._serve_connection, self.host, self.port)
+        # websockets 3.3 and later wrap the asyncio server.
+        server = getattr(self._server, 'server', self._server)
+        self.port = server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _respond(self, websocket, brain, data):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        for response in brain.respond(data):
+            await websocket.send(response)
+
+    async def _serve_connection(self, websocket, path):
+        brain = self.brain_factory()
+        self.brains.append(brain)
+        drop_after = None
+        if self.drop_after is not None and self.drops < self.drop_count:
+            drop_after = self.drop_after
+            self.drops += 1
+        received = 0
+        try:
+            while brain.phase != "finished":
+                data = await websocket.recv()
+                received += 1
+                if received == drop_after:
+                    log.debug("Stand-in server dropping connection")
+                    await websocket.close(1011, "dropped")
+                    return
+                await self._respond(websocket, brain, data)
+        except websockets.exceptions.ConnectionClosed:
+            log.debug("Stand-in server connection closed")
@@ -0,0 +1,733 @@
+import asyncio
+import gc
+import socket
+import struct
+import threading
+import unittest
+from unittest import mock
+
+import websockets
+from google.protobuf.descriptor_pb2 import DescriptorProto
+from google.protobuf.descriptor_pb2 import FieldDescriptorProto
+
+from bonsai import memory_telemetry
+from bonsai.brain_server_connection import BrainServerConnection
+from bonsai.common.message_builder import MessageBuilder
+from bonsai.gc_control import GcControl
+from bonsai.generator import Generator
+from bonsai.inkling_types import Luminance, LuminanceBatch
+from bonsai.loopback import LoopbackBrain, LoopbackDriver, constant_policy
+from bonsai.memory_telemetry import MemoryBudgetExceeded
+from bonsai.stand_in_server import StandInServer
+from bonsai.test_loopback import CountingSimulator, OUTPUT_SCHEMA
+from bonsai.test_loopback import make_schema
+from bonsai.test_loopback import PREDICTION_SCHEMA, PROPERTIES_SCHEMA
+from bonsai.proto.curve_generator_pb2 import MNIST_training_data_schema
+from bonsai.proto.generator_simulator_api_pb2 import PredictionData
+from bonsai.proto.generator_simulator_api_pb2 import ServerToSimulator
+from bonsai.proto.generator_simulator_api_pb2 import SetPropertiesData
+
+TRAINING_URL = "ws://localhost/v1/user/brain/sims/ws"
+
+
+class SnapshotSimulator(CountingSimulator):
+    def __init__(self):
+        super().__init__()
+        self.calls.update({'snapshot': 0, 'restore': 0})
+        self.world = None
+
+    def start(self):
+        super().start()
+        self.world = {'position': 0.0}
+
+    def snapshot(self):
+        self.calls['snapshot'] += 1
+        return dict(self.world)
+
+    def restore(self, snapshot):
+        self.calls['restore'] += 1
+        self.world = dict(snapshot)
+        self.steps = 0
+
+
+def run_loopback(simulator, num_episodes, **kwargs):
+    connection_options = kwargs.pop('connection_options', {})
+    driver = LoopbackDriver(
+        simulator, PROPERTIES_SCHEMA, OUTPUT_SCHEMA, PREDICTION_SCHEMA,
+        properties={'gain': 1.0}, reward_name='distance',
+        connection_options=connection_options, **kwargs)
+    return driver.run(num_episodes)
+
+
+def make_connection(simulator, **connection_options):
+    connection = BrainServerConnection(
+        TRAINING_URL, "sim", simulator, **connection_options)
+    connection.properties_schema = MessageBuilder().reconstitute(
+        PROPERTIES_SCHEMA)
+    connection.output_schema = MessageBuilder().reconstitute(OUTPUT_SCHEMA)
+    connection.prediction_schema = MessageBuilder().reconstitute(
+        PREDICTION_SCHEMA)
+    return connection
+
+
+def set_properties_data(**properties):
+    message = MessageBuilder().reconstitute(PROPERTIES_SCHEMA)()
+    for name, value in properties.items():
+        setattr(message, name, value)
+    data = SetPropertiesData()
+    data.dynamic_properties = message.SerializeToString()
+    data.reward_name = 'distance'
+    data.prediction_schema.CopyFrom(PREDICTION_SCHEMA)
+    return data
+
+
+def prediction_data(**predictions):
+    message = MessageBuilder().reconstitute(PREDICTION_SCHEMA)()
+    for name, value in predictions.items():
+        setattr(message, name, value)
+    data = PredictionData()
+    data.dynamic_prediction = message.SerializeToString()
+    return data
+
+
+class SnapshotTests(unittest.TestCase):
+    def test_snapshot_replaces_reset_and_start(self):
+        simulator = SnapshotSimulator()
+        run_loopback(simulator, 3, episode_length=2,
+                     connection_options={'restore_snapshots': True})
+        self.assertEqual(1, simulator.calls['start'])
+        self.assertEqual(1, simulator.calls['snapshot'])
+        self.assertEqual(3, simulator.calls['restore'])
+        self.assertEqual(0, simulator.calls['reset'])
+
+    def test_snapshot_restored_at_start_without_reset(self):
+        simulator = SnapshotSimulator()
+        run_loopback(simulator, 3, episode_length=2,
+                     reset_between_episodes=False,
+                     connection_options={'restore_snapshots': True})
+        self.assertEqual(1, simulator.calls['start'])
+        self.assertEqual(2, simulator.calls['restore'])
+
+    def test_snapshots_are_off_by_default(self):
+        simulator = SnapshotSimulator()
+        run_loopback(simulator, 2, episode_length=2)
+        self.assertEqual(2, simulator.calls['start'])
+        self.assertEqual(0, simulator.calls['snapshot'])
+
+    def test_snapshots_require_hooks(self):
+        with self.assertRaises(ValueError):
+            BrainServerConnection(TRAINING_URL, "sim", CountingSimulator(),
+                                  restore_snapshots=True)
+
+
+class ConfigurableSimulator(SnapshotSimulator):
+    def __init__(self):
+        super().__init__()
+        self.configured = 0
+
+    def set_properties(self, **kwargs):
+        super().set_properties(**kwargs)
+        self.configured += 1
+        self.world = {'terrain': kwargs['gain']}
+
+
+class PropertiesCacheTests(unittest.TestCase):
+    def test_revisited_properties_restore_cached_snapshot(self):
+        simulator = ConfigurableSimulator()
+        connection = make_connection(simulator, properties_cache_size=2)
+        for gain in [1.0, 2.0, 2.0, 1.0, 3.0, 1.0]:
+            connection.handle_set_properties(set_properties_data(gain=gain))
+            self.assertEqual({'terrain': gain}, simulator.world)
+            self.assertEqual({'gain': gain}, simulator.properties)
+        # 1.0 and 2.0 are built once each; 3.0 evicts 2.0, and 1.0 is
+        # still cached because it was used more recently.
+        self.assertEqual(3, simulator.configured)
+        self.assertEqual(3, simulator.calls['restore'])
+
+    def test_cost_hint_bounds_cache(self):
+        simulator = ConfigurableSimulator()
+        connection = make_connection(
+            simulator, properties_cache_size=5,
+            properties_cache_cost=lambda properties, snapshot: 3)
+        for gain in [1.0, 2.0, 1.0]:
+            connection.handle_set_properties(set_properties_data(gain=gain))
+        self.assertEqual(3, simulator.configured)
+
+    def test_episode_snapshot_is_kept_per_properties(self):
+        simulator = ConfigurableSimulator()
+        connection = make_connection(
+            simulator, properties_cache_size=2, restore_snapshots=True)
+        connection.handle_set_properties(set_properties_data(gain=1.0))
+        connection._start_episode()
+        connection.handle_set_properties(set_properties_data(gain=2.0))
+        connection._start_episode()
+        connection.handle_set_properties(set_properties_data(gain=1.0))
+        connection._start_episode()
+        self.assertEqual(2, simulator.calls['start'])
+
+
+class ThreadRecordingSimulator(CountingSimulator):
+    def __init__(self):
+        super().__init__()
+        self.lifecycle = []
+        self.threads = {'start': [], 'reset': []}
+
+    def set_properties(self, **kwargs):
+        super().set_properties(**kwargs)
+        self.lifecycle.append('set_properties')
+
+    def start(self):
+        super().start()
+        self.lifecycle.append('start')
+        self.threads['start'].append(threading.get_ident())
+
+    def stop(self):
+        super().stop()
+        self.lifecycle.append('stop')
+
+    def reset(self):
+        super().reset()
+        self.lifecycle.append('reset')
+        self.threads['reset'].append(threading.get_ident())
+
+
+class PrepareEpisodeTests(unittest.TestCase):
+    def test_episodes_start_in_background(self):
+        simulator = ThreadRecordingSimulator()
+        result = run_loopback(
+            simulator, 2, episode_length=3,
+            connection_options={'prepare_episodes': True})
+        self.assertEqual(2, result.episodes)
+        self.assertEqual(6, simulator.calls['predictions'])
+        # One start() per episode, the first prepared after
+        # SET_PROPERTIES, and every reset() in the background.
+        self.assertEqual(['set_properties', 'start', 'stop', 'reset',
+                          'start', 'stop', 'reset'], simulator.lifecycle)
+        main = threading.get_ident()
+        self.assertNotEqual(main, simulator.threads['start'][0])
+        self.assertNotIn(main, simulator.threads['reset'])
+
+    def test_properties_set_after_reset_apply_before_start(self):
+        simulator = ThreadRecordingSimulator()
+        connection = make_connection(simulator, prepare_episodes=True)
+        set_properties = server_message(ServerToSimulator.SET_PROPERTIES)
+        set_properties.set_properties_data.CopyFrom(
+            set_properties_data(gain=1.0))
+        lesson = server_message(ServerToSimulator.SET_PROPERTIES)
+        lesson.set_properties_data.CopyFrom(set_properties_data(gain=2.0))
+        websocket = ScriptedWebSocket([
+            set_properties, server_message(ServerToSimulator.START),
+            server_message(ServerToSimulator.STOP),
+            server_message(ServerToSimulator.RESET), lesson,
+            server_message(ServerToSimulator.START),
+            server_message(ServerToSimulator.FINISHED)])
+        asyncio.get_event_loop().run_until_complete(
+            connection.run_simulator_for_training(websocket))
+        self.assertEqual(['set_properties', 'start', 'stop', 'reset',
+                          'set_properties', 'start'], simulator.lifecycle)
+        self.assertEqual({'gain': 2.0}, simulator.properties)
+
+    def test_prepared_episode_uses_snapshot(self):
+        simulator = SnapshotSimulator()
+        run_loopback(simulator, 3, episode_length=2,
+                     reset_between_episodes=False,
+                     connection_options={'prepare_episodes': True,
+                                         'restore_snapshots': True})
+        self.assertEqual(1, simulator.calls['start'])
+        # Restored at the START of the second and third episodes.
+        self.assertEqual(2, simulator.calls['restore'])
+
+
+class TickRewardSimulator(CountingSimulator):
+    """Rewards 1, 2, 3, ... for successive ticks."""
+
+    def distance(self):
+        return float(self.steps)
+
+
+class ActionRepeatTests(unittest.TestCase):
+    def test_each_prediction_is_applied_repeatedly(self):
+        simulator = CountingSimulator()
+        result = run_loopback(simulator, 2, episode_length=4,
+                              connection_options={'action_repeat': 3})
+        self.assertEqual(2, result.episodes)
+        self.assertEqual(24, simulator.calls['predictions'])
+
+    def test_repeats_stop_at_terminal(self):
+        simulator = CountingSimulator(terminal_after=5)
+        run_loopback(simulator, 1, episode_length=10,
+                     connection_options={'action_repeat': 3})
+        self.assertEqual(5, simulator.calls['predictions'])
+
+    def test_reward_accumulation(self):
+        expected = {'sum': 6.0, 'last': 3.0, 'max': 3.0}
+        for accumulation, reward in expected.items():
+            connection = make_connection(
+                TickRewardSimulator(), action_repeat=3,
+                reward_accumulation=accumulation)
+            connection.handle_set_properties(set_properties_data(gain=1.0))
+            connection.handle_prediction(
+                prediction_data(force=1.0, boost=False))
+            to_server = connection.get_state_message()
+            self.assertEqual(reward, to_server.state_data.reward)
+
+    def test_invalid_options(self):
+        with self.assertRaises(ValueError):
+            BrainServerConnection(TRAINING_URL, "sim", CountingSimulator(),
+                                  action_repeat=0)
+        with self.assertRaises(ValueError):
+            BrainServerConnection(TRAINING_URL, "sim", CountingSimulator(),
+                                  reward_accumulation='mean')
+
+
+def run_against_server(simulator, num_episodes, connection_options=None,
+                       **server_options):
+    def brain_factory():
+        return LoopbackBrain(
+            PROPERTIES_SCHEMA, OUTPUT_SCHEMA, PREDICTION_SCHEMA,
+            {'gain': 1.0}, 'distance',
+            constant_policy(PREDICTION_SCHEMA, 1.0), 3, num_episodes)
+
+    server = StandInServer(brain_factory, **server_options)
+    connection_options = dict(connection_options or {},
+                              max_reconnect_attempts=3,
+                              reconnect_backoff=0.001)
+
+    async def run():
+        await server.start()
+        connection = BrainServerConnection(
+            server.url, "sim", simulator, **connection_options)
+        try:
+            await connection.run_until_complete()
+        finally:
+            await server.close()
+        return connection
+
+    return server, asyncio.get_event_loop().run_until_complete(run())
+
+
+class ReconnectTests(unittest.TestCase):
+    def test_reconnects_after_drops(self):
+        simulator = CountingSimulator()
+        with self.assertLogs('bonsai.brain_server_connection', 'ERROR'):
+            server, connection = run_against_server(
+                simulator, 2, drop_after=4, drop_count=2)
+        self.assertEqual(3, len(server.brains))
+        self.assertEqual('finished', server.brains[-1].phase)
+        self.assertEqual(2, len(connection.reconnect_downtimes))
+        self.assertTrue(all(d >= 0 for d in connection.reconnect_downtimes))
+        # The schemas sent on each connection are reconstituted once.
+        self.assertEqual(3, len(connection._schema_classes))
+
+    def test_gives_up_after_max_attempts(self):
+        # Nothing listens on a port freed right after binding it.
+        with socket.socket() as listener:
+            listener.bind(('127.0.0.1', 0))
+            port = listener.getsockname()[1]
+        connection = BrainServerConnection(
+            "ws://127.0.0.1:{}/v1/user/brain/sims/ws".format(port), "sim",
+            CountingSimulator(), max_reconnect_attempts=2,
+            reconnect_backoff=0.001)
+        with self.assertLogs('bonsai.brain_server_connection', 'ERROR'):
+            with self.assertRaises(OSError):
+                asyncio.get_event_loop().run_until_complete(
+                    connection.run_until_complete())
+        self.assertEqual(2, connection._reconnect_attempt)
+
+    def test_simulator_errors_are_not_retried(self):
+        class FailingSimulator(CountingSimulator):
+            def set_prediction(self, force, boost):
+                raise OSError("device unavailable")
+
+        connect = websockets.connect
+        with mock.patch.object(websockets, 'connect',
+                               side_effect=connect) as connects:
+            with self.assertRaises(OSError):
+                run_against_server(FailingSimulator(), 2)
+        self.assertEqual(1, connects.call_count)
+
+    def test_no_reconnect_by_default(self):
+        connection = BrainServerConnection(
+            TRAINING_URL, "sim", CountingSimulator())
+        self.assertEqual(0, connection.max_reconnect_attempts)
+
+
+class FieldAccountingTests(unittest.TestCase):
+    def test_states_and_actions_are_accounted(self):
+        simulator = CountingSimulator()
+        with self.assertLogs('bonsai.brain_server_connection', 'INFO') as logs:
+            _, connection = run_against_server(
+                simulator, 2, connection_options={'field_accounting': True})
+        rows = {row[:2]: row[2:] for row in connection.field_accounting.rows()}
+        self.assertEqual({('output', 'position'), ('prediction', 'force'),
+                          ('prediction', 'boost')}, set(rows))
+        # One state for each START and for each of the 3 predictions.
+        self.assertEqual(8, rows[('output', 'position')][0])
+        self.assertTrue(any('output.position' in line
+                            for line in logs.output))
+
+    def test_off_by_default(self):
+        connection = BrainServerConnection(
+            TRAINING_URL, "sim", CountingSimulator())
+        self.assertIsNone(connection.field_accounting)
+
+
+class MapSimulator(CountingSimulator):
+    def __init__(self):
+        super().__init__()
+        self.map_version = 0
+
+    def get_state(self):
+        return {'map': Luminance(1, 1, [float(self.map_version)]),
+                'position': self.position}
+
+    def get_state_versions(self):
+        return {'map': self.map_version}
+
+
+class MemoizeFieldsTests(unittest.TestCase):
+    def test_states_use_simulator_versions(self):
+        output_schema = make_schema(
+            'output', [('map', FieldDescriptorProto.TYPE_MESSAGE),
+                       ('position', FieldDescriptorProto.TYPE_FLOAT)])
+        output_schema.field[0].type_name = (
+            'bonsai.inkling_types.proto.Luminance')
+        simulator = MapSimulator()
+        connection = make_connection(simulator, memoize_fields=True)
+        connection.output_schema = MessageBuilder().reconstitute(
+            output_schema)
+
+        states = []
+        for version in (0, 0, 1):
+            simulator.map_version = version
+            simulator.position = 2.0
+            data = connection.get_state_message().state_data.state
+            states.append(connection.output_schema.FromString(data))
+        self.assertEqual(states[0], states[1])
+        self.assertEqual(1.0, struct.unpack('f', states[2].map.pixels)[0])
+        self.assertEqual(2.0, states[2].position)
+
+    def test_off_by_default(self):
+        connection = BrainServerConnection(
+            TRAINING_URL, "sim", MapSimulator())
+        self.assertFalse(connection._uses_state_versions)
+
+
+class MemoryBudgetTests(unittest.TestCase):
+    def test_reconnects_with_fresh_state_over_budget(self):
+        # Over budget at the tenth message only.
+        sizes = iter([1 << 20, 3 << 20])
+
+        def fake_resident_set_size():
+            return next(sizes, 1 << 20)
+
+        simulator = CountingSimulator()
+        with mock.patch.object(memory_telemetry, 'resident_set_size',
+                               side_effect=fake_resident_set_size):
+            with self.assertLogs('bonsai.brain_server_connection',
+                                 'WARNING'):
+                server, connection = run_against_server(
+                    simulator, 3, connection_options={
+                        'memory_interval': 10, 'memory_budget': 2 << 20})
+        self.assertEqual(1, connection.memory_rebuilds)
+        self.assertEqual(2, len(server.brains))
+        self.assertEqual('finished', server.brains[-1].phase)
+
+    def test_gives_up_if_rebuild_does_not_help(self):
+        simulator = CountingSimulator()
+        with mock.patch.object(memory_telemetry, 'resident_set_size',
+                               return_value=3 << 20):
+            with self.assertLogs('bonsai.brain_server_connection',
+                                 'WARNING'):
+                with self.assertRaises(MemoryBudgetExceeded):
+                    run_against_server(simulator, 3, connection_options={
+                        'memory_interval': 10, 'memory_budget': 2 << 20})
+
+
+class LowLatencyGcTests(unittest.TestCase):
+    def test_collections_run_at_episode_boundaries(self):
+        simulator = CountingSimulator()
+        thresholds = gc.get_threshold()
+        with mock.patch.object(GcControl, 'boundary',
+                               autospec=True) as boundary:
+            _, connection = run_against_server(
+                simulator, 2, connection_options={'low_latency_gc': True})
+        # SET_PROPERTIES, then STOP and RESET of each episode.
+        self.assertEqual(5, boundary.call_count)
+        self.assertEqual(thresholds, gc.get_threshold())
+
+    def test_rebuild_thaws_before_collecting(self):
+        sizes = iter([1 << 20, 3 << 20])
+
+        def fake_resident_set_size():
+            return next(sizes, 1 << 20)
+
+        with mock.patch.object(memory_telemetry, 'resident_set_size',
+                               side_effect=fake_resident_set_size), \
+                mock.patch.object(GcControl, 'thaw', autospec=True,
+                                  wraps=GcControl.thaw) as thaw:
+            with self.assertLogs('bonsai.brain_server_connection',
+                                 'WARNING'):
+                _, connection = run_against_server(
+                    CountingSimulator(), 3, connection_options={
+                        'low_latency_gc': True, 'memory_interval': 10,
+                        'memory_budget': 2 << 20})
+        self.assertEqual(1, connection.memory_rebuilds)
+        # Once by each start() and once by the rebuild.
+        self.assertEqual(3, thaw.call_count)
+
+    def test_prediction_session(self):
+        def brain_factory():
+            return LoopbackBrain(
+                PROPERTIES_SCHEMA, OUTPUT_SCHEMA, PREDICTION_SCHEMA,
+                {'gain': 1.0}, 'distance',
+                constant_policy(PREDICTION_SCHEMA, 1.0), 4,
+                2)
+
+        async def run():
+            server = StandInServer(brain_factory)
+            await server.start()
+            connection = BrainServerConnection(
+                server.prediction_url, "sim", simulator,
+                low_latency_gc=True)
+            try:
+                await connection.run_until_complete()
+            finally:
+                await server.close()
+
+        simulator = CountingSimulator(terminal_after=3)
+        with self.assertLogs('bonsai.brain_server_connection', 'ERROR'):
+            asyncio.get_event_loop().run_until_complete(run())
+        # The first episode ends at the terminal state after 3
+        # predictions. Nothing resets the simulator in prediction, so
+        # the second ends at the state after the next prediction.
+        self.assertEqual(4, simulator.calls['predictions'])
+
+
+class ListGenerator(Generator):
+    def __init__(self, samples):
+        super().__init__()
+        self.samples = list(samples)
+
+    def next_data(self):
+        return self.samples.pop(0)
+
+
+class BatchGenerator(Generator):
+    def __init__(self, batches):
+        super().__init__()
+        self.batches = batches
+        self.counts = []
+
+    def next_data_batch(self, count):
+        self.counts.append(count)
+        labels = self.batches.pop(0)
+        return {'label': labels,
+                'image': LuminanceBatch(1, 1, struct.pack(
+                    '{}f'.format(len(labels)), *labels))}
+
+
+class AsyncIteratorGenerator(Generator):
+    def __init__(self, labels):
+        super().__init__()
+        self.labels = labels
+        self.fetched = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await asyncio.sleep(0)
+        if not self.labels:
+            raise StopAsyncIteration
+        self.fetched += 1
+        return {'label': self.labels.pop(0), 'image': Luminance(0, 0, [])}
+
+
+class AsyncNextDataGenerator(Generator):
+    def __init__(self, samples):
+        super().__init__()
+        self.samples = samples
+
+    async def next_data(self):
+        await asyncio.sleep(0)
+        if not self.samples:
+            raise ValueError("the source went away")
+        return self.samples.pop(0)
+
+
+class ScriptedWebSocket:
+    def __init__(self, replies):
+        self.sent = []
+        self.replies = replies
+
+    async def send(self, data):
+        self.sent.append(data)
+
+    async def recv(self):
+        return self.replies.pop(0).SerializeToString()
+
+
+def server_message(message_type):
+    message = ServerToSimulator()
+    message.message_type = message_type
+    return message
+
+
+class GeneratorEncodingTests(unittest.TestCase):
+    def test_mnist_schema_encodes_as_before(self):
+        image = Luminance(2, 1, [0.25, 0.75])
+        connection = BrainServerConnection(
+            TRAINING_URL, "gen", ListGenerator([{'label': 7, 'image': image}]))
+        output_schema = DescriptorProto()
+        MNIST_training_data_schema.DESCRIPTOR.CopyToProto(output_schema)
+        connection.output_schema = MessageBuilder().reconstitute(
+            output_schema)
+
+        expected = MNIST_training_data_schema()
+        expected.label = 7
+        expected.image.width = 2
+        expected.image.height = 1
+        expected.image.pixels = image.pixels
+        self.assertEqual(
+            expected.SerializeToString(),
+            connection.get_next_data_message().SerializeToString())
+
+    def test_any_output_schema_and_batches(self):
+        connection = BrainServerConnection(
+            TRAINING_URL, "gen", ListGenerator([]))
+        connection.output_schema = MessageBuilder().reconstitute(make_schema(
+            'sample', [('x', FieldDescriptorProto.TYPE_FLOAT),
+                       ('y', FieldDescriptorProto.TYPE_INT32)]))
+        encoded = connection.encode_data_batch(
+            [{'x': 0.5, 'y': 1}, {'x': 1.5, 'y': 2}])
+        decoded = [connection.output_schema.FromString(data)
+                   for data in encoded]
+        self.assertEqual([(0.5, 1), (1.5, 2)],
+                         [(message.x, message.y) for message in decoded])
+
+    def test_data_batches_are_split_into_messages(self):
+        generator = BatchGenerator([[1, 2, 3], [4, 5], [6], []])
+        connection = BrainServerConnection(
+            TRAINING_URL, "gen", generator, data_batch_size=3)
+        output_schema = DescriptorProto()
+        MNIST_training_data_schema.DESCRIPTOR.CopyToProto(output_schema)
+        connection.output_schema = MessageBuilder().reconstitute(
+            output_schema)
+        set_properties = server_message(ServerToSimulator.SET_PROPERTIES)
+        set_properties.set_properties_data.CopyFrom(
+            set_properties_data(gain=1.0))
+        set_properties.set_properties_data.reward_name = ''
+        connection.properties_schema = MessageBuilder().reconstitute(
+            PROPERTIES_SCHEMA)
+        # Samples 5 and 6 are sent after SET_PROPERTIES, dropping 3.
+        websocket = ScriptedWebSocket(
+            [server_message(ServerToSimulator.PREDICTION)] +
+            [set_properties] +
+            [server_message(ServerToSimulator.PREDICTION)] * 3)
+        asyncio.get_event_loop().run_until_complete(
+            connection.run_generator_for_training(websocket))
+
+        samples = [connection.output_schema.FromString(data)
+                   for data in websocket.sent]
+        self.assertEqual([1, 2, 4, 5, 6],
+                         [sample.label for sample in samples])
+        self.assertEqual(
+            [4.0, 5.0], [struct.unpack('f', sample.image.pixels)[0]
+                         for sample in samples[2:4]])
+        self.assertEqual([3, 3, 3, 3], generator.counts)
+
+    def test_async_iterators_are_fetched_within_the_send_window(self):
+        generator = AsyncIteratorGenerator(list(range(1, 11)))
+        connection = BrainServerConnection(
+            TRAINING_URL, "gen", generator, send_window=2)
+        connection.output_schema = MessageBuilder().reconstitute(
+            make_schema('sample',
+                        [('label', FieldDescriptorProto.TYPE_INT32)]))
+        ahead = []
+
+        class WindowWebSocket(ScriptedWebSocket):
+            async def send(self, data):
+                await super().send(data)
+                ahead.append(generator.fetched - len(self.sent))
+
+            async def recv(self):
+                # Waits for the server long enough to fill the window.
+                for _ in range(10):
+                    await asyncio.sleep(0)
+                return await super().recv()
+
+        websocket = WindowWebSocket(
+            [server_message(ServerToSimulator.PREDICTION)] * 10)
+        asyncio.get_event_loop().run_until_complete(
+            connection.run_generator_for_training(websocket))
+
+        self.assertEqual(list(range(1, 11)),
+                         [connection.output_schema.FromString(data).label
+                          for data in websocket.sent])
+        # The fetch task stays a full window, and no more, ahead.
+        self.assertEqual(2, max(ahead))
+
+    def test_samples_fetched_before_set_properties_are_not_sent(self):
+        class GainGenerator(Generator):
+            def __init__(self):
+                super().__init__()
+                self.properties = {'gain': 1.0}
+                self.fetched = 0
+
+            def __aiter__(self):
+                return self
+
+            async def __anext__(self):
+                # The label records the gain when the fetch began.
+                gain = self.properties['gain']
+                await asyncio.sleep(0)
+                self.fetched += 1
+                return {'label': int(gain) * 100 + self.fetched}
+
+        generator = GainGenerator()
+        connection = make_connection(generator, send_window=2)
+        connection.output_schema = MessageBuilder().reconstitute(
+            make_schema('sample',
+                        [('label', FieldDescriptorProto.TYPE_INT32)]))
+        set_properties = server_message(ServerToSimulator.SET_PROPERTIES)
+        set_properties.set_properties_data.CopyFrom(
+            set_properties_data(gain=2.0))
+        set_properties.set_properties_data.reward_name = ''
+
+        class FillingWebSocket(ScriptedWebSocket):
+            async def recv(self):
+                # Fills the window, with one more sample waiting for room.
+                for _ in range(10):
+                    await asyncio.sleep(0)
+                return await super().recv()
+
+        websocket = FillingWebSocket(
+            [set_properties] +
+            [server_message(ServerToSimulator.PREDICTION)] * 2 +
+            [server_message(ServerToSimulator.FINISHED)])
+        asyncio.get_event_loop().run_until_complete(
+            connection.run_generator_for_training(websocket))
+
+        labels = [connection.output_schema.FromString(data).label
+                  for data in websocket.sent]
+        self.assertEqual(101, labels[0])
+        self.assertEqual(4, len(labels))
+        self.assertTrue(all(label > 200 for label in labels[1:]), labels)
+
+    def test_async_next_data_errors_end_the_session(self):
+        generator = AsyncNextDataGenerator([{'label': 1}, {'label': 2}])
+        connection = BrainServerConnection(TRAINING_URL, "gen", generator)
+        connection.output_schema = MessageBuilder().reconstitute(
+            make_schema('sample',
+                        [('label', FieldDescriptorProto.TYPE_INT32)]))
+        websocket = ScriptedWebSocket(
+            [server_message(ServerToSimulator.PREDICTION)] * 2)
+        with self.assertRaisesRegex(ValueError, "source went away"):
+            asyncio.get_event_loop().run_until_complete(
+                connection.run_generator_for_training(websocket))
+        self.assertEqual(2, len(websocket.sent))
+
+
+if __name__ == '__main__':
+    unittest.main()
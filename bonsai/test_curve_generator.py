@@ -0,0 +1,91 @@
+import asyncio
+import struct
+import unittest
+from unittest import mock
+
+from google.protobuf.descriptor_pb2 import DescriptorProto
+
+from bonsai import curve_generator
+from bonsai.brain_server_connection import BrainServerConnection
+from bonsai.common.message_builder import MessageBuilder
+from bonsai.curve_generator import CurveGenerator
+from bonsai.proto.curve_generator_pb2 import (
+    CurveGeneratorSetPropertiesRequestData, MNIST_training_data_schema)
+from bonsai.proto.generator_simulator_api_pb2 import ServerToSimulator
+from bonsai.test_brain_server_connection import (
+    ScriptedWebSocket, server_message, TRAINING_URL)
+
+
+def reconstitute(message_class):
+    schema = DescriptorProto()
+    message_class.DESCRIPTOR.CopyToProto(schema)
+    return MessageBuilder().reconstitute(schema)
+
+
+def image_rows(image):
+    pixels = struct.unpack('{}f'.format(image.width * image.height),
+                           image.pixels)
+    return [pixels[row * image.width:(row + 1) * image.width]
+            for row in range(image.height)]
+
+
+class CurveGeneratorTests(unittest.TestCase):
+    def check_batch(self, generator):
+        batch = generator.next_data_batch(50)
+        self.assertEqual(50, len(batch['label']))
+        self.assertEqual(50, len(batch['image']))
+        self.assertEqual({0, 1}, set(int(label) for label in batch['label']))
+        for index in range(50):
+            image = batch['image'][index]
+            self.assertEqual((28, 28), (image.width, image.height))
+            values = sum(image_rows(image), ())
+            self.assertTrue(all(0.0 <= value <= 1.0 for value in values))
+            self.assertGreater(max(values), 0.5)
+
+    @unittest.skipIf(curve_generator.numpy is None, "numpy is not installed")
+    def test_numpy_batches(self):
+        self.check_batch(CurveGenerator(seed=1))
+
+    def test_batches_without_numpy(self):
+        with mock.patch.object(curve_generator, 'numpy', None):
+            self.check_batch(CurveGenerator(seed=1))
+
+    def test_zero_curviness_draws_straight_lines(self):
+        generator = CurveGenerator(width=5, height=5, seed=2)
+        generator.set_properties(curviness=0.0)
+        sample = generator.next_data()
+        self.assertEqual(0, sample['label'])
+        # The brightest row of each column moves by at most one row
+        # from column to column.
+        rows = image_rows(sample['image'])
+        brightest = [max(range(5), key=lambda row: rows[row][column])
+                     for column in range(5)]
+        for left, right in zip(brightest, brightest[1:]):
+            self.assertLessEqual(abs(left - right), 1)
+
+    def test_connection_honours_curviness(self):
+        generator = CurveGenerator(seed=3)
+        connection = BrainServerConnection(TRAINING_URL, "gen", generator,
+                                           data_batch_size=4)
+        connection.properties_schema = reconstitute(
+            CurveGeneratorSetPropertiesRequestData)
+        connection.output_schema = reconstitute(MNIST_training_data_schema)
+        set_properties = server_message(ServerToSimulator.SET_PROPERTIES)
+        set_properties.set_properties_data.dynamic_properties = (
+            CurveGeneratorSetPropertiesRequestData(
+                curviness=0.25).SerializeToString())
+        websocket = ScriptedWebSocket(
+            [set_properties] +
+            [server_message(ServerToSimulator.PREDICTION)] * 4 +
+            [server_message(ServerToSimulator.FINISHED)])
+        asyncio.get_event_loop().run_until_complete(
+            connection.run_generator_for_training(websocket))
+        self.assertEqual({'curviness': 0.25}, generator.properties)
+        self.assertEqual(6, len(websocket.sent))
+        for data in websocket.sent:
+            sample = MNIST_training_data_schema.FromString(data)
+            self.assertEqual(28 * 28 * 4, len(sample.image.pixels))
+
+
+if __name__ == '__main__':
+    unittest.main()
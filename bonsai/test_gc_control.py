@@ -0,0 +1,89 @@
+import gc
+import unittest
+import weakref
+from unittest import mock
+
+from bonsai import gc_control
+from bonsai.gc_control import GcControl
+
+
+class GcControlTests(unittest.TestCase):
+    def setUp(self):
+        self.thresholds = gc.get_threshold()
+        self.control = GcControl(max_deferred=5)
+        self.addCleanup(self.control.close)
+
+    def full_collections(self):
+        return sum(1 for generation, _ in self.control.pauses
+                   if generation == 2)
+
+    def test_full_collections_wait_for_boundary(self):
+        self.control.start()
+        self.assertEqual(1, self.full_collections())
+        self.assertEqual(self.thresholds[:2], gc.get_threshold()[:2])
+        self.assertGreater(gc.get_threshold()[2], self.thresholds[2])
+
+        # Not due while the oldest generation is under its threshold.
+        self.control.boundary()
+        self.assertEqual(1, self.full_collections())
+        for _ in range(self.thresholds[2] + 1):
+            gc.collect(1)
+        # Nor while the heap has not grown.
+        self.control.boundary()
+        self.assertEqual(1, self.full_collections())
+        with mock.patch.object(gc_control.sys, 'getallocatedblocks',
+                               return_value=1 << 40):
+            self.control.boundary()
+        self.assertEqual(2, self.full_collections())
+
+    def test_step_collects_past_max_deferred(self):
+        self.control.start()
+        self.control.step()
+        for _ in range(5):
+            gc.collect(1)
+        self.control.step()
+        self.assertEqual(2, self.full_collections())
+
+    def test_close_restores_collector(self):
+        self.control.start()
+        self.assertIn('generation 2', self.control.report())
+        self.control.close()
+        self.assertEqual(self.thresholds, gc.get_threshold())
+        self.assertNotIn(self.control._callback, gc.callbacks)
+        if hasattr(gc, 'get_freeze_count'):
+            self.assertEqual(0, gc.get_freeze_count())
+
+    def test_collector_is_restored_when_the_last_user_closes(self):
+        other = GcControl()
+        self.addCleanup(other.close)
+        self.control.start()
+        other.start()
+        self.control.start()
+        self.control.close()
+        self.assertGreater(gc.get_threshold()[2], self.thresholds[2])
+        other.close()
+        self.assertEqual(self.thresholds, gc.get_threshold())
+
+    def test_callback_is_registered_by_start(self):
+        self.assertNotIn(self.control._callback, gc.callbacks)
+        self.control.start()
+        self.assertIn(self.control._callback, gc.callbacks)
+
+    def test_thaw_lets_a_rebuild_reclaim_frozen_cycles(self):
+        class Node(object):
+            pass
+
+        self.control.start()
+        node = Node()
+        node.cycle = node
+        reference = weakref.ref(node)
+        # A reconnect starts again, freezing the cycle while it is live.
+        self.control.start()
+        del node
+        self.control.thaw()
+        gc.collect()
+        self.assertIsNone(reference())
+
+
+if __name__ == '__main__':
+    unittest.main()
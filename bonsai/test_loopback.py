@@ -0,0 +1,177 @@
+import asyncio
+import unittest
+
+from google.protobuf.descriptor_pb2 import DescriptorProto
+from google.protobuf.descriptor_pb2 import FieldDescriptorProto
+
+from bonsai.loopback import LoopbackDriver, constant_policy, random_policy
+from bonsai.simulator import AsyncSimulator, Simulator
+
+
+def make_schema(name, fields):
+    schema = DescriptorProto()
+    schema.name = name
+    for number, (field_name, field_type) in enumerate(fields, 1):
+        field = schema.field.add()
+        field.name = field_name
+        field.number = number
+        field.type = field_type
+        field.label = FieldDescriptorProto.LABEL_OPTIONAL
+    return schema
+
+
+PROPERTIES_SCHEMA = make_schema(
+    'properties', [('gain', FieldDescriptorProto.TYPE_FLOAT)])
+OUTPUT_SCHEMA = make_schema(
+    'output', [('position', FieldDescriptorProto.TYPE_FLOAT)])
+PREDICTION_SCHEMA = make_schema(
+    'prediction', [('force', FieldDescriptorProto.TYPE_FLOAT),
+                   ('boost', FieldDescriptorProto.TYPE_BOOL)])
+
+
+class CountingSimulator(Simulator):
+    def __init__(self, terminal_after=None):
+        super().__init__()
+        self.terminal_after = terminal_after
+        self.position = 0.0
+        self.steps = 0
+        self.calls = {'start': 0, 'stop': 0, 'reset': 0, 'predictions': 0}
+
+    def start(self):
+        self.calls['start'] += 1
+        self.steps = 0
+
+    def stop(self):
+        self.calls['stop'] += 1
+
+    def reset(self):
+        self.calls['reset'] += 1
+
+    def set_prediction(self, force, boost):
+        self.calls['predictions'] += 1
+        self.position += force
+        self.steps += 1
+
+    def get_state(self):
+        return {'position': self.position}
+
+    def distance(self):
+        return -abs(self.position)
+
+    def get_terminal(self):
+        return (self.terminal_after is not None and
+                self.steps >= self.terminal_after)
+
+
+class FusedSimulator(CountingSimulator):
+    def __init__(self):
+        super().__init__()
+        self.fused_calls = []
+
+    def get_state(self):
+        raise AssertionError("get_state() should not be called")
+
+    def get_terminal(self):
+        raise AssertionError("get_terminal() should not be called")
+
+    def get_state_reward_terminal(self, reward_name):
+        self.fused_calls.append(reward_name)
+        return {'position': self.position}, self.distance(), False
+
+
+class CountingAsyncSimulator(AsyncSimulator):
+    def __init__(self):
+        super().__init__()
+        self.position = 0.0
+        self.calls = {'start': 0, 'stop': 0, 'reset': 0, 'predictions': 0}
+
+    async def start(self):
+        self.calls['start'] += 1
+
+    async def stop(self):
+        self.calls['stop'] += 1
+
+    async def reset(self):
+        self.calls['reset'] += 1
+
+    async def set_prediction(self, force, boost):
+        await asyncio.sleep(0)
+        self.calls['predictions'] += 1
+        self.position += force
+
+    async def get_state(self):
+        await asyncio.sleep(0)
+        return {'position': self.position}
+
+    async def distance(self):
+        return -abs(self.position)
+
+    async def get_terminal(self):
+        return False
+
+
+class LoopbackDriverTests(unittest.TestCase):
+    def make_driver(self, simulator, **kwargs):
+        return LoopbackDriver(
+            simulator, PROPERTIES_SCHEMA, OUTPUT_SCHEMA, PREDICTION_SCHEMA,
+            properties={'gain': 2.0}, reward_name='distance', **kwargs)
+
+    def test_codec_run_follows_message_sequence(self):
+        simulator = CountingSimulator()
+        result = self.make_driver(simulator, episode_length=5).run(3)
+        self.assertEqual(3, result.episodes)
+        self.assertEqual(
+            {'start': 3, 'stop': 3, 'reset': 3, 'predictions': 15},
+            simulator.calls)
+        self.assertEqual({'gain': 2.0}, simulator.properties)
+        # SET_PROPERTIES + 3 * (START + 5 PREDICTION + STOP + RESET)
+        self.assertEqual(25, result.messages)
+
+    def test_codec_and_direct_runs_count_the_same_messages(self):
+        with_codec = self.make_driver(
+            CountingSimulator(terminal_after=3), episode_length=10).run(4)
+        without_codec = self.make_driver(
+            CountingSimulator(terminal_after=3), episode_length=10).run(
+                4, codec=False)
+        self.assertEqual(with_codec.messages, without_codec.messages)
+        self.assertEqual(with_codec.episodes, without_codec.episodes)
+
+    def test_async_simulator_is_awaited(self):
+        simulator = CountingAsyncSimulator()
+        result = self.make_driver(simulator, episode_length=4).run(2)
+        self.assertEqual(
+            {'start': 2, 'stop': 2, 'reset': 2, 'predictions': 8},
+            simulator.calls)
+        self.assertEqual({'gain': 2.0}, simulator.properties)
+        direct = self.make_driver(
+            CountingAsyncSimulator(), episode_length=4).run(2, codec=False)
+        self.assertEqual(result.messages, direct.messages)
+
+    def test_fused_step_is_preferred(self):
+        simulator = FusedSimulator()
+        with_codec = self.make_driver(simulator, episode_length=3).run(2)
+        self.assertEqual(['distance'] * 8, simulator.fused_calls)
+        without_codec = self.make_driver(
+            FusedSimulator(), episode_length=3).run(2, codec=False)
+        self.assertEqual(with_codec.messages, without_codec.messages)
+
+    def test_without_reset_between_episodes(self):
+        simulator = CountingSimulator()
+        self.make_driver(
+            simulator, episode_length=2, reset_between_episodes=False).run(2)
+        self.assertEqual(0, simulator.calls['reset'])
+
+    def test_policies_cover_prediction_fields(self):
+        prediction = random_policy(PREDICTION_SCHEMA, seed=1)()
+        self.assertEqual({'force', 'boost'}, set(prediction))
+        self.assertTrue(-1.0 <= prediction['force'] <= 1.0)
+        self.assertEqual({'force': 0, 'boost': False},
+                         constant_policy(PREDICTION_SCHEMA)())
+
+    def test_rejects_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            self.make_driver(CountingSimulator(), policy='greedy')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import tracemalloc
+import unittest
+from unittest import mock
+
+from bonsai import memory_telemetry
+from bonsai.memory_telemetry import MemoryBudgetExceeded, MemoryTelemetry
+from bonsai.memory_telemetry import resident_set_size
+
+
+class MemoryTelemetryTests(unittest.TestCase):
+    def test_resident_set_size(self):
+        self.assertGreater(resident_set_size(), 0)
+
+    def test_samples_every_interval(self):
+        sizes = iter(range(100, 200, 10))
+        with mock.patch.object(memory_telemetry, 'resident_set_size',
+                               side_effect=lambda: next(sizes)):
+            telemetry = MemoryTelemetry(interval=2)
+            with self.assertLogs('bonsai.memory_telemetry', 'INFO'):
+                for _ in range(5):
+                    telemetry.before('START')
+                    telemetry.after('START')
+        self.assertEqual([(2, 110), (4, 120)], list(telemetry.samples))
+        self.assertEqual(120, telemetry.peak_rss)
+
+    def test_budget(self):
+        with mock.patch.object(memory_telemetry, 'resident_set_size',
+                               return_value=2 << 20):
+            telemetry = MemoryTelemetry(interval=1, budget=1 << 20)
+            with self.assertLogs('bonsai.memory_telemetry', 'INFO'):
+                with self.assertRaises(MemoryBudgetExceeded):
+                    telemetry.after('START')
+            telemetry.budget = 4 << 20
+            telemetry.check_budget()
+
+    def test_budget_needs_current_size(self):
+        with mock.patch.object(memory_telemetry, 'current_resident_set_size',
+                               return_value=None):
+            with self.assertLogs('bonsai.memory_telemetry', 'WARNING'):
+                telemetry = MemoryTelemetry(interval=1, budget=1)
+        self.assertIsNone(telemetry.budget)
+        telemetry.check_budget(2)
+
+    def test_traces_growth_per_phase(self):
+        telemetry = MemoryTelemetry(interval=1, trace=True)
+        self.addCleanup(telemetry.close)
+        leaked = []
+        with self.assertLogs('bonsai.memory_telemetry', 'INFO'):
+            # Phases are traced at their first message after a sample
+            # that has seen them, here in the second round.
+            for _ in range(2):
+                for phase in ('RESET', 'PREDICTION'):
+                    telemetry.before(phase)
+                    if phase == 'PREDICTION':
+                        leaked.append(bytearray(1 << 20))
+                    telemetry.after(phase)
+        self.assertEqual({'RESET', 'PREDICTION'}, set(telemetry.phase_growth))
+        location, size, count = telemetry.phase_growth['PREDICTION'][0]
+        self.assertIn('test_memory_telemetry.py', location)
+        self.assertGreaterEqual(size, 1 << 20)
+        self.assertIn('Growth while handling PREDICTION',
+                      telemetry.report())
+
+        telemetry.close()
+        self.assertFalse(tracemalloc.is_tracing())
+
+
+if __name__ == '__main__':
+    unittest.main()
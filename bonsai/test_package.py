@@ -0,0 +1,43 @@
+import os
+import subprocess
+import sys
+import unittest
+
+import bonsai
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def modules_after(statement, modules):
+    program = "import sys\n{}\nprint(' '.join(m for m in {!r} " \
+              "if m in sys.modules))".format(statement, modules)
+    output = subprocess.check_output(
+        [sys.executable, "-c", program], cwd=ROOT, universal_newlines=True)
+    return output.split()
+
+
+class LazyImportTests(unittest.TestCase):
+    def test_import_bonsai_defers_heavy_modules(self):
+        heavy = ['websockets', 'numpy', 'bonsai_config',
+                 'bonsai.proto.generator_simulator_api_pb2',
+                 'bonsai.proto.curve_generator_pb2']
+        self.assertEqual([], modules_after("import bonsai", heavy))
+        self.assertEqual(
+            [], modules_after("from bonsai import Simulator", heavy))
+
+    def test_connection_defers_generator_and_config_modules(self):
+        self.assertEqual([], modules_after(
+            "import bonsai.brain_server_connection",
+            ['bonsai_config', 'bonsai.proto.curve_generator_pb2']))
+
+    def test_attributes_load_on_access(self):
+        from bonsai.brain_server_connection import BrainServerConnection
+        self.assertIs(BrainServerConnection, bonsai.BrainServerConnection)
+        self.assertIn('run_vector_simulator', dir(bonsai))
+        with self.assertRaises(AttributeError):
+            bonsai.no_such_attribute
+
+
+if __name__ == '__main__':
+    unittest.main()
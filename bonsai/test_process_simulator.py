@@ -0,0 +1,103 @@
+import unittest
+
+from bonsai.inkling_types import Luminance
+from bonsai.loopback import LoopbackDriver
+from bonsai.process_simulator import ProcessSimulator, _pack_into, _packed_size
+from bonsai.process_simulator import _unpack
+from bonsai.simulator import Simulator
+from bonsai.test_loopback import OUTPUT_SCHEMA, PREDICTION_SCHEMA
+from bonsai.test_loopback import PROPERTIES_SCHEMA
+
+
+class FrameSimulator(Simulator):
+    def __init__(self, width):
+        super().__init__()
+        self.width = width
+        self.position = 0.0
+
+    def set_prediction(self, force, boost):
+        if force > 100:
+            raise ValueError("force too large")
+        self.position += force
+
+    def get_state(self):
+        return {'position': self.position,
+                'frame': Luminance(self.width, 1,
+                                   [self.position] * self.width),
+                'name': 'frame', 'gain': self.properties.get('gain')}
+
+    def distance(self):
+        return -abs(self.position)
+
+    def get_terminal(self):
+        return False
+
+
+class ProcessSimulatorTests(unittest.TestCase):
+    def setUp(self):
+        self.simulator = ProcessSimulator(FrameSimulator, 4)
+        self.addCleanup(self.simulator.close)
+
+    def test_round_trips_state_reward_and_frames(self):
+        self.simulator.set_properties(gain=2.0)
+        self.simulator.start()
+        self.simulator.notify_prediction_received({'force': 1.5, 'boost': 1})
+        state, reward, terminal = self.simulator.get_state_reward_terminal(
+            'distance')
+        self.assertEqual(1.5, state['position'])
+        self.assertEqual(2.0, state['gain'])
+        self.assertEqual('frame', state['name'])
+        self.assertEqual(
+            Luminance(4, 1, [1.5] * 4).pixels, state['frame'].pixels)
+        self.assertEqual(-1.5, reward)
+        self.assertFalse(terminal)
+        self.assertEqual({'force': 1.5, 'boost': 1},
+                         self.simulator.get_last_action())
+        self.assertEqual(-1.5, self.simulator.distance())
+
+    def test_child_exceptions_are_raised_in_parent(self):
+        self.simulator.start()
+        self.simulator.set_prediction(force=1000.0, boost=False)
+        with self.assertRaises(RuntimeError) as context:
+            self.simulator.get_state()
+        self.assertIn("force too large", str(context.exception))
+        # Later calls still get their own replies.
+        self.simulator.set_prediction(force=2.0, boost=False)
+        self.assertEqual(2.0, self.simulator.get_state()['position'])
+
+    def test_only_the_active_reward_method_is_forwarded(self):
+        self.assertFalse(hasattr(self.simulator, 'distance'))
+        self.simulator.start()
+        self.simulator.get_state_reward_terminal('distance')
+        self.assertEqual(0.0, self.simulator.distance())
+        with self.assertRaises(AttributeError):
+            self.simulator.distnace()
+
+    def test_runs_under_loopback_driver(self):
+        driver = LoopbackDriver(
+            self.simulator, PROPERTIES_SCHEMA, OUTPUT_SCHEMA,
+            PREDICTION_SCHEMA, properties={'gain': 1.0},
+            reward_name='distance', episode_length=5)
+        self.assertEqual(3, driver.run(3).episodes)
+
+
+class PackingTests(unittest.TestCase):
+    def test_pack_round_trip(self):
+        values = {'a': 1, 'b': 2.5, 'c': True, 'd': None, 'e': 'text',
+                  'f': Luminance(1, 1, [0.5])}
+        buffer = bytearray(_packed_size(values))
+        self.assertEqual(len(buffer), _pack_into(buffer, 0, values))
+        unpacked, offset = _unpack(memoryview(buffer), 0)
+        self.assertEqual(len(buffer), offset)
+        self.assertEqual(values['f'].pixels, unpacked.pop('f').pixels)
+        values.pop('f')
+        self.assertEqual(values, unpacked)
+        self.assertIs(True, unpacked['c'])
+
+    def test_unsupported_values_are_rejected(self):
+        with self.assertRaises(TypeError):
+            _packed_size({'a': [1, 2]})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+
+from bonsai.brain_server_connection import BrainServerConnection
+from bonsai.proto.generator_simulator_api_pb2 import ServerToSimulator
+from bonsai.replay_generator import ReplayGenerator, write_shard
+from bonsai.test_brain_server_connection import TRAINING_URL
+
+
+class RecordingWebSocket:
+    def __init__(self, replies):
+        self.sent = []
+        self.replies = replies
+
+    async def send(self, data):
+        self.sent.append(data)
+
+    async def recv(self):
+        message = ServerToSimulator()
+        message.message_type = self.replies.pop(0)
+        return message.SerializeToString()
+
+
+class ReplayGeneratorTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.shards = []
+        for shard in range(4):
+            path = os.path.join(directory, "shard-{}".format(shard))
+            write_shard(path, ['{}-{}'.format(shard, i).encode()
+                               for i in range(25)])
+            self.shards.append(path)
+        self.samples = sorted('{}-{}'.format(shard, i).encode()
+                              for shard in range(4) for i in range(25))
+
+    def serve_all(self, generator):
+        served = []
+        while True:
+            try:
+                served.append(generator.next_encoded_data())
+            except StopIteration:
+                return served
+
+    def test_serves_every_sample_each_epoch(self):
+        generator = ReplayGenerator(self.shards, shuffle_buffer_size=16,
+                                    epochs=2, seed=1)
+        served = self.serve_all(generator)
+        self.assertEqual(sorted(self.samples * 2), sorted(served))
+        self.assertNotEqual(self.samples, served[:100])
+        self.assertEqual(2, generator.epoch)
+
+    def test_unshuffled_keeps_shard_order(self):
+        generator = ReplayGenerator(self.shards[:1], shuffle_buffer_size=1,
+                                    epochs=1)
+        self.assertEqual(['0-{}'.format(i).encode() for i in range(25)],
+                         self.serve_all(generator))
+
+    def test_parallel_readers(self):
+        generator = ReplayGenerator(self.shards, epochs=3, readers=3)
+        self.addCleanup(generator.close)
+        self.assertEqual(sorted(self.samples * 3),
+                         sorted(self.serve_all(generator)))
+
+    def test_connection_sends_samples_as_they_are(self):
+        generator = ReplayGenerator(self.shards[:1], shuffle_buffer_size=1,
+                                    epochs=1)
+        connection = BrainServerConnection(TRAINING_URL, "gen", generator)
+        websocket = RecordingWebSocket(
+            [ServerToSimulator.PREDICTION] * 3 + [ServerToSimulator.FINISHED])
+        asyncio.get_event_loop().run_until_complete(
+            connection.run_generator_for_training(websocket))
+        self.assertEqual([b'0-0', b'0-1', b'0-2', b'0-3'], websocket.sent)
+
+    def test_session_ends_when_samples_run_out(self):
+        generator = ReplayGenerator(self.shards[:1], epochs=1)
+        connection = BrainServerConnection(TRAINING_URL, "gen", generator)
+        websocket = RecordingWebSocket([ServerToSimulator.PREDICTION] * 30)
+        asyncio.get_event_loop().run_until_complete(
+            connection.run_generator_for_training(websocket))
+        self.assertEqual(25, len(websocket.sent))
+
+    def test_endless_epochs_of_empty_shards_are_an_error(self):
+        empty = os.path.join(os.path.dirname(self.shards[0]), "empty")
+        write_shard(empty, [])
+        generator = ReplayGenerator([empty, empty])
+        with self.assertRaises(ValueError):
+            generator.next_encoded_data()
+        finite = ReplayGenerator([empty], epochs=2)
+        with self.assertRaises(StopIteration):
+            finite.next_encoded_data()
+
+
+if __name__ == '__main__':
+    unittest.main()
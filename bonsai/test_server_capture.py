@@ -0,0 +1,51 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from bonsai.server_capture import ReplayDriver, read_capture
+from bonsai.test_brain_server_connection import run_against_server
+from bonsai.test_loopback import CountingSimulator
+
+
+class ServerCaptureTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, "session.cap")
+
+    def capture(self, simulator, **server_options):
+        run_against_server(simulator, 2,
+                           connection_options={'capture_path': self.path},
+                           **server_options)
+
+    def test_replay_repeats_the_simulator_calls(self):
+        recorded = CountingSimulator()
+        self.capture(recorded)
+        is_training, messages = read_capture(self.path)
+        self.assertTrue(is_training)
+
+        replayed = CountingSimulator()
+        result = ReplayDriver(self.path, replayed).run()
+        self.assertEqual(recorded.calls, replayed.calls)
+        self.assertEqual(2, result.episodes)
+        self.assertEqual(len(messages), result.messages)
+
+    def test_replay_spans_reconnects(self):
+        with self.assertLogs('bonsai.brain_server_connection', 'ERROR'):
+            self.capture(CountingSimulator(), drop_after=4)
+        replayed = CountingSimulator()
+        ReplayDriver(self.path, replayed).run()
+        self.assertEqual(3, replayed.calls['start'])
+
+    def test_replay_keeps_original_timing(self):
+        self.capture(CountingSimulator(), latency=0.005)
+        _, messages = read_capture(self.path)
+        span = messages[-1][0] - messages[0][0]
+        result = ReplayDriver(self.path, CountingSimulator(),
+                              timing=True).run()
+        self.assertGreaterEqual(result.elapsed, span * 0.9)
+
+
+if __name__ == '__main__':
+    unittest.main()
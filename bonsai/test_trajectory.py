@@ -0,0 +1,168 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from bonsai.brain_server_connection import BrainServerConnection
+from bonsai.brain_server_connection import _state_data_view
+from bonsai.common.message_builder import MessageBuilder
+from bonsai.proto.generator_simulator_api_pb2 import SimulationSourceData
+from bonsai.proto.generator_simulator_api_pb2 import SimulatorToServer
+from bonsai.test_brain_server_connection import run_loopback
+from bonsai.loopback import LoopbackBrain, constant_policy
+from bonsai.stand_in_server import StandInServer
+from bonsai.test_loopback import CountingSimulator, OUTPUT_SCHEMA
+from bonsai.test_loopback import PREDICTION_SCHEMA, PROPERTIES_SCHEMA
+from bonsai.trajectory import TrajectoryReader, TrajectoryRecorder
+
+
+class TrajectoryTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def read(self):
+        reader = TrajectoryReader(self.directory)
+        self.addCleanup(reader.close)
+        return reader
+
+    def test_records_round_trip_across_segments(self):
+        recorder = TrajectoryRecorder(
+            self.directory, segment_size=64, flush_size=16)
+        for episode in range(3):
+            recorder.start_episode()
+            for step in range(4):
+                recorder.record('{}:{}'.format(episode, step).encode())
+        recorder.close()
+
+        reader = self.read()
+        self.assertGreater(len(reader._maps), 1)
+        self.assertEqual(12, len(reader))
+        self.assertEqual([0, 1, 2], reader.episodes)
+        self.assertEqual([b'1:0', b'1:1', b'1:2', b'1:3'],
+                         [bytes(record) for record in reader.episode(1)])
+        self.assertEqual(b'2:3', bytes(reader.record(11)))
+
+    def test_recording_resumes_after_existing_episodes(self):
+        for _ in range(2):
+            recorder = TrajectoryRecorder(self.directory)
+            recorder.start_episode()
+            recorder.record(b'state')
+            recorder.close()
+        self.assertEqual([0, 1], self.read().episodes)
+
+    def test_records_before_the_first_episode_have_their_own(self):
+        recorder = TrajectoryRecorder(self.directory)
+        recorder.record(b'early')
+        recorder.start_episode()
+        recorder.record(b'started')
+        recorder.close()
+        reader = self.read()
+        self.assertEqual([0, 1], reader.episodes)
+        self.assertEqual([b'early'],
+                         [bytes(record) for record in reader.episode(0)])
+
+    def test_terminal_records_end_the_episode(self):
+        recorder = TrajectoryRecorder(self.directory)
+        for step in range(5):
+            recorder.record(b'step', terminal=step in (1, 3))
+        recorder.close()
+        self.assertEqual([2, 2, 1], [len(self.read().episode(episode))
+                                     for episode in range(3)])
+
+    def test_recording_after_close_is_an_error(self):
+        recorder = TrajectoryRecorder(self.directory)
+        recorder.close()
+        with self.assertRaises(ValueError):
+            recorder.record(b'late')
+
+    def test_new_segments_follow_the_highest_index(self):
+        for index in (0, 5):
+            with open(os.path.join(self.directory, "segment-{:06d}.traj"
+                                   .format(index)), 'wb'):
+                pass
+        recorder = TrajectoryRecorder(self.directory)
+        recorder.record(b'state')
+        recorder.close()
+        self.assertEqual(
+            ["segment-000000.traj", "segment-000005.traj",
+             "segment-000006.traj"], sorted(os.listdir(self.directory)))
+
+    def test_full_queue_waits_for_the_writer(self):
+        recorder = TrajectoryRecorder(self.directory, flush_size=1,
+                                      max_queued=1)
+        written = threading.Event()
+        write_loop = recorder._queue.get
+
+        def slow_get(*args, **kwargs):
+            written.wait()
+            return write_loop(*args, **kwargs)
+        recorder._queue.get = slow_get
+        timer = threading.Timer(0.3, written.set)
+        timer.start()
+        began = time.monotonic()
+        for step in range(3):
+            recorder.record(b'step')
+        self.assertGreater(time.monotonic() - began, 0.2)
+        recorder.close()
+        timer.join()
+        self.assertEqual(3, len(self.read()))
+
+    def test_connection_records_sent_states(self):
+        run_loopback(CountingSimulator(terminal_after=3), 2,
+                     connection_options={'trajectory_dir': self.directory})
+        reader = self.read()
+        self.assertEqual([0, 1], reader.episodes)
+        output_schema = MessageBuilder().reconstitute(OUTPUT_SCHEMA)
+        records = [SimulationSourceData.FromString(bytes(record))
+                   for record in reader.episode(1)]
+        # START and three predictions.
+        self.assertEqual([False, False, False, True],
+                         [bool(record.terminal) for record in records])
+        for record in records:
+            state = output_schema.FromString(record.state)
+            self.assertAlmostEqual(-abs(state.position), record.reward,
+                                   places=5)
+
+    def test_prediction_states_are_split_at_terminal_states(self):
+        def brain_factory():
+            return LoopbackBrain(
+                PROPERTIES_SCHEMA, OUTPUT_SCHEMA, PREDICTION_SCHEMA,
+                {'gain': 1.0}, 'distance',
+                constant_policy(PREDICTION_SCHEMA, 1.0), 4, 2)
+
+        async def run():
+            server = StandInServer(brain_factory)
+            await server.start()
+            connection = BrainServerConnection(
+                server.prediction_url, "sim",
+                CountingSimulator(terminal_after=3),
+                trajectory_dir=self.directory)
+            try:
+                await connection.run_until_complete()
+            finally:
+                await server.close()
+
+        with self.assertLogs('bonsai.brain_server_connection', 'ERROR'):
+            asyncio.get_event_loop().run_until_complete(run())
+        reader = self.read()
+        terminals = [[bool(SimulationSourceData.FromString(
+            bytes(record)).terminal) for record in reader.episode(episode)]
+            for episode in reader.episodes]
+        self.assertEqual([[False, False, False, True], [True]], terminals)
+
+    def test_state_data_view(self):
+        to_server = SimulatorToServer()
+        to_server.message_type = SimulatorToServer.STATE
+        to_server.state_data.state = b'x' * 300
+        to_server.state_data.reward = 1.5
+        self.assertEqual(
+            to_server.state_data.SerializeToString(),
+            bytes(_state_data_view(to_server.SerializeToString())))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import asyncio
+import unittest
+
+from bonsai.loopback import LoopbackBrain, LoopbackWebSocket, random_policy
+from bonsai.test_loopback import OUTPUT_SCHEMA, PREDICTION_SCHEMA
+from bonsai.test_loopback import PROPERTIES_SCHEMA
+from bonsai.vector_simulator import VectorSimulator
+from bonsai.vector_simulator import vector_simulator_connections
+
+
+class BatchSimulator(VectorSimulator):
+    def __init__(self, num_envs):
+        super().__init__(num_envs)
+        self.positions = [0.0] * num_envs
+        self.batch_sizes = []
+        self.starts = 0
+
+    def start(self, index):
+        self.starts += 1
+        self.positions[index] = 0.0
+
+    def set_predictions(self, indices, force, boost):
+        self.batch_sizes.append(len(indices))
+        for index, value in zip(indices, force):
+            self.positions[index] += value
+
+    def get_states(self, indices):
+        return {'position': [self.positions[i] for i in indices]}
+
+    def distance(self, indices):
+        return [-abs(self.positions[i]) for i in indices]
+
+    def get_terminals(self, indices):
+        return [False] * len(indices)
+
+
+class NetworkLikeWebSocket(LoopbackWebSocket):
+    """Yields to the event loop on recv(), as a real websocket would."""
+
+    async def recv(self):
+        await asyncio.sleep(0)
+        return await super().recv()
+
+
+class DroppingWebSocket(NetworkLikeWebSocket):
+    """Fails on the given receive, as a dropped connection would."""
+
+    def __init__(self, brain, drop_at):
+        super().__init__(brain)
+        self.received = 0
+        self.drop_at = drop_at
+
+    async def recv(self):
+        self.received += 1
+        if self.received == self.drop_at:
+            raise ConnectionResetError("dropped")
+        return await super().recv()
+
+
+async def run_session(connection, websocket):
+    await connection.send_register(websocket)
+    await connection.recv_acknowledge_register(websocket)
+    await connection.run_simulator_for_training(websocket)
+
+
+class VectorSimulatorTests(unittest.TestCase):
+    def run_sessions(self, simulator, episode_lengths, websockets=None,
+                     **connection_options):
+        connections = vector_simulator_connections(
+            "ws://localhost/v1/user/brain/sims/ws", "vector", simulator,
+            **connection_options)
+        brains = [
+            LoopbackBrain(PROPERTIES_SCHEMA, OUTPUT_SCHEMA, PREDICTION_SCHEMA,
+                          {'gain': 1.0}, 'distance',
+                          random_policy(PREDICTION_SCHEMA, seed=index),
+                          length, 2)
+            for index, length in enumerate(episode_lengths)]
+        websockets = websockets or [NetworkLikeWebSocket(brain)
+                                    for brain in brains]
+        self.results = asyncio.get_event_loop().run_until_complete(
+            asyncio.wait_for(asyncio.gather(*[
+                run_session(connection, websocket)
+                for connection, websocket in zip(connections, websockets)],
+                return_exceptions=True), 5))
+        self.connections = connections
+        return brains
+
+    def test_predictions_are_batched_across_sessions(self):
+        simulator = BatchSimulator(4)
+        brains = self.run_sessions(simulator, [5, 5, 5, 5])
+        self.assertEqual([2] * 4, [brain.episodes for brain in brains])
+        self.assertEqual(8, simulator.starts)
+        self.assertEqual(40, sum(simulator.batch_sizes))
+        self.assertEqual(4, max(simulator.batch_sizes))
+        self.assertEqual([{'gain': 1.0}] * 4, simulator.properties)
+
+    def test_sessions_with_shorter_episodes_do_not_block(self):
+        simulator = BatchSimulator(3)
+        brains = self.run_sessions(simulator, [2, 6, 4])
+        self.assertEqual([2, 2, 2], [brain.episodes for brain in brains])
+        self.assertEqual(24, sum(simulator.batch_sizes))
+
+    def test_sessions_ending_mid_episode_do_not_block(self):
+        simulator = BatchSimulator(3)
+        brains = [LoopbackBrain(PROPERTIES_SCHEMA, OUTPUT_SCHEMA,
+                                PREDICTION_SCHEMA, {'gain': 1.0}, 'distance',
+                                random_policy(PREDICTION_SCHEMA), 5, 2)
+                  for _ in range(3)]
+        websockets = [DroppingWebSocket(brain, 5) for brain in brains[:1]]
+        websockets += [NetworkLikeWebSocket(brain) for brain in brains[1:]]
+        self.run_sessions(simulator, [5, 5, 5], websockets)
+        self.assertIsInstance(self.results[0], ConnectionResetError)
+        self.assertEqual([None, None], self.results[1:])
+
+    def test_connection_options_are_passed_on(self):
+        simulator = BatchSimulator(2)
+        self.run_sessions(simulator, [2, 2], action_repeat=2)
+        self.assertEqual([2, 2], [connection.action_repeat
+                                  for connection in self.connections])
+        self.assertEqual(16, sum(simulator.batch_sizes))
+
+
+if __name__ == '__main__':
+    unittest.main()
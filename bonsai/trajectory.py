@@ -0,0 +1,278 @@
+"""
+This file contains TrajectoryRecorder, which appends the serialized
+SimulationSourceData of every state a BrainServerConnection sends to
+segment files, and TrajectoryReader, which memory maps those files for
+offline analysis.
+"""
+import logging
+import mmap
+import os
+import queue
+import threading
+
+from bonsai.common.record_file import RECORD_HEADER, read_record_headers
+
+
+log = logging.getLogger(__name__)
+
+# Records are tagged with their episode index.
+_SEGMENT_PREFIX = "segment-"
+_SEGMENT_SUFFIX = ".traj"
+_SEGMENT_NAME = _SEGMENT_PREFIX + "{:06d}" + _SEGMENT_SUFFIX
+
+
+class TrajectoryRecorder:
+    """
+    Appends records to segment files in directory. Records are buffered
+    in memory and written by a background thread once flush_size bytes
+    are pending, so record() does no file I/O. At most max_queued such
+    batches wait for the writer; beyond that, record() waits for the
+    disk to catch up rather than letting memory grow. A new segment is
+    started once the current one reaches segment_size bytes.
+
+    Records belong to the current episode, and start_episode() begins
+    the next one. A record made before the first start_episode(), or
+    after a terminal record, begins an episode of its own, so states
+    sent without START, e.g. in prediction, are still split into
+    episodes. Recording resumes after the last segment and episode
+    already in directory.
+    """
+
+    def __init__(self, directory, segment_size=64 << 20,
+                 flush_size=1 << 20, max_queued=64):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.flush_size = flush_size
+        os.makedirs(directory, exist_ok=True)
+        existing = _segment_paths(directory)
+        self._segment_index = 0
+        self._next_episode = 0
+        if existing:
+            self._segment_index = _segment_index(existing[-1]) + 1
+            self._next_episode = _last_episode(existing[-1]) + 1
+        # None until the next record or start_episode() begins one.
+        self.episode = None
+        self._segment = None
+        self._segment_bytes = 0
+        self._pending = []
+        self._pending_bytes = 0
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._error = None
+        self._writer = threading.Thread(
+            target=self._write_loop, name="TrajectoryRecorder", daemon=True)
+        self._writer.start()
+
+    def start_episode(self):
+        """
+        Starts a new episode for the following records.
+        """
+        self.episode = self._next_episode
+        self._next_episode += 1
+
+    def record(self, data, terminal=False):
+        """
+        Records the bytes-like object data as part of the current
+        episode. A terminal record ends the episode.
+        """
+        if self._writer is None:
+            raise ValueError("record() called after close()")
+        if self._error is not None:
+            raise self._error
+        if self.episode is None:
+            self.start_episode()
+        self._pending.append(RECORD_HEADER.pack(len(data), self.episode))
+        self._pending.append(bytes(data))
+        self._pending_bytes += RECORD_HEADER.size + len(data)
+        if terminal:
+            self.episode = None
+        if self._pending_bytes >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Hands the pending records to the writer thread.
+        """
+        if self._pending:
+            self._put(self._pending)
+            self._pending = []
+            self._pending_bytes = 0
+
+    def close(self):
+        """
+        Writes all pending records and stops the writer thread.
+        """
+        if self._writer is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self._put(None)
+            self._writer.join()
+            self._writer = None
+        if self._error is not None:
+            raise self._error
+
+    def _put(self, chunks):
+        # Waits while the queue is full, unless the writer has failed
+        # and stopped taking from it.
+        while self._error is None:
+            try:
+                self._queue.put(chunks, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+        if chunks is not None:
+            raise self._error
+
+    def _write_loop(self):
+        try:
+            while True:
+                chunks = self._queue.get()
+                if chunks is None:
+                    break
+                # Records are kept whole, so rotate between them.
+                for index in range(0, len(chunks), 2):
+                    size = len(chunks[index]) + len(chunks[index + 1])
+                    if self._segment is None or (
+                            self._segment_bytes and
+                            self._segment_bytes + size > self.segment_size):
+                        self._open_next_segment()
+                    self._segment.write(chunks[index])
+                    self._segment.write(chunks[index + 1])
+                    self._segment_bytes += size
+                self._segment.flush()
+        except Exception as e:
+            log.error("Trajectory recording failed: %s", e)
+            self._error = e
+        finally:
+            if self._segment is not None:
+                self._segment.close()
+
+    def _open_next_segment(self):
+        if self._segment is not None:
+            self._segment.close()
+        path = os.path.join(
+            self.directory, _SEGMENT_NAME.format(self._segment_index))
+        self._segment_index += 1
+        self._segment = open(path, 'wb')
+        self._segment_bytes = 0
+
+
+def _segment_index(path):
+    name = os.path.basename(path)
+    return int(name[len(_SEGMENT_PREFIX):-len(_SEGMENT_SUFFIX)])
+
+
+def _segment_paths(directory):
+    """
+    Returns the paths of the segments in directory, in index order.
+    """
+    names = [name for name in os.listdir(directory)
+             if name.startswith(_SEGMENT_PREFIX) and
+             name.endswith(_SEGMENT_SUFFIX) and
+             name[len(_SEGMENT_PREFIX):-len(_SEGMENT_SUFFIX)].isdigit()]
+    paths = [os.path.join(directory, name) for name in names]
+    return sorted(paths, key=_segment_index)
+
+
+def _last_episode(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    episode = -1
+    for _, _, episode in read_record_headers(data):
+        pass
+    return episode
+
+
+class TrajectoryReader:
+    """
+    Memory maps the segments written by a TrajectoryRecorder. Records
+    are returned as memoryviews onto the mapped files, so reading them
+    copies nothing; they can be parsed with
+    SimulationSourceData.FromString(). The views must not be used after
+    close().
+
+        reader = TrajectoryReader(directory)
+        for record in reader.episode(3):
+            state_data = SimulationSourceData.FromString(record)
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._files = []
+        self._mmaps = []
+        self._maps = []
+        # Per record: segment, payload offset, payload length, episode.
+        self._records = []
+        for path in _segment_paths(directory):
+            self._map_segment(path)
+
+        # Records of each episode, in order of first appearance.
+        self._episodes = []
+        self._episode_records = {}
+        for index, record in enumerate(self._records):
+            episode = record[3]
+            if episode not in self._episode_records:
+                self._episodes.append(episode)
+                self._episode_records[episode] = []
+            self._episode_records[episode].append(index)
+
+    def _map_segment(self, path):
+        if os.path.getsize(path) == 0:
+            return
+        f = open(path, 'rb')
+        self._files.append(f)
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._mmaps.append(mapped)
+        view = memoryview(mapped)
+        self._maps.append(view)
+        segment = len(self._maps) - 1
+        end = 0
+        for start, length, episode in read_record_headers(view):
+            self._records.append((segment, start, length, episode))
+            end = start + length
+        if end != len(view):
+            log.warning("Ignoring truncated record at the end of %s", path)
+
+    def __len__(self):
+        return len(self._records)
+
+    def record(self, index):
+        """
+        Returns the record at index across all segments.
+        """
+        segment, start, length, _ = self._records[index]
+        return self._maps[segment][start:start + length]
+
+    def __iter__(self):
+        for index in range(len(self._records)):
+            yield self.record(index)
+
+    @property
+    def episodes(self):
+        """
+        The recorded episode indices, in order.
+        """
+        return list(self._episodes)
+
+    def episode(self, episode):
+        """
+        Returns the records of episode, as a list of memoryviews.
+        """
+        return [self.record(index)
+                for index in self._episode_records.get(episode, [])]
+
+    def close(self):
+        """
+        Unmaps the segments. Raises BufferError if records returned by
+        the reader are still referenced.
+        """
+        for view in self._maps:
+            view.release()
+        self._maps = []
+        for mapped in self._mmaps:
+            mapped.close()
+        self._mmaps = []
+        for f in self._files:
+            f.close()
+        self._files = []
@@ -0,0 +1,273 @@
+"""
+This file contains VectorSimulator, an interface for simulators that
+step many environment instances per call, and run_vector_simulator,
+which connects each instance to the BRAIN as its own websocket session
+while batching the calls made on the simulator.
+"""
+import asyncio
+import logging
+
+from bonsai.brain_server_connection import BrainServerConnection
+from bonsai.brain_server_connection import set_event_loop_policy
+from bonsai.simulator import AsyncSimulator
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+log = logging.getLogger(__name__)
+
+
+def _as_batch(values):
+    if numpy is not None:
+        return numpy.asarray(values)
+    return list(values)
+
+
+def _item(value):
+    # Unwrap numpy scalars so protobuf field setters accept them.
+    item = getattr(value, 'item', None)
+    if item is not None and getattr(value, 'ndim', None) == 0:
+        return item()
+    return value
+
+
+class VectorSimulator:
+    """
+    Interface for client implemented simulators that hold num_envs
+    environment instances and step them together.
+
+    Methods taking indices receive a sequence of environment indices.
+    set_predictions() receives, for each prediction field, an array with
+    one entry per index. get_states() returns a dictionary of state
+    field names to arrays (or lists, e.g. of Luminance values) with one
+    entry per index, and get_rewards() and get_terminals() return one
+    value per index. Arrays are numpy arrays when numpy is installed
+    and lists otherwise.
+
+    VectorSimulators must implement set_predictions(), get_states(),
+    get_terminals() and, for each objective declared in inkling, a
+    method of that name taking indices. start(), stop(), reset() and
+    set_properties() are per environment and optional.
+    """
+    def __init__(self, num_envs):
+        self.num_envs = num_envs
+        self.properties = [{} for _ in range(num_envs)]
+
+    def set_properties(self, index, **kwargs):
+        self.properties[index] = kwargs
+
+    def set_predictions(self, indices, **predictions):
+        raise NotImplementedError()
+
+    def get_states(self, indices):
+        raise NotImplementedError()
+
+    def get_rewards(self, reward_name, indices):
+        return getattr(self, reward_name)(indices)
+
+    def get_terminals(self, indices):
+        raise NotImplementedError()
+
+    def start(self, index):
+        pass
+
+    def stop(self, index):
+        pass
+
+    def reset(self, index):
+        pass
+
+
+class _Batcher:
+    """
+    Collects the predictions and state requests of the per-environment
+    sessions and steps the VectorSimulator once every environment that
+    is in an episode is waiting for its next state. Environments that
+    are between episodes do not hold up the batch.
+    """
+
+    def __init__(self, simulator, flush_timeout=None):
+        self.simulator = simulator
+        self.flush_timeout = flush_timeout
+        self._active = set()
+        self._predictions = {}
+        self._waiting = {}
+        self._timer = None
+
+    def activate(self, index):
+        self._active.add(index)
+
+    def deactivate(self, index):
+        self._active.discard(index)
+        self._predictions.pop(index, None)
+        waiting = self._waiting.pop(index, None)
+        if waiting is not None:
+            waiting[0].cancel()
+        self._flush_if_ready()
+
+    def submit(self, index, predictions):
+        self._predictions[index] = predictions
+
+    async def observe(self, index, reward_name):
+        self._active.add(index)
+        future = asyncio.get_event_loop().create_future()
+        self._waiting[index] = (future, reward_name or None)
+        if not self._flush_if_ready() and self.flush_timeout is not None:
+            if self._timer is None:
+                self._timer = asyncio.get_event_loop().call_later(
+                    self.flush_timeout, self._flush)
+        return await future
+
+    def _flush_if_ready(self):
+        if self._waiting and len(self._waiting) >= len(self._active):
+            self._flush()
+            return True
+        return False
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        waiting, self._waiting = self._waiting, {}
+        if not waiting:
+            return
+        try:
+            results = self._step(waiting)
+        except Exception as e:
+            for future, _ in waiting.values():
+                future.set_exception(e)
+            return
+        for index, (future, _) in waiting.items():
+            future.set_result(results[index])
+
+    def _step(self, waiting):
+        simulator = self.simulator
+
+        # Apply the predictions received since the last batch.
+        stepped = sorted(i for i in waiting if i in self._predictions)
+        if stepped:
+            fields = self._predictions[stepped[0]].keys()
+            simulator.set_predictions(stepped, **{
+                name: _as_batch([self._predictions[i][name]
+                                 for i in stepped])
+                for name in fields})
+            for index in stepped:
+                del self._predictions[index]
+
+        # Gather states, rewards and terminals for every waiting session.
+        indices = sorted(waiting)
+        states = simulator.get_states(indices)
+        terminals = simulator.get_terminals(indices)
+
+        rewards = {}
+        reward_names = set(name for _, name in waiting.values())
+        for reward_name in reward_names:
+            if reward_name is None:
+                continue
+            group = [i for i in indices if waiting[i][1] == reward_name]
+            for index, reward in zip(
+                    group, simulator.get_rewards(reward_name, group)):
+                rewards[index] = _item(reward)
+
+        results = {}
+        for position, index in enumerate(indices):
+            state = {name: _item(values[position])
+                     for name, values in states.items()}
+            results[index] = (state, rewards.get(index, 0.0),
+                              bool(terminals[position]))
+        return results
+
+
+class _EnvironmentView(AsyncSimulator):
+    """
+    Presents one environment of a VectorSimulator to a
+    BrainServerConnection as an AsyncSimulator.
+    """
+
+    def __init__(self, batcher, index):
+        super().__init__()
+        self._batcher = batcher
+        self._simulator = batcher.simulator
+        self._index = index
+
+    async def set_properties(self, **kwargs):
+        self.properties = kwargs
+        self._simulator.set_properties(self._index, **kwargs)
+
+    async def start(self):
+        self._simulator.start(self._index)
+        self._batcher.activate(self._index)
+
+    async def stop(self):
+        self._simulator.stop(self._index)
+        self._batcher.deactivate(self._index)
+
+    async def reset(self):
+        self._simulator.reset(self._index)
+
+    async def notify_prediction_received(self, predictions):
+        self._last_actions = predictions
+        self._batcher.submit(self._index, predictions)
+
+    async def get_state_reward_terminal(self, reward_name):
+        return await self._batcher.observe(self._index, reward_name)
+
+    def end_session(self):
+        # Sessions can end mid-episode, without STOP, e.g. when the
+        # connection drops; they must not hold up the batch after that.
+        self._batcher.deactivate(self._index)
+
+
+class _EnvironmentConnection(BrainServerConnection):
+    """
+    A BrainServerConnection for an _EnvironmentView, which leaves the
+    batch whenever a session ends.
+    """
+
+    async def run_simulator_for_training(self, websocket):
+        try:
+            await super().run_simulator_for_training(websocket)
+        finally:
+            self.simulator.end_session()
+
+    async def run_simulator_for_prediction(self, websocket):
+        try:
+            await super().run_simulator_for_prediction(websocket)
+        finally:
+            self.simulator.end_session()
+
+
+def vector_simulator_connections(brain_url, simulator_name, simulator,
+                                 flush_timeout=None, **connection_options):
+    """
+    Returns one BrainServerConnection per environment of simulator,
+    created with connection_options. Each connection speaks the usual
+    per-session protocol, while calls on the VectorSimulator are batched
+    across all of them. If flush_timeout is set, a batch is stepped
+    after that many seconds even if some sessions are still waiting on
+    the server.
+    """
+    batcher = _Batcher(simulator, flush_timeout)
+    return [_EnvironmentConnection(brain_url, simulator_name,
+                                   _EnvironmentView(batcher, index),
+                                   **connection_options)
+            for index in range(simulator.num_envs)]
+
+
+def run_vector_simulator(simulator_name, simulator, brain_url,
+                         event_loop=None, flush_timeout=None,
+                         **connection_options):
+    """
+    Runs every environment of simulator against brain_url, each over
+    its own websocket session, until all sessions complete.
+    connection_options are passed to every BrainServerConnection.
+    """
+    set_event_loop_policy(event_loop)
+    connections = vector_simulator_connections(
+        brain_url, simulator_name, simulator, flush_timeout,
+        **connection_options)
+    asyncio.get_event_loop().run_until_complete(asyncio.gather(
+        *[connection.run_until_complete() for connection in connections]))
@@ -23,8 +23,8 @@ setup(
         'Topic :: Scientific/Engineering :: Artificial Intelligence',
         'License :: OSI Approved :: BSD License',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.4',
         'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3.6',
         'Natural Language :: English'
     ],
     keywords='bonsai',
@@ -33,6 +33,10 @@ setup(
         'protobuf>=3.0.0,<4',
         'bonsai_config>=0.2.0',
     ],
+    extras_require={
+        'numpy': ['numpy'],
+        'uvloop': ['uvloop'],
+    },
     dependency_links=[
         # Temporary until we get bonsai-config on PyPI
         ('git+https://github.com/BonsaiAI/bonsai-config.git'